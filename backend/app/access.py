@@ -0,0 +1,140 @@
+"""Materialized department -> document view access.
+
+`department_document_access` answers "which documents can department X see" with one
+indexed lookup instead of combining `Document.is_public`, `Document.department_id`,
+`DocumentViewPermission` and the grants a document inherits from the folders above it
+(`FolderViewPermission` through `folder_closure`) on every request. Documents in the trash
+(`Document.deleted_at`) have no rows, so access-filtered queries skip them without a predicate of
+their own. Endpoints that change any of those inputs call
+`sync_document_access` inside their own transaction; `check_access` / `rebuild_access`
+detect and repair drift:
+
+    python -m backend.app.access check
+    python -m backend.app.access rebuild
+"""
+import sys
+from sqlalchemy import select, delete, insert, literal, union, except_, Select
+from sqlalchemy.orm import Session
+import backend.app.models as models
+
+# Bucket holding every public document; mirrors the role_id == 0 admin convention.
+PUBLIC_DEPARTMENT_ID = 0
+
+
+def _expected_rows():
+    """Union of every (department_id, document_id) pair implied by the source tables."""
+    D = models.Document
+    P = models.DocumentViewPermission
+    C = models.FolderClosure
+    F = models.FolderViewPermission
+    # documents in the trash have no access rows at all
+    live = D.deleted_at.is_(None)
+    return union(
+        select(literal(PUBLIC_DEPARTMENT_ID).label("department_id"), D.document_id.label("document_id")).where(D.is_public == True, live),
+        select(D.department_id.label("department_id"), D.document_id.label("document_id")).where(live),
+        select(P.department_id.label("department_id"), P.document_id.label("document_id"))
+        .join(D, D.document_id == P.document_id).where(live),
+        # grants on the document's folder or any folder above it
+        select(F.department_id.label("department_id"), D.document_id.label("document_id"))
+        .join(C, C.descendant_id == D.folder_id).join(F, F.folder_id == C.ancestor_id).where(live),
+    )
+
+
+def sync_document_access(db: Session, doc: models.Document) -> None:
+    """Recompute the access rows of a single document. Does not commit."""
+    sync_documents_access(db, [doc.document_id])
+
+
+def sync_documents_access(db: Session, document_ids) -> None:
+    """Recompute the access rows of a set of documents with one DELETE and one INSERT ... SELECT.
+    `document_ids` may also be a select of ids (e.g. every document of a folder subtree). Does not commit."""
+    A = models.DepartmentDocumentAccess
+    if not isinstance(document_ids, Select):
+        document_ids = list(document_ids)
+        if not document_ids:
+            return
+    # make pending grant/revoke/publicity changes visible to the query below
+    db.flush()
+    expected = _expected_rows().subquery()
+    db.execute(delete(A).where(A.document_id.in_(document_ids)))
+    db.execute(insert(A).from_select(
+        ["department_id", "document_id"],
+        select(expected.c.department_id, expected.c.document_id).where(expected.c.document_id.in_(document_ids)),
+    ))
+
+
+def remove_department_access(db: Session, department_id: int) -> None:
+    """Drop every access row of a department that is being deleted. Does not commit."""
+    A = models.DepartmentDocumentAccess
+    db.execute(delete(A).where(A.department_id == department_id))
+
+
+def accessible_document_ids(user: models.User, include_edit: bool = True):
+    """Select of document ids visible to `user`, for use as `Document.document_id.in_(...)`.
+    include_edit adds documents the user holds an explicit edit permission on (edit implies view).
+    Documents in the trash are never included."""
+    A = models.DepartmentDocumentAccess
+    E = models.DocumentEditPermission
+    D = models.Document
+    dept_ids = [PUBLIC_DEPARTMENT_ID]
+    if getattr(user, "department_id", None) is not None:
+        dept_ids.append(user.department_id)
+    q = select(A.document_id).where(A.department_id.in_(dept_ids))
+    if include_edit:
+        q = union(q, select(E.document_id).join(D, D.document_id == E.document_id)
+                  .where(E.user_id == user.user_id, D.deleted_at.is_(None)))
+    return q
+
+
+def check_access(db: Session, limit: int = 1000) -> dict:
+    """Compare the access table against the source tables.
+    Returns up to `limit` missing and extra (department_id, document_id) pairs each."""
+    A = models.DepartmentDocumentAccess
+    expected = _expected_rows().subquery()
+    expected_q = select(expected.c.department_id, expected.c.document_id)
+    actual_q = select(A.department_id, A.document_id)
+    missing = db.execute(except_(expected_q, actual_q).limit(limit)).all()
+    extra = db.execute(except_(actual_q, expected_q).limit(limit)).all()
+    return {
+        "missing": [{"department_id": d, "document_id": doc_id} for d, doc_id in missing],
+        "extra": [{"department_id": d, "document_id": doc_id} for d, doc_id in extra],
+    }
+
+
+def rebuild_access(db: Session) -> int:
+    """Repopulate the whole access table from the source tables. Does not commit.
+    Returns the number of rows written."""
+    A = models.DepartmentDocumentAccess
+    db.execute(delete(A))
+    expected = _expected_rows().subquery()
+    db.execute(insert(A).from_select(["department_id", "document_id"], select(expected.c.department_id, expected.c.document_id)))
+    return db.query(A).count()
+
+
+def main(argv: list[str]) -> int:
+    from backend.app.database import SessionLocal, init_db
+
+    if len(argv) != 1 or argv[0] not in ("check", "rebuild"):
+        print("usage: python -m backend.app.access check|rebuild", file=sys.stderr)
+        return 2
+    init_db()
+    db = SessionLocal()
+    try:
+        if argv[0] == "rebuild":
+            rows = rebuild_access(db)
+            db.commit()
+            print(f"rebuilt department_document_access: {rows} rows")
+            return 0
+        report = check_access(db)
+        print(f"missing: {len(report['missing'])}  extra: {len(report['extra'])}")
+        for row in report["missing"]:
+            print(f"  missing department={row['department_id']} document={row['document_id']}")
+        for row in report["extra"]:
+            print(f"  extra   department={row['department_id']} document={row['document_id']}")
+        return 1 if report["missing"] or report["extra"] else 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,574 @@
+"""Export and import of the whole repository as one streaming archive, for backups and for cloning an
+environment without dumping a database that holds every payload.
+
+    python -m backend.app.archive export backup.tar
+    python -m backend.app.archive export backup.tar --backfill             # hash old versions first
+    python -m backend.app.archive export backup-2.tar --since backup.tar     # only what changed since
+    python -m backend.app.archive export - | ssh clone 'python -m backend.app.archive import -'
+    python -m backend.app.archive import backup.tar --workers 8
+    python -m backend.app.archive manifest backup.tar
+
+An archive is a tar written and read front to back, so it can be piped:
+
+    manifest.json                        format, watermarks, tables with their columns and row counts
+    changes/00000001.jsonl.gz            (incremental) documents changed since the base export
+    tables/<table>/00000001.jsonl.gz     rows as JSON arrays in manifest column order, ARCHIVE_CHUNK_ROWS a member
+    blobs/<aa>/<sha256>                  every stored content once, named by its hash
+
+Version rows carry their content hash instead of their bytes, so a content stored by several versions
+(or linked to, see backend.app.dedup) is in the archive once. The export reads one snapshot
+(REPEATABLE READ on PostgreSQL) in keyset-paged chunks, with one payload in memory at a time. It writes
+nothing to the source: versions stored before hashes were recorded make it fail unless --backfill asks
+to hash them first (backend.app.dedup.backfill, which commits). The import bulk-upserts chunk by chunk
+(running it again after an interruption is safe) and writes payloads on ARCHIVE_IMPORT_WORKERS threads,
+into the database for hot versions and into the configured cold store for cold ones, with at most
+ARCHIVE_IMPORT_MEMORY_BYTES of payloads read and waiting; a larger one is written alone, once those
+before it are done. Primary keys are kept; PostgreSQL sequences are moved past them. The target should
+not be serving while it imports.
+
+With --since (the previous archive; only its manifest is read) the export holds the changes after it:
+users, departments, roles, tags, folders and retention policies whole (they are small; rows missing
+from them are deleted on import), documents with their versions, tags, grants and access rows only
+for the documents the change log (backend.app.changelog) names since, together with the ids of their
+versions so that purged ones are dropped, the change log and audit log past the previous watermarks,
+previews created since, and the contents of the versions added since. Import the full archive into an
+empty database, then the incremental ones in order. Resumable upload sessions are not exported (their
+chunks are staged on local disk).
+"""
+import argparse
+import base64
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import sys
+import tarfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from sqlalchemy import Date, DateTime, Integer, LargeBinary, delete, func, select, text, tuple_, update
+from sqlalchemy.orm import Session
+import backend.app.models as models
+from backend.app.database import Base, insert_ignore, upsert
+from backend.app.changelog import head as changelog_head
+from backend.app.dedup import backfill
+from backend.app.storage import HOT, COLD, cold_store, delete_cold_objects, peek_version_data
+
+logger = logging.getLogger("backend.app.archive")
+
+FORMAT = 1
+ARCHIVE_CHUNK_ROWS = int(os.getenv("ARCHIVE_CHUNK_ROWS", 5000))
+ARCHIVE_IMPORT_WORKERS = int(os.getenv("ARCHIVE_IMPORT_WORKERS", 4))
+# Payload bytes an import holds at once, read and waiting for the writers
+ARCHIVE_IMPORT_MEMORY_BYTES = int(os.getenv("ARCHIVE_IMPORT_MEMORY_BYTES", 256 * 1024 * 1024))
+BLOB_PAGE_SIZE = 500
+# Changed documents per member of changes/ (each names its versions)
+CHANGES_CHUNK = 500
+
+# Exported whole every time
+GLOBAL_TABLES = ("roles", "departments", "users", "tags", "folders", "folder_closure", "folder_view_permissions",
+                 "retention_policies")
+# Rows of the changed documents only, in incremental exports
+DOCUMENT_TABLES = ("documents", "document_versions", "document_tags", "document_view_permissions",
+                   "document_edit_permissions", "department_document_access")
+# Append-only: rows past the previous export's watermark (table -> id column, also the watermark's name)
+APPEND_TABLES = {"document_changes": "change_id", "audit_log": "event_id"}
+PREVIEW_TABLE = "content_previews"
+# Where the target keeps a version's bytes is its own business: set on insert, never overwritten
+STORAGE_COLUMNS = ("file_data", "storage_tier", "storage_key", "last_accessed_at")
+
+
+class ArchiveError(Exception):
+    """An archive that cannot be written or imported here; the message says why."""
+
+
+def _tables(base: dict | None, marks: dict):
+    """(table, columns, criteria, keyset order) of everything exported, parents before children."""
+    C = models.DocumentChange
+    changed = None
+    if base is not None:
+        changed = (select(C.document_id)
+                   .where(C.change_id > base["change_id"], C.change_id <= marks["change_id"]).distinct())
+    for table in Base.metadata.sorted_tables:
+        name = table.name
+        criteria = []
+        if name in DOCUMENT_TABLES:
+            if changed is not None:
+                criteria.append(table.c.document_id.in_(changed))
+        elif name in APPEND_TABLES:
+            column = table.c[APPEND_TABLES[name]]
+            criteria.append(column <= marks[column.name])
+            if base is not None:
+                criteria.append(column > base[column.name])
+        elif name == PREVIEW_TABLE:
+            if base is not None:
+                # previews committed while the base was exported are missed; the generator redoes them
+                criteria.append(table.c.created_at >= datetime.fromisoformat(base["exported_at"]))
+        elif name not in GLOBAL_TABLES:
+            continue
+        columns = [c for c in table.columns if not (name == "document_versions" and c.name == "file_data")]
+        order = list(table.primary_key.columns)
+        if name == "folders":
+            # parents before children, whatever their ids
+            F = models.FolderClosure
+            level = select(func.max(F.depth)).where(F.descendant_id == table.c.folder_id).scalar_subquery()
+            order = [level, table.c.folder_id]
+        yield table, columns, criteria, order
+
+
+def _chunks(db: Session, columns: list, criteria: list, order: list, size: int):
+    """Rows in chunks of `size`, keyset-paged on `order`."""
+    after = None
+    n = len(columns)
+    while True:
+        q = select(*columns, *order).where(*criteria)
+        if after is not None:
+            q = q.where(tuple_(*order) > tuple_(*after))
+        rows = db.execute(q.order_by(*order).limit(size)).all()
+        if not rows:
+            return
+        after = rows[-1][n:]
+        yield [row[:n] for row in rows]
+        if len(rows) < size:
+            return
+
+
+def _encode(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (bytes, memoryview)):
+        return base64.b64encode(bytes(value)).decode()
+    raise TypeError(f"cannot archive {type(value).__name__}")
+
+
+def _jsonl(records) -> bytes:
+    return gzip.compress("".join(json.dumps(r, default=_encode, separators=(",", ":")) + "\n" for r in records).encode(),
+                         compresslevel=6)
+
+
+def _add(tar: tarfile.TarFile, name: str, data: bytes) -> None:
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _begin_snapshot(db: Session) -> None:
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    elif dialect == "sqlite":
+        # pysqlite only opens transactions for writes; an open read transaction is what pins the snapshot
+        db.execute(text("BEGIN"))
+
+
+def _blob_criteria(base: dict | None) -> list:
+    V = models.DocumentVersion
+    criteria = [V.storage_tier.in_((HOT, COLD)), V.content_sha256.isnot(None)]
+    if base is not None:
+        criteria.append(V.version_id > base["version_id"])
+    return criteria
+
+
+def _blobs(db: Session, base: dict | None):
+    """(hash, bytes) of every content stored by a version in the export, one in memory at a time."""
+    V = models.DocumentVersion
+    after = ""
+    while True:
+        page = (db.query(V.content_sha256, func.min(V.version_id))
+                .filter(*_blob_criteria(base), V.content_sha256 > after)
+                .group_by(V.content_sha256).order_by(V.content_sha256).limit(BLOB_PAGE_SIZE).all())
+        if not page:
+            return
+        after = page[-1][0]
+        for digest, version_id in page:
+            tier, key, data = db.query(V.storage_tier, V.storage_key, V.file_data).filter(V.version_id == version_id).one()
+            if tier == COLD:
+                try:
+                    data = cold_store().get(key)
+                except KeyError:
+                    # re-warmed since the snapshot was taken, which removed the cold copy
+                    data = _fresh_payload(version_id)
+            yield digest, data or b""
+
+
+def _fresh_payload(version_id: int) -> bytes:
+    from backend.app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        return peek_version_data(db, version_id)
+    finally:
+        db.close()
+
+
+def _changes(db: Session, base: dict, marks: dict, size: int = CHANGES_CHUNK):
+    """Chunks of {"document_id", "versions"} (or "deleted": true) for the documents changed since `base`."""
+    C = models.DocumentChange
+    D = models.Document
+    V = models.DocumentVersion
+    after = 0
+    while True:
+        ids = [r[0] for r in (db.query(C.document_id)
+                              .filter(C.change_id > base["change_id"], C.change_id <= marks["change_id"], C.document_id > after)
+                              .distinct().order_by(C.document_id).limit(size).all())]
+        if not ids:
+            return
+        after = ids[-1]
+        live = {r[0] for r in db.query(D.document_id).filter(D.document_id.in_(ids))}
+        versions: dict[int, list[int]] = {}
+        for document_id, version_id in (db.query(V.document_id, V.version_id)
+                                        .filter(V.document_id.in_(ids)).order_by(V.version_id)):
+            versions.setdefault(document_id, []).append(version_id)
+        yield [{"document_id": i, "versions": versions.get(i, [])} if i in live else {"document_id": i, "deleted": True}
+               for i in ids]
+
+
+def export(db: Session, out, since: dict | None = None, chunk_rows: int = ARCHIVE_CHUNK_ROWS,
+           backfill_hashes: bool = False) -> dict:
+    """Write an archive to the binary file `out`; with `since` (the manifest of an earlier export) only
+    what changed after it. Returns the manifest. Writes to the database only with `backfill_hashes`."""
+    if since is not None and since.get("format") != FORMAT:
+        raise ArchiveError(f"cannot export changes since an archive of format {since.get('format')}")
+    if backfill_hashes:
+        # hashes are what payloads are archived by (commits)
+        backfill(db)
+    _begin_snapshot(db)
+    V = models.DocumentVersion
+    unhashed = db.query(func.count(V.version_id)).filter(V.content_sha256.is_(None)).scalar()
+    if unhashed:
+        db.rollback()
+        raise ArchiveError(f"{unhashed} versions were stored before content hashes were recorded; "
+                           "export with --backfill to hash them first (this writes to the database)")
+    base = since["watermarks"] if since is not None else None
+    marks = {
+        "change_id": changelog_head(db),
+        "version_id": db.query(func.max(V.version_id)).scalar() or 0,
+        "event_id": db.query(func.max(models.AuditEvent.event_id)).scalar() or 0,
+        "exported_at": datetime.now(timezone.utc).isoformat(),
+    }
+    tables = list(_tables(base, marks))
+    blobs = (db.query(V.content_sha256.label("digest"), func.max(V.file_size).label("size"))
+             .filter(*_blob_criteria(base)).group_by(V.content_sha256).subquery())
+    n_blobs, blob_bytes = db.query(func.count(), func.coalesce(func.sum(blobs.c.size), 0)).select_from(blobs).one()
+    manifest = {
+        "format": FORMAT,
+        "export_id": uuid.uuid4().hex,
+        "base": since["export_id"] if since is not None else None,
+        "base_watermarks": base,
+        "watermarks": marks,
+        "database": db.get_bind().dialect.name,
+        "tables": {t.name: {"columns": [c.name for c in columns],
+                            "rows": db.execute(select(func.count()).select_from(t).where(*criteria)).scalar()}
+                   for t, columns, criteria, _ in tables},
+        "blobs": {"count": n_blobs, "bytes": int(blob_bytes)},
+    }
+    with tarfile.open(fileobj=out, mode="w|") as tar:
+        _add(tar, "manifest.json", json.dumps(manifest, indent=1).encode())
+        if base is not None:
+            for n, chunk in enumerate(_changes(db, base, marks), 1):
+                _add(tar, f"changes/{n:08d}.jsonl.gz", _jsonl(chunk))
+        for table, columns, criteria, order in tables:
+            for n, chunk in enumerate(_chunks(db, columns, criteria, order, chunk_rows), 1):
+                _add(tar, f"tables/{table.name}/{n:08d}.jsonl.gz", _jsonl(list(row) for row in chunk))
+        for digest, data in _blobs(db, base):
+            _add(tar, f"blobs/{digest[:2]}/{digest}", data)
+    db.rollback()
+    return manifest
+
+
+def read_manifest(f) -> dict:
+    """The manifest of the archive in the binary file `f` (its first member)."""
+    with tarfile.open(fileobj=f, mode="r|") as tar:
+        member = tar.next()
+        if member is None or member.name != "manifest.json":
+            raise ArchiveError("not an archive: manifest.json is not its first member")
+        return json.loads(tar.extractfile(member).read())
+
+
+def _decoders(table, columns: list[str]) -> list:
+    decoders = []
+    for name in columns:
+        if name not in table.c:
+            raise ArchiveError(f"column {table.name}.{name} of the archive does not exist here; migrate the schema first")
+        kind = table.c[name].type
+        if isinstance(kind, LargeBinary):
+            decoders.append(base64.b64decode)
+        elif isinstance(kind, DateTime):
+            decoders.append(datetime.fromisoformat)
+        elif isinstance(kind, Date):
+            decoders.append(date.fromisoformat)
+        else:
+            decoders.append(None)
+    return decoders
+
+
+def _apply_changes(db: Session, records: list[dict], report: dict) -> None:
+    """Drop what the changed documents no longer have: versions purged since (handing over linked bytes
+    first, as the trash does), and their tags, grants and access rows, which the tables bring back.
+    Documents gone from the source go with all their rows. Commits."""
+    from backend.app.trash import _payload_rows, _delete_versions
+
+    V = models.DocumentVersion
+    ids = [r["document_id"] for r in records]
+    keep = {v for r in records for v in r.get("versions", ())}
+    gone = [r["document_id"] for r in records if r.get("deleted")]
+    doomed = [r[0] for r in db.query(V.version_id).filter(V.document_id.in_(ids)) if r[0] not in keep]
+    cold_keys = []
+    if doomed:
+        _, cold_keys = _delete_versions(db, _payload_rows(db, V.version_id.in_(doomed)))
+    for model in (models.DocumentTag, models.DocumentViewPermission, models.DocumentEditPermission,
+                  models.DepartmentDocumentAccess):
+        db.execute(delete(model).where(model.document_id.in_(ids)))
+    if gone:
+        report["documents_removed"] += db.execute(
+            delete(models.Document).where(models.Document.document_id.in_(gone))).rowcount
+    db.commit()
+    delete_cold_objects(cold_keys)
+    report["versions_removed"] += len(doomed)
+
+
+def _write_blob(digest: str, data: bytes, after_version_id: int) -> None:
+    """Give the content to the imported versions storing it: hot ones in the database, cold ones in the
+    cold store under their key."""
+    from backend.app.database import SessionLocal
+
+    V = models.DocumentVersion
+    db = SessionLocal()
+    try:
+        db.execute(update(V).where(V.content_sha256 == digest, V.storage_tier == HOT, V.file_data.is_(None),
+                                   V.version_id > after_version_id).values(file_data=data))
+        for (key,) in db.query(V.storage_key).filter(V.content_sha256 == digest, V.storage_tier == COLD,
+                                                     V.version_id > after_version_id):
+            cold_store().put(key, data)
+        db.commit()
+    finally:
+        db.close()
+
+
+class _ByteBudget:
+    """A semaphore counting bytes: acquire(n) waits until n more fit under `limit`. More than `limit`
+    is taken as all of it, so that it waits for everything else and then goes alone."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._free = limit
+        self._cond = threading.Condition()
+
+    def acquire(self, n: int) -> int:
+        """Take `n` bytes (at most `limit`); returns what to release."""
+        n = min(n, self.limit)
+        with self._cond:
+            self._cond.wait_for(lambda: self._free >= n)
+            self._free -= n
+        return n
+
+    def release(self, n: int) -> None:
+        with self._cond:
+            self._free += n
+            self._cond.notify_all()
+
+
+def _import_blob(tar: tarfile.TarFile, member: tarfile.TarInfo, digest: str, after_version_id: int,
+                 pool: ThreadPoolExecutor, budget: _ByteBudget, done, report: dict) -> None:
+    """Read one content once it fits in `budget` and hand it to the pool; one larger than the whole
+    budget waits for the pool to drain and is written here."""
+    size = budget.acquire(member.size)
+    try:
+        data = tar.extractfile(member).read()
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ArchiveError(f"content {digest} is corrupt")
+        if member.size > budget.limit:
+            _write_blob(digest, data, after_version_id)
+    except BaseException:
+        budget.release(size)
+        raise
+    if member.size > budget.limit:
+        budget.release(size)
+    else:
+        pool.submit(_write_blob, digest, data, after_version_id).add_done_callback(lambda future: done(future, size))
+    report["blobs"] += 1
+    report["blob_bytes"] += len(data)
+
+
+def _remove_missing(db: Session, table, keys: set, report: dict) -> None:
+    """Delete the rows of a table exported whole that the archive does not have. Commits."""
+    pk = list(table.primary_key.columns)
+    doomed = [tuple(r) for r in db.execute(select(*pk)) if tuple(r) not in keys]
+    for i in range(0, len(doomed), CHANGES_CHUNK):
+        db.execute(delete(table).where(tuple_(*pk).in_(doomed[i:i + CHANGES_CHUNK])))
+    db.commit()
+    report["rows_removed"] += len(doomed)
+
+
+def _move_sequences(db: Session, tables) -> None:
+    """Point PostgreSQL sequences past the imported ids, so that new rows do not collide with them."""
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    for table in tables:
+        pk = list(table.primary_key.columns)
+        if len(pk) != 1 or not isinstance(pk[0].type, Integer):
+            continue
+        db.execute(text(f"SELECT setval(pg_get_serial_sequence(:t, :c), COALESCE((SELECT MAX({pk[0].name}) FROM {table.name}), 0) + 1, false)"),
+                   {"t": table.name, "c": pk[0].name})
+    db.commit()
+
+
+def import_archive(db: Session, f, workers: int = ARCHIVE_IMPORT_WORKERS,
+                   memory_bytes: int = ARCHIVE_IMPORT_MEMORY_BYTES) -> dict:
+    """Load the archive in the binary file `f` (read front to back), with at most `memory_bytes` of
+    payloads in memory (or the one payload, if larger). Returns a report."""
+    if db.get_bind().dialect.name == "sqlite":
+        # one writer at a time anyway
+        workers = 1
+    tables = {t.name: t for t in Base.metadata.sorted_tables}
+    report = {"tables": {}, "blobs": 0, "blob_bytes": 0, "versions_removed": 0, "documents_removed": 0,
+              "rows_removed": 0, "versions_without_payload": 0}
+    manifest = None
+    seen_keys: dict[str, set] = {}
+    errors: list[BaseException] = []
+    budget = _ByteBudget(memory_bytes)
+
+    def done(future, size):
+        budget.release(size)
+        if future.exception() is not None:
+            errors.append(future.exception())
+
+    with tarfile.open(fileobj=f, mode="r|") as tar, ThreadPoolExecutor(workers, thread_name_prefix="archive-import") as pool:
+        for member in tar:
+            if not member.isfile():
+                continue
+            kind, _, rest = member.name.partition("/")
+            if kind == "blobs" and manifest is not None:
+                # the bytes are read once they fit in the budget
+                _import_blob(tar, member, rest.split("/")[-1], after_version_id, pool, budget, done, report)
+                if errors:
+                    raise errors[0]
+                continue
+            data = tar.extractfile(member).read()
+            if manifest is None:
+                if member.name != "manifest.json":
+                    raise ArchiveError("not an archive: manifest.json is not its first member")
+                manifest = json.loads(data)
+                if manifest.get("format") != FORMAT:
+                    raise ArchiveError(f"unsupported archive format {manifest.get('format')}")
+                empty = db.query(models.User.user_id).first() is None and db.query(models.Document.document_id).first() is None
+                if manifest["base"] is None and not empty:
+                    raise ArchiveError("a full archive can only be imported into an empty database")
+                if manifest["base"] is not None and empty:
+                    raise ArchiveError(f"incremental archive: import its base ({manifest['base']}) and those before it first")
+                after_version_id = (manifest["base_watermarks"] or {}).get("version_id", 0)
+                continue
+            if errors:
+                raise errors[0]
+            if kind == "changes":
+                _apply_changes(db, [json.loads(line) for line in gzip.decompress(data).splitlines()], report)
+            elif kind == "tables":
+                name = rest.split("/")[0]
+                if name not in tables:
+                    raise ArchiveError(f"table {name} of the archive does not exist here; migrate the schema first")
+                table = tables[name]
+                columns = manifest["tables"][name]["columns"]
+                decoders = _decoders(table, columns)
+                rows = []
+                for line in gzip.decompress(data).splitlines():
+                    values = json.loads(line)
+                    rows.append({c: v if d is None or v is None else d(v) for c, d, v in zip(columns, decoders, values)})
+                if name in APPEND_TABLES or name == PREVIEW_TABLE:
+                    insert_ignore(db, table, rows)
+                else:
+                    pk = {c.name for c in table.primary_key.columns}
+                    fixed = pk | set(STORAGE_COLUMNS) if name == "document_versions" else pk
+                    upsert(db, table, rows, [c for c in columns if c not in fixed])
+                db.commit()
+                if name in GLOBAL_TABLES and manifest["base"] is not None:
+                    pk = [c.name for c in table.primary_key.columns]
+                    seen_keys.setdefault(name, set()).update(tuple(r[c] for c in pk) for r in rows)
+                report["tables"][name] = report["tables"].get(name, 0) + len(rows)
+    if errors:
+        raise errors[0]
+    if manifest is None:
+        raise ArchiveError("empty archive")
+    if manifest["base"] is not None:
+        # children first
+        for name in reversed([n for n in tables if n in GLOBAL_TABLES]):
+            _remove_missing(db, tables[name], seen_keys.get(name, set()), report)
+    _move_sequences(db, [tables[name] for name in manifest["tables"] if name in tables])
+    V = models.DocumentVersion
+    report["versions_without_payload"] = (db.query(func.count(V.version_id))
+                                          .filter(V.storage_tier == HOT, V.file_data.is_(None), V.version_id > after_version_id)
+                                          .scalar())
+    return report
+
+
+def _open(path: str, mode: str):
+    if path == "-":
+        return sys.stdout.buffer if mode == "wb" else sys.stdin.buffer
+    return open(path, mode)
+
+
+def main(argv: list[str]) -> int:
+    from backend.app.database import SessionLocal, init_db
+
+    p = argparse.ArgumentParser(prog="python -m backend.app.archive",
+                                description="Export the repository to a streaming archive, or import one.")
+    sub = p.add_subparsers(dest="command", required=True)
+    e = sub.add_parser("export", help="write an archive ('-' for stdout)")
+    e.add_argument("path")
+    e.add_argument("--since", metavar="ARCHIVE", help="only what changed since this earlier export")
+    e.add_argument("--chunk-rows", type=int, default=ARCHIVE_CHUNK_ROWS)
+    e.add_argument("--backfill", action="store_true",
+                   help="first hash versions stored before hashes were recorded (writes to the database)")
+    i = sub.add_parser("import", help="load an archive ('-' for stdin)")
+    i.add_argument("path")
+    i.add_argument("--workers", type=int, default=ARCHIVE_IMPORT_WORKERS, help="threads writing payloads")
+    i.add_argument("--memory-bytes", type=int, default=ARCHIVE_IMPORT_MEMORY_BYTES,
+                   help="payload bytes held at once, read and waiting")
+    m = sub.add_parser("manifest", help="print the manifest of an archive")
+    m.add_argument("path")
+    args = p.parse_args(argv)
+    # with the archive on stdout, the summary goes to stderr
+    log = sys.stderr if args.path == "-" else sys.stdout
+
+    try:
+        if args.command == "manifest":
+            with _open(args.path, "rb") as f:
+                print(json.dumps(read_manifest(f), indent=1))
+            return 0
+        since = None
+        if args.command == "export" and args.since:
+            with open(args.since, "rb") as f:
+                since = read_manifest(f)
+        init_db()
+        db = SessionLocal()
+        try:
+            if args.command == "export":
+                with _open(args.path, "wb") as f:
+                    manifest = export(db, f, since=since, chunk_rows=args.chunk_rows, backfill_hashes=args.backfill)
+                rows = sum(t["rows"] for t in manifest["tables"].values())
+                print(f"exported {rows} rows and {manifest['blobs']['count']} contents "
+                      f"({manifest['blobs']['bytes']} bytes) as {manifest['export_id']}"
+                      + (f", changes since {manifest['base']}" if manifest["base"] else ""), file=log)
+            else:
+                with _open(args.path, "rb") as f:
+                    report = import_archive(db, f, workers=args.workers, memory_bytes=args.memory_bytes)
+                print(f"imported {sum(report['tables'].values())} rows and {report['blobs']} contents "
+                      f"({report['blob_bytes']} bytes); removed {report['documents_removed']} documents, "
+                      f"{report['versions_removed']} versions and {report['rows_removed']} other rows", file=log)
+                if report["versions_without_payload"]:
+                    print(f"warning: {report['versions_without_payload']} versions have no content", file=sys.stderr)
+                    return 1
+        finally:
+            db.close()
+    except ArchiveError as exc:
+        print(f"error: {exc}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,394 @@
+"""Audit log: who downloaded or changed which document, written off the request path.
+
+Endpoints call record() after their commit. It only appends to an in-memory buffer; a background
+thread writes the buffer in batches of AUDIT_BATCH_SIZE, every AUDIT_FLUSH_INTERVAL_SECONDS or as soon
+as a batch is full, to the sink chosen by AUDIT_SINK:
+
+    table   the append-only `audit_log` table (default), which admins query through GET /admin/audit
+    jsonl   one JSON object per line, in files under AUDIT_LOG_DIR; a new file is started every UTC day
+            and at AUDIT_FILE_MAX_BYTES (for shipping to a log pipeline)
+    off     nothing is recorded
+
+The buffer holds at most AUDIT_BUFFER_SIZE events. When the sink falls behind and the buffer is full,
+record() appends the overflow to a spill file under AUDIT_SPILL_DIR instead: requests pay for a local
+file append rather than a database round trip, and nothing is dropped. Batches the sink rejects are
+spilled as well. The writer replays spill files before the buffer, so once the sink accepts writes
+again the backlog drains first; files left behind by a worker that died are replayed by the next one
+to start. Events keep the time they happened, so late writes still sort where they belong. The spill
+directory must be local to the host (workers are told apart by pid). By hand:
+
+    python -m backend.app.audit flush     # replay spill files, e.g. after an outage
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Iterable
+from sqlalchemy import insert, inspect, tuple_
+from sqlalchemy.orm import Session
+import backend.app.models as models
+from backend.app.metrics import AUDIT_EVENTS, AUDIT_BUFFERED
+
+logger = logging.getLogger("backend.app.audit")
+
+AUDIT_SINK = os.getenv("AUDIT_SINK", "table").lower()
+if AUDIT_SINK not in ("table", "jsonl", "off"):
+    raise ValueError(f"unknown AUDIT_SINK: {AUDIT_SINK!r}")
+AUDIT_LOG_DIR = os.getenv("AUDIT_LOG_DIR", os.path.normpath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "data", "audit")))
+AUDIT_SPILL_DIR = os.getenv("AUDIT_SPILL_DIR", os.path.join(AUDIT_LOG_DIR, "spill"))
+AUDIT_FILE_MAX_BYTES = int(os.getenv("AUDIT_FILE_MAX_BYTES", 64 * 1024 ** 2))
+AUDIT_BUFFER_SIZE = int(os.getenv("AUDIT_BUFFER_SIZE", 10000))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", 500))
+AUDIT_FLUSH_INTERVAL_SECONDS = float(os.getenv("AUDIT_FLUSH_INTERVAL_SECONDS", 1))
+AUDIT_PAGE_SIZE = 100
+AUDIT_MAX_PAGE_SIZE = 1000
+
+
+def _dumps(event: dict) -> str:
+    return json.dumps({**event, "occurred_at": event["occurred_at"].isoformat()}, separators=(",", ":"))
+
+
+def _loads(line: str) -> dict:
+    event = json.loads(line)
+    event["occurred_at"] = datetime.fromisoformat(event["occurred_at"])
+    return event
+
+
+class TableSink:
+    """Inserts batches into `audit_log`, one transaction each."""
+
+    def write(self, events: list[dict]) -> None:
+        from backend.app.database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            db.execute(insert(models.AuditEvent.__table__), events)
+            db.commit()
+        finally:
+            db.close()
+
+
+class JsonlSink:
+    """Appends batches to audit-<UTC time>-<pid>.jsonl under `directory`, starting a new file every UTC
+    day and once the current one reaches `max_bytes`. Only the writer calls it, one batch at a time."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._path = None
+        self._day = None
+        self._size = 0
+
+    def write(self, events: list[dict]) -> None:
+        now = datetime.now(timezone.utc)
+        if self._path is None or self._day != now.date() or self._size >= self.max_bytes:
+            os.makedirs(self.directory, exist_ok=True)
+            self._path = os.path.join(self.directory, f"audit-{now:%Y%m%dT%H%M%S%f}-{os.getpid()}.jsonl")
+            self._day = now.date()
+            self._size = 0
+        data = "".join(_dumps(e) + "\n" for e in events).encode()
+        with open(self._path, "ab") as f:
+            f.write(data)
+        self._size += len(data)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SpillFiles:
+    """Events that could not wait for the sink, as JSONL files in `directory`.
+
+    A worker appends to spill-<pid>.jsonl. Before replaying it renames that file to
+    spill-<pid>-<ns>.ready, and claims each .ready file (its own or another worker's) by renaming it to
+    .replaying-<pid>, so every file is replayed by exactly one worker."""
+
+    _orphan = re.compile(r"spill-(\d+)\.jsonl|(spill-\d+-\d+)\.replaying-(\d+)")
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _current(self) -> str:
+        return os.path.join(self.directory, f"spill-{os.getpid()}.jsonl")
+
+    def append(self, events: list[dict]) -> None:
+        data = "".join(_dumps(e) + "\n" for e in events).encode()
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._current(), "ab") as f:
+                f.write(data)
+
+    def _seal(self, path: str, pid: int) -> None:
+        try:
+            os.replace(path, os.path.join(self.directory, f"spill-{pid}-{time.time_ns()}.ready"))
+        except FileNotFoundError:
+            pass
+
+    def adopt_orphans(self) -> None:
+        """Make the files of workers that are gone replayable."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            m = self._orphan.fullmatch(name)
+            if m is None:
+                continue
+            pid = int(m.group(1) or m.group(3))
+            if pid == os.getpid() or _pid_alive(pid):
+                continue
+            path = os.path.join(self.directory, name)
+            if m.group(1):
+                self._seal(path, pid)
+            else:
+                try:
+                    os.replace(path, os.path.join(self.directory, m.group(2) + ".ready"))
+                except FileNotFoundError:
+                    pass
+
+    def replay(self, write, batch_size: int) -> int:
+        """Write every .ready file (and this worker's current file) with `write`, oldest first, and
+        delete it. On failure the rest of the file is put back for the next attempt and the error raised.
+        Returns the number of events written."""
+        with self._lock:
+            self._seal(self._current(), os.getpid())
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith(".ready")]
+        except FileNotFoundError:
+            return 0
+        # spill-<pid>-<ns>.ready: oldest first
+        names.sort(key=lambda n: int(n[:-len(".ready")].rsplit("-", 1)[1]))
+        written = 0
+        for name in names:
+            ready = os.path.join(self.directory, name)
+            claimed = f"{ready[:-len('.ready')]}.replaying-{os.getpid()}"
+            try:
+                os.replace(ready, claimed)
+            except FileNotFoundError:
+                # another worker claimed it
+                continue
+            events = []
+            with open(claimed, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        events.append(_loads(line))
+                    except ValueError:
+                        # a line cut short by a crash
+                        logger.warning("skipping unreadable line in %s", claimed)
+            for start in range(0, len(events), batch_size):
+                try:
+                    write(events[start:start + batch_size])
+                except Exception:
+                    with open(claimed, "w", encoding="utf-8") as f:
+                        f.writelines(_dumps(e) + "\n" for e in events[start:])
+                    os.replace(claimed, ready)
+                    raise
+                written += len(events[start:start + batch_size])
+            os.remove(claimed)
+        return written
+
+
+class AuditLog:
+    """Audit events buffered in memory and written to `sink` in batches by flush()."""
+
+    def __init__(self, sink, spill: SpillFiles, buffer_size: int = AUDIT_BUFFER_SIZE,
+                 batch_size: int = AUDIT_BATCH_SIZE):
+        self.sink = sink
+        self.spill = spill
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.wake = threading.Event()
+        self._pending: deque = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def buffered(self) -> int:
+        return len(self._pending)
+
+    def record(self, user_id: int | None, action: str, items: Iterable[tuple], version_id: int | None = None) -> None:
+        """Buffer one event per (document_id, detail) in `items`. Never blocks on the sink."""
+        if self.sink is None:
+            return
+        now = datetime.now(timezone.utc)
+        events = [{"occurred_at": now, "user_id": user_id, "action": action, "document_id": document_id,
+                   "version_id": version_id, "detail": detail} for document_id, detail in items]
+        if not events:
+            return
+        with self._lock:
+            room = max(0, self.buffer_size - len(self._pending))
+            self._pending.extend(events[:room])
+            overflow = events[room:]
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.wake.set()
+        if overflow:
+            self._spill(overflow)
+
+    def _spill(self, events: list[dict]) -> None:
+        try:
+            self.spill.append(events)
+        except Exception:
+            AUDIT_EVENTS.labels("dropped").inc(len(events))
+            logger.exception("could not spill %d audit events", len(events))
+            return
+        AUDIT_EVENTS.labels("spilled").inc(len(events))
+
+    def flush(self) -> int:
+        """Write spilled events, then buffered ones. Returns the number written. If the sink fails the
+        batch in hand is spilled, the rest stays buffered, and the error is raised."""
+        if self.sink is None:
+            return 0
+        with self._flush_lock:
+            written = self.spill.replay(self.sink.write, self.batch_size)
+            while True:
+                with self._lock:
+                    batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                if not batch:
+                    break
+                try:
+                    self.sink.write(batch)
+                except Exception:
+                    self._spill(batch)
+                    raise
+                written += len(batch)
+        if written:
+            AUDIT_EVENTS.labels("written").inc(written)
+        return written
+
+    def spill_pending(self) -> None:
+        """Move everything buffered to a spill file (on shutdown, when the sink is failing)."""
+        with self._lock:
+            events = list(self._pending)
+            self._pending.clear()
+        if events:
+            self._spill(events)
+
+
+def _sink():
+    if AUDIT_SINK == "table":
+        return TableSink()
+    if AUDIT_SINK == "jsonl":
+        return JsonlSink(AUDIT_LOG_DIR, AUDIT_FILE_MAX_BYTES)
+    return None
+
+
+audit_log = AuditLog(_sink(), SpillFiles(AUDIT_SPILL_DIR))
+AUDIT_BUFFERED.set_function(audit_log.buffered)
+
+
+def _user_id(user: models.User | int | None) -> int | None:
+    # from the identity map: after a commit, user.user_id would reload the expired user
+    if user is None or isinstance(user, int):
+        return user
+    identity = inspect(user).identity
+    return identity[0] if identity else user.user_id
+
+
+def record(user: models.User | int | None, action: str, document_ids: Iterable[int], detail: str | None = None,
+           version_id: int | None = None) -> None:
+    """Audit `action` by `user` on each document. Call it after the commit."""
+    audit_log.record(_user_id(user), action, ((d, detail) for d in document_ids), version_id)
+
+
+def record_pairs(user: models.User | None, action: str, pairs: Iterable[tuple[int, str | None]]) -> None:
+    """Audit `action` by `user` once per (document_id, detail), e.g. per pair of a batch grant."""
+    audit_log.record(_user_id(user), action, pairs)
+
+
+def query(db: Session, document_id: int | None = None, user_id: int | None = None, action: str | None = None,
+          since: datetime | None = None, until: datetime | None = None, before_id: int | None = None,
+          limit: int = AUDIT_PAGE_SIZE) -> tuple[list[tuple[models.AuditEvent, str | None]], bool]:
+    """A page of events, newest first, with the username of each event's user. Returns (rows, has_more)."""
+    A = models.AuditEvent
+    U = models.User
+    q = db.query(A, U.username).outerjoin(U, U.user_id == A.user_id)
+    if document_id is not None:
+        q = q.filter(A.document_id == document_id)
+    if user_id is not None:
+        q = q.filter(A.user_id == user_id)
+    if action is not None:
+        q = q.filter(A.action == action)
+    if since is not None:
+        q = q.filter(A.occurred_at >= since)
+    if until is not None:
+        q = q.filter(A.occurred_at < until)
+    if before_id is not None:
+        occurred_at = db.query(A.occurred_at).filter(A.event_id == before_id).scalar()
+        if occurred_at is None:
+            return [], False
+        q = q.filter(tuple_(A.occurred_at, A.event_id) < tuple_(occurred_at, before_id))
+    rows = q.order_by(A.occurred_at.desc(), A.event_id.desc()).limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
+
+
+def flush() -> bool:
+    """Flush the audit log from the calling thread. Returns False (and logs) if the sink failed; the
+    events are kept for the next attempt."""
+    try:
+        audit_log.flush()
+    except Exception:
+        logger.exception("audit log flush failed")
+        return False
+    return True
+
+
+def start_writer(interval: float = AUDIT_FLUSH_INTERVAL_SECONDS) -> threading.Event | None:
+    """Flush the audit log on a daemon thread, every `interval` seconds or when a batch is full. Returns
+    an Event that stops it (what is left is flushed by stop_writer)."""
+    if audit_log.sink is None:
+        return None
+    audit_log.spill.adopt_orphans()
+    stop = threading.Event()
+
+    def loop():
+        while not stop.is_set():
+            # 0: only when a batch is full
+            audit_log.wake.wait(interval if interval > 0 else None)
+            audit_log.wake.clear()
+            flush()
+
+    threading.Thread(target=loop, name="audit-writer", daemon=True).start()
+    return stop
+
+
+def stop_writer(stop: threading.Event | None) -> None:
+    if stop is None:
+        return
+    stop.set()
+    audit_log.wake.set()
+    if not flush():
+        # replayed by the next worker to start
+        audit_log.spill_pending()
+
+
+def main(argv: list[str]) -> int:
+    from backend.app.database import init_db
+
+    p = argparse.ArgumentParser(prog="python -m backend.app.audit", description="Maintain the audit log.")
+    p.add_argument("command", choices=["flush"])
+    p.parse_args(argv)
+    if audit_log.sink is None:
+        print("AUDIT_SINK is off")
+        return 1
+    init_db()
+    audit_log.spill.adopt_orphans()
+    print(f"wrote {audit_log.flush()} spilled audit events to the {AUDIT_SINK} sink")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,203 @@
+"""Document change log: which documents changed, in commit order, for incremental sync.
+
+Endpoints that change a document (uploads, publicity, tags, view/edit grants, retention deleting
+versions) call record_changes() inside their own transaction, right before committing. Clients read
+the log through GET /documents/changes with the cursor of their last page and get, per changed
+document they can see, its current state; documents whose access changed and that they can no longer
+see come back as removed. A client syncs in O(changes) instead of re-reading /documents/me:
+
+    cursor = GET /documents/changes                  -> {"cursor": head}, taken before the full fetch
+    GET /documents/me                                -> initial list
+    GET /documents/changes?cursor=<cursor>           -> changes, new cursor, has_more; repeat
+
+Cursors are change ids. On PostgreSQL, ids come from a sequence and are handed out before commit, so a
+reader could pass over an id whose transaction commits later. record_changes() therefore takes a
+transaction-level advisory lock: writers append one at a time, in commit order. The lock is held only
+from the append to the commit. SQLite serialises writers anyway.
+
+Compaction keeps the newest entry of every document and deletes the older entries once they are
+CHANGE_LOG_RETENTION_DAYS old. A client reading from any old cursor still sees every document that
+changed since, so cursors never expire; the log stays bounded by the number of documents. A
+background thread compacts every CHANGE_LOG_COMPACT_INTERVAL_SECONDS (0 disables it), or from the CLI:
+
+    python -m backend.app.changelog compact
+    python -m backend.app.changelog compact --days 7 --batch-size 500
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+from sqlalchemy import delete, update, func, or_, text
+from sqlalchemy.orm import Session
+import backend.app.models as models
+from backend.app.access import accessible_document_ids
+
+logger = logging.getLogger("backend.app.changelog")
+
+CHANGE_LOG_RETENTION_DAYS = float(os.getenv("CHANGE_LOG_RETENTION_DAYS", 30))
+CHANGE_LOG_COMPACT_INTERVAL_SECONDS = float(os.getenv("CHANGE_LOG_COMPACT_INTERVAL_SECONDS", 3600))
+CHANGE_LOG_COMPACT_BATCH_SIZE = int(os.getenv("CHANGE_LOG_COMPACT_BATCH_SIZE", 1000))
+CHANGE_LOG_PAGE_SIZE = 500
+CHANGE_LOG_MAX_PAGE_SIZE = 5000
+# Change types that can take access away; readers who lost it are told the document was removed
+ACCESS_CHANGES = frozenset({"publicity", "permissions", "folder", "deleted"})
+# Arbitrary advisory lock keys (see database.try_advisory_lock): compaction job, and appends
+COMPACT_LOCK_KEY = 7303
+APPEND_LOCK_KEY = 7304
+
+
+class Change(NamedTuple):
+    change_id: int
+    document_id: int
+    change_type: str
+    # the reader can no longer see the document
+    removed: bool
+
+
+def record_changes(db: Session, document_ids, change_type: str) -> None:
+    """Append one entry per document. Does not commit; call it last before db.commit()."""
+    document_ids = list(dict.fromkeys(document_ids))
+    if not document_ids:
+        return
+    if db.get_bind().dialect.name == "postgresql":
+        # released at commit/rollback; keeps change ids in commit order (see module docstring)
+        db.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": APPEND_LOCK_KEY})
+    access_changed = change_type in ACCESS_CHANGES
+    db.execute(models.DocumentChange.__table__.insert(), [
+        {"document_id": doc_id, "change_type": change_type, "access_changed": access_changed}
+        for doc_id in document_ids
+    ])
+
+
+def head(db: Session) -> int:
+    """Cursor of the newest entry (0 for an empty log)."""
+    return db.query(func.max(models.DocumentChange.change_id)).scalar() or 0
+
+
+def changes_since(db: Session, user: models.User, cursor: int, limit: int = CHANGE_LOG_PAGE_SIZE,
+                  is_admin: bool = False) -> tuple[list[Change], int, bool]:
+    """One page of changes after `cursor` that `user` may see, one per document (its newest in the
+    page). Returns (changes, next cursor, has_more)."""
+    C = models.DocumentChange
+    newest = head(db)
+    q = (db.query(C.change_id, C.document_id, C.change_type, C.access_changed)
+         .filter(C.change_id > cursor, C.change_id <= newest))
+    visible = None
+    if not is_admin:
+        visible = accessible_document_ids(user)
+        # entries of documents the user cannot see are skipped unless they may have taken access away
+        q = q.filter(or_(C.document_id.in_(visible), C.access_changed == True))
+    rows = q.order_by(C.change_id).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    # past the last page the cursor jumps to the head, over entries the user cannot see
+    next_cursor = rows[-1][0] if has_more else newest if newest > cursor else cursor
+
+    latest: dict[int, tuple] = {}
+    access_changed: set[int] = set()
+    for row in rows:
+        latest[row[1]] = row
+        if row[3]:
+            access_changed.add(row[1])
+    D = models.Document
+    q = db.query(D.document_id).filter(D.document_id.in_(list(latest)), D.deleted_at.is_(None))
+    if visible is not None:
+        q = q.filter(D.document_id.in_(visible))
+    visible_ids = {r[0] for r in q.all()}
+    changes = []
+    for doc_id, row in latest.items():
+        if doc_id in visible_ids:
+            changes.append(Change(row[0], doc_id, row[2], False))
+        elif doc_id in access_changed:
+            changes.append(Change(row[0], doc_id, row[2], True))
+    changes.sort(key=lambda c: c.change_id)
+    return changes, next_cursor, has_more
+
+
+def compact(db: Session, older_than: datetime, batch_size: int = CHANGE_LOG_COMPACT_BATCH_SIZE) -> int:
+    """Delete entries older than `older_than` that are not the newest of their document, in batches of
+    documents (one transaction each). The newest entry inherits access_changed from the deleted ones.
+    Returns the number of entries deleted."""
+    C = models.DocumentChange
+    deleted = 0
+    after_id = 0
+    while True:
+        document_ids = [r[0] for r in (
+            db.query(C.document_id)
+            .filter(C.document_id > after_id)
+            .group_by(C.document_id)
+            .having(func.count() > 1, func.min(C.changed_at) < older_than)
+            .order_by(C.document_id)
+            .limit(batch_size)
+            .all()
+        )]
+        if not document_ids:
+            break
+        after_id = document_ids[-1]
+        keep = dict(db.query(C.document_id, func.max(C.change_id)).filter(C.document_id.in_(document_ids))
+                    .group_by(C.document_id).all())
+        doomed = (C.document_id.in_(document_ids), C.changed_at < older_than, C.change_id.notin_(list(keep.values())))
+        lost_access = {r[0] for r in db.query(C.document_id).filter(*doomed, C.access_changed == True).distinct()}
+        if lost_access:
+            db.execute(update(C).where(C.change_id.in_([keep[d] for d in lost_access])).values(access_changed=True))
+        deleted += db.execute(delete(C).where(*doomed)).rowcount
+        db.commit()
+    return deleted
+
+
+def _compact_once(retention_days: float = CHANGE_LOG_RETENTION_DAYS) -> None:
+    from backend.app.database import SessionLocal, try_advisory_lock
+
+    with try_advisory_lock(COMPACT_LOCK_KEY) as locked:
+        if not locked:
+            return
+        db = SessionLocal()
+        try:
+            deleted = compact(db, datetime.now(timezone.utc) - timedelta(days=retention_days))
+        finally:
+            db.close()
+    if deleted:
+        logger.info("change log compaction deleted %d entries", deleted)
+
+
+def start_compactor(interval: float = CHANGE_LOG_COMPACT_INTERVAL_SECONDS) -> threading.Event | None:
+    """Run compaction every `interval` seconds on a daemon thread. Returns an Event that stops it."""
+    if interval <= 0:
+        return None
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                _compact_once()
+            except Exception:
+                logger.exception("change log compaction failed")
+
+    threading.Thread(target=loop, name="changelog-compactor", daemon=True).start()
+    return stop
+
+
+def main(argv: list[str]) -> int:
+    from backend.app.database import SessionLocal, init_db
+
+    p = argparse.ArgumentParser(prog="python -m backend.app.changelog", description="Maintain the document change log.")
+    p.add_argument("command", choices=["compact"])
+    p.add_argument("--days", type=float, default=CHANGE_LOG_RETENTION_DAYS, help="compact entries older than this")
+    p.add_argument("--batch-size", type=int, default=CHANGE_LOG_COMPACT_BATCH_SIZE, help="documents per transaction")
+    args = p.parse_args(argv)
+    init_db()
+    db = SessionLocal()
+    try:
+        deleted = compact(db, datetime.now(timezone.utc) - timedelta(days=args.days), args.batch_size)
+        remaining = db.query(func.count(models.DocumentChange.change_id)).scalar()
+    finally:
+        db.close()
+    print(f"deleted {deleted} change log entries, {remaining} remain")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
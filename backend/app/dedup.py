@@ -0,0 +1,220 @@
+"""Upload deduplication by content hash.
+
+Every stored version records the SHA-256 of its payload (document_versions.content_sha256, indexed),
+computed while the upload is read. UPLOAD_DEDUP_MODE decides what an upload of content that already
+exists does:
+
+    off    nothing (the hash is still recorded)
+    warn   store it as usual; the response names the versions with the same content that the user
+           can see in X-Duplicate-Of (default)
+    skip   as warn, and a new version identical to the document's latest version is not stored: the
+           response is the existing version, with X-Upload-Deduplicated: skipped
+    link   as skip, and content stored elsewhere is not stored again: the new version is "linked" to
+           a version holding the bytes (storage tier "linked", X-Upload-Deduplicated: linked)
+
+Links always point at a version that holds the bytes (hot or cold), never at another link. Retention
+deleting such a version first hands its bytes to one of the versions linked to it and re-points the
+others (release_links). GET /admin/dedup/report lists duplicate content and the bytes that linking it
+would reclaim. Versions stored before hashes were recorded are hashed by:
+
+    python -m backend.app.dedup backfill
+    python -m backend.app.dedup report
+"""
+import hashlib
+import logging
+import os
+import sys
+from fastapi import Response
+from sqlalchemy import func, case, update
+from sqlalchemy.orm import Session
+import backend.app.models as models
+from backend.app.access import accessible_document_ids
+from backend.app.storage import HOT, COLD, LINKED, cold_store
+
+logger = logging.getLogger("backend.app.dedup")
+
+UPLOAD_DEDUP_MODE = os.getenv("UPLOAD_DEDUP_MODE", "warn").lower()
+if UPLOAD_DEDUP_MODE not in ("off", "warn", "skip", "link"):
+    raise ValueError(f"unknown UPLOAD_DEDUP_MODE: {UPLOAD_DEDUP_MODE!r}")
+# At most this many duplicates are named in X-Duplicate-Of, and per group in the report
+MAX_LISTED_DUPLICATES = 20
+HASH_BLOCK_BYTES = 1 << 20
+BACKFILL_BATCH_SIZE = 100
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_and_hash(f) -> tuple[bytes, str]:
+    """Read an upload's spooled file in blocks, hashing as it comes in."""
+    digest = hashlib.sha256()
+    blocks = []
+    while block := f.read(HASH_BLOCK_BYTES):
+        digest.update(block)
+        blocks.append(block)
+    return b"".join(blocks), digest.hexdigest()
+
+
+def unchanged_latest(db: Session, doc: models.Document, digest: str, title: str | None) -> models.DocumentVersion | None:
+    """The document's latest version if a new one with this content and title would change nothing and
+    no-op versions are skipped."""
+    if UPLOAD_DEDUP_MODE not in ("skip", "link") or title != doc.latest_version_title:
+        return None
+    V = models.DocumentVersion
+    return (db.query(V).filter(V.document_id == doc.document_id, V.version_number == doc.latest_version_number,
+                               V.content_sha256 == digest).one_or_none())
+
+
+def payload_columns(db: Session, data: bytes, digest: str) -> dict:
+    """Column values storing `data` for a new version: its bytes, or in link mode a link to a version
+    that already holds the same content."""
+    columns = {"file_data": data, "file_size": len(data), "content_sha256": digest}
+    if UPLOAD_DEDUP_MODE == "link":
+        V = models.DocumentVersion
+        # share-locked until the upload commits: a purge or sweep deleting the source waits, then finds the
+        # link in release_links; one that got there first has deleted the row, and the bytes are stored
+        source = (db.query(V.version_id)
+                  .filter(V.content_sha256 == digest, V.file_size == len(data), V.storage_tier.in_((HOT, COLD)))
+                  .order_by(V.version_id).with_for_update(read=True).first())
+        if source is not None:
+            columns.update(file_data=None, storage_tier=LINKED, storage_key=str(source[0]))
+    return columns
+
+
+def report_duplicates(db: Session, user: models.User, digest: str, version: models.DocumentVersion,
+                      response: Response | None, skipped: bool = False) -> None:
+    """Set X-Duplicate-Of (other versions with this content the user can see) and X-Upload-Deduplicated.
+    Content the user cannot see is never hinted at, not even by saying the upload was linked to it."""
+    if response is None or UPLOAD_DEDUP_MODE == "off":
+        return
+    V = models.DocumentVersion
+    q = db.query(V.version_id).filter(V.content_sha256 == digest, V.version_id != version.version_id, V.deleted_at.is_(None))
+    if not (user.role_id == 0 or getattr(user.role, "name", None) == "admin"):
+        q = q.filter(V.document_id.in_(accessible_document_ids(user)))
+    duplicates = [r[0] for r in q.order_by(V.version_id).limit(MAX_LISTED_DUPLICATES).all()]
+    if duplicates:
+        response.headers["X-Duplicate-Of"] = ", ".join(map(str, duplicates))
+    if skipped:
+        response.headers["X-Upload-Deduplicated"] = "skipped"
+    elif version.storage_tier == LINKED and duplicates:
+        response.headers["X-Upload-Deduplicated"] = "linked"
+
+
+def release_links(db: Session, version_ids) -> set[int]:
+    """Before versions are deleted: move the bytes of each one that others link to into the first of
+    them that survives, and re-point the remaining links there. Does not commit. Returns the ids of the
+    versions whose bytes were handed over: their cold objects must not be deleted and deleting them
+    frees nothing."""
+    V = models.DocumentVersion
+    doomed = set(version_ids)
+    if not doomed:
+        return set()
+    heirs: dict[int, list[int]] = {}
+    for version_id, key in (db.query(V.version_id, V.storage_key)
+                            .filter(V.storage_tier == LINKED, V.storage_key.in_([str(i) for i in doomed]))
+                            .order_by(V.version_id).all()):
+        if version_id not in doomed:
+            heirs.setdefault(int(key), []).append(version_id)
+    for source_id, linked in heirs.items():
+        heir, others = linked[0], linked[1:]
+        tier, key, data = db.query(V.storage_tier, V.storage_key, V.file_data).filter(V.version_id == source_id).one()
+        if tier == COLD:
+            # the cold object changes owner instead of being copied
+            db.execute(update(V).where(V.version_id == heir).values(storage_tier=COLD, storage_key=key, file_data=None))
+        else:
+            db.execute(update(V).where(V.version_id == heir).values(storage_tier=HOT, storage_key=None, file_data=data))
+        if others:
+            db.execute(update(V).where(V.version_id.in_(others)).values(storage_key=str(heir)))
+    return set(heirs)
+
+
+def duplicate_report(db: Session, limit: int = 100) -> dict:
+    """Content stored more than once, largest reclaimable bytes first. Reclaimable bytes are what
+    linking every copy but one would free."""
+    V = models.DocumentVersion
+    stored = func.sum(case((V.storage_tier == LINKED, 0), else_=1))
+    size = func.max(V.file_size)
+    reclaimable = (stored - 1) * size
+    groups = (
+        db.query(V.content_sha256.label("sha256"), size.label("size"), func.count().label("versions"),
+                 func.count(func.distinct(V.document_id)).label("documents"), stored.label("stored_copies"),
+                 reclaimable.label("reclaimable"))
+        .filter(V.content_sha256.isnot(None))
+        .group_by(V.content_sha256)
+        .having(func.count() > 1)
+    )
+    totals = groups.subquery()
+    n_groups, total = db.query(func.count(), func.coalesce(func.sum(totals.c.reclaimable), 0)).select_from(totals).one()
+    rows = groups.order_by(reclaimable.desc(), V.content_sha256).limit(limit).all()
+    listed: dict[str, list[int]] = {}
+    for digest, version_id in (db.query(V.content_sha256, V.version_id)
+                               .filter(V.content_sha256.in_([r.sha256 for r in rows])).order_by(V.version_id).all()):
+        ids = listed.setdefault(digest, [])
+        if len(ids) < MAX_LISTED_DUPLICATES:
+            ids.append(version_id)
+    linked, unhashed = db.query(func.sum(case((V.storage_tier == LINKED, 1), else_=0)),
+                                func.sum(case((V.content_sha256.is_(None), 1), else_=0))).one()
+    return {
+        "groups": [{"sha256": r.sha256, "size": r.size or 0, "versions": r.versions, "documents": r.documents,
+                    "stored_copies": r.stored_copies, "reclaimable_bytes": r.reclaimable or 0,
+                    "version_ids": listed.get(r.sha256, [])} for r in rows],
+        "duplicate_groups": n_groups,
+        "reclaimable_bytes": int(total),
+        "linked_versions": int(linked or 0),
+        "unhashed_versions": int(unhashed or 0),
+    }
+
+
+def backfill(db: Session, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Hash versions stored before hashes were recorded, one payload in memory at a time and one
+    transaction per batch. Cold payloads are read without re-warming them; linked versions take the hash
+    of the version they link to. Returns versions hashed."""
+    V = models.DocumentVersion
+    hashed = 0
+    after_id = 0
+    while True:
+        batch = (db.query(V.version_id, V.storage_tier, V.storage_key)
+                 .filter(V.version_id > after_id, V.content_sha256.is_(None))
+                 .order_by(V.version_id).limit(batch_size).all())
+        if not batch:
+            return hashed
+        after_id = batch[-1][0]
+        for version_id, tier, key in batch:
+            if tier == LINKED:
+                # a link always points at an older version, hashed by now
+                digest = db.query(V.content_sha256).filter(V.version_id == int(key)).scalar()
+            elif tier == COLD:
+                digest = content_hash(cold_store().get(key))
+            else:
+                digest = content_hash(db.query(V.file_data).filter(V.version_id == version_id).scalar() or b"")
+            db.execute(update(V).where(V.version_id == version_id).values(content_sha256=digest))
+            hashed += 1
+        db.commit()
+
+
+def main(argv: list[str]) -> int:
+    from backend.app.database import SessionLocal, init_db
+
+    if len(argv) != 1 or argv[0] not in ("backfill", "report"):
+        print("usage: python -m backend.app.dedup backfill|report", file=sys.stderr)
+        return 2
+    init_db()
+    db = SessionLocal()
+    try:
+        if argv[0] == "backfill":
+            print(f"hashed {backfill(db)} versions")
+            return 0
+        report = duplicate_report(db)
+        for g in report["groups"]:
+            print(f"  {g['sha256'][:16]}  {g['size']:12d} bytes  {g['versions']:5d} versions in {g['documents']:4d} documents"
+                  f"  {g['stored_copies']:4d} stored  {g['reclaimable_bytes']:14d} reclaimable")
+        print(f"{report['duplicate_groups']} duplicated contents, {report['reclaimable_bytes']} bytes reclaimable "
+              f"({report['linked_versions']} versions already linked, {report['unhashed_versions']} not hashed yet)")
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
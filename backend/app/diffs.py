@@ -0,0 +1,514 @@
+"""Server-side comparison of the text of two versions.
+
+The text of a content (document_versions.content_sha256) is extracted once into a file of the disk
+cache under DIFF_CACHE_DIR: text files decoded as UTF-8 with line ends normalized, PDFs page by page
+(needs pypdfium2). Images and other binaries have no text to compare. Diffs are memoised in the same
+cache per pair of contents, granularity and context, as the exact stream they were sent as, so asking
+again (for these versions or any others with the same contents) only reads a file. The workers of a
+host share the cache; it holds at most DIFF_CACHE_BYTES in all, least recently used first out.
+
+Neither text is loaded to diff it: both files are read in step through a window of DIFF_WINDOW_LINES
+lines a side. Common stretches are skipped without matching; otherwise the window is matched (difflib)
+and everything up to its last run of matching lines is settled and sent before the window moves on, so
+the first hunks go out while the rest of the files is still unread and memory does not grow with their
+size. A window without matching lines grows up to DIFF_WINDOW_GROWTH times before its lines are taken as
+replaced, so text moved farther than that shows as deleted and added. Word diffs tokenize changed
+blocks of up to DIFF_WORD_MAX_LINES lines a side; larger ones stay line diffs.
+
+The stream is NDJSON, one object per line:
+
+    {"type": "start", "version_a": 41, "version_b": 42, "granularity": "word", "context": 3}
+    {"type": "hunk", "a_start": 10, "a_lines": 7, "b_start": 10, "b_lines": 8}
+    {"type": "line", "op": " ", "text": "unchanged line"}          op: " " both, "-" only a, "+" only b
+    {"type": "words", "segments": [["=", "the "], ["-", "old"], ["+", "new"], ["=", " text"]]}
+    {"type": "end", "hunks": 3, "added": 12, "removed": 9}
+
+By hand:
+
+    python -m backend.app.diffs stats
+    python -m backend.app.diffs clear
+"""
+import argparse
+import difflib
+import io
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+import backend.app.models as models
+from backend.app.dedup import content_hash
+from backend.app.metrics import DIFF_CACHE_REQUESTS
+from backend.app.previews import sniff
+from backend.app.storage import peek_version_data
+
+logger = logging.getLogger("backend.app.diffs")
+
+DIFF_CACHE_DIR = os.getenv("DIFF_CACHE_DIR", os.path.normpath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "data", "diff_cache")))
+DIFF_CACHE_BYTES = int(os.getenv("DIFF_CACHE_BYTES", 2 * 1024 ** 3))
+DIFF_MAX_SOURCE_BYTES = int(os.getenv("DIFF_MAX_SOURCE_BYTES", 100 * 1024 ** 2))
+DIFF_WINDOW_LINES = int(os.getenv("DIFF_WINDOW_LINES", 20000))
+DIFF_WINDOW_GROWTH = 8
+# Matching lines that settle everything before them in a window
+SYNC_LINES = 3
+HUNK_MAX_LINES = 10000
+DIFF_WORD_MAX_LINES = int(os.getenv("DIFF_WORD_MAX_LINES", 200))
+DIFF_CONTEXT_LINES = 3
+DIFF_MAX_CONTEXT = 100
+# Bytes of the stream collected before they are sent (one write per line would be one send per line)
+STREAM_CHUNK_BYTES = 64 * 1024
+# Age of a worker's index of the cache directory after which it is read again before evicting
+DISK_RESCAN_SECONDS = 60
+TEXT_BLOCK_CHARS = 1 << 20
+
+_WORD = re.compile(r"\w+|\s+|[^\w\s]+")
+
+
+class DiffError(Exception):
+    """A comparison that cannot be made; the message is meant for the client, status_code is the HTTP status."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class DiskCache:
+    """Files under a directory shared by the workers of a host, at most max_bytes in all, the least
+    recently used removed first. Recency is the files' mtime, touched on every use, so the workers share
+    it; each one indexes the directory on first use, adds the entries it opens, whoever wrote them, and
+    reads the directory again before evicting once the index is DISK_RESCAN_SECONDS old, so the limit
+    holds for all of them together. Entries are written to a temp file and renamed into place, so a
+    reader never sees a partial one, and read through files opened by open(), which an eviction by
+    another worker cannot take away."""
+
+    def __init__(self, root: str = DIFF_CACHE_DIR, max_bytes: int = DIFF_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._index: OrderedDict | None = None
+        self._bytes = 0
+        self._scanned = 0.0
+        self._lock = threading.Lock()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, *name.split("/"))
+
+    def _load_index(self) -> None:
+        # under the lock: sizes and recency of what is on disk, whichever process wrote it
+        entries = []
+        for dirpath, _, files in os.walk(self.root):
+            for file_name in files:
+                if file_name.endswith(".tmp"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(dirpath, file_name))
+                except FileNotFoundError:
+                    continue
+                name = os.path.relpath(os.path.join(dirpath, file_name), self.root).replace(os.sep, "/")
+                entries.append((st.st_mtime, name, st.st_size))
+        self._index = OrderedDict()
+        self._bytes = 0
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self._bytes += size
+        self._scanned = time.monotonic()
+
+    def open(self, name: str, binary: bool = False):
+        """An entry opened for reading (text as written, or bytes), or None."""
+        path = self._path(name)
+        try:
+            f = open(path, "rb") if binary else open(path, encoding="utf-8", newline="\n")
+        except FileNotFoundError:
+            with self._lock:
+                if self._index is not None:
+                    self._bytes -= self._index.pop(name, 0)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        size = os.fstat(f.fileno()).st_size
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            self._bytes += size - self._index.pop(name, 0)
+            self._index[name] = size
+        return f
+
+    @contextmanager
+    def writer(self, name: str):
+        """A text file to write an entry to; it is added when the block exits without an error."""
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+                yield f
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._add(name, os.path.getsize(path))
+
+    def _add(self, name: str, size: int) -> None:
+        doomed = []
+        with self._lock:
+            if self._index is None or time.monotonic() - self._scanned > DISK_RESCAN_SECONDS:
+                self._load_index()
+            self._bytes += size - self._index.pop(name, 0)
+            self._index[name] = size
+            # the newest entry stays even when it alone is over the limit: it is about to be read
+            while self._bytes > self.max_bytes and len(self._index) > 1:
+                old, old_size = self._index.popitem(last=False)
+                self._bytes -= old_size
+                doomed.append(old)
+        for old in doomed:
+            try:
+                os.remove(self._path(old))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._load_index()
+            texts = sum(1 for name in self._index if name.startswith("text/"))
+            return {"texts": texts, "diffs": len(self._index) - texts, "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+    def clear(self) -> int:
+        with self._lock:
+            self._load_index()
+            names, self._index, self._bytes = list(self._index), OrderedDict(), 0
+        for name in names:
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+        return len(names)
+
+
+cache = DiskCache()
+
+# Extractions of the same content are serialized (a burst of diffs against a new version extracts it once)
+_extract_locks = [threading.Lock() for _ in range(64)]
+
+
+def _write_text(data: bytes, out) -> None:
+    # universal newlines: \r\n and \r become \n, also across block boundaries
+    reader = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", errors="replace", newline=None)
+    while block := reader.read(TEXT_BLOCK_CHARS):
+        out.write(block)
+
+
+def _write_pdf_text(data: bytes, out) -> None:
+    import pypdfium2 as pdfium  # optional dependency, only needed for PDF diffs
+
+    pdf = pdfium.PdfDocument(data)
+    try:
+        for page in pdf:
+            text = page.get_textpage().get_text_range()
+            out.write(text.replace("\r\n", "\n").replace("\r", "\n"))
+            if text and not text.endswith(("\n", "\r")):
+                out.write("\n")
+    finally:
+        pdf.close()
+
+
+def _payload(db: Session, version_id: int) -> bytes:
+    # past the payload cache: the extracted text is what is cached, and it is extracted once per content
+    try:
+        return peek_version_data(db, version_id)
+    except KeyError:
+        raise DiffError(404, f"content of version {version_id} is missing")
+
+
+def open_text(db: Session, version: models.DocumentVersion):
+    """The extracted text of a version (load it with file_data deferred) as an open file, extracting it
+    on the first request for its content. Versions stored before hashes were recorded get theirs now."""
+    if (version.file_size or 0) > DIFF_MAX_SOURCE_BYTES:
+        raise DiffError(413, f"version {version.version_id} is too large to compare")
+    digest = version.content_sha256
+    data = None
+    if digest is None:
+        data = _payload(db, version.version_id)
+        digest = content_hash(data)
+        db.execute(update(models.DocumentVersion).where(models.DocumentVersion.version_id == version.version_id)
+                   .values(content_sha256=digest))
+        db.commit()
+    name = f"text/{digest[:2]}/{digest}.txt"
+    f = cache.open(name)
+    if f is not None:
+        return f
+    with _extract_locks[int(digest[:8], 16) % len(_extract_locks)]:
+        # another thread or worker may have extracted it meanwhile
+        f = cache.open(name)
+        if f is not None:
+            return f
+        preview = db.get(models.ContentPreview, digest)
+        if preview is not None and preview.kind not in ("text", "pdf"):
+            raise DiffError(415, f"version {version.version_id} has no text to compare")
+        if data is None:
+            data = _payload(db, version.version_id)
+        kind = sniff(data, version.file_name)
+        if kind not in ("text", "pdf"):
+            raise DiffError(415, f"version {version.version_id} has no text to compare")
+        try:
+            with cache.writer(name) as out:
+                if kind == "text":
+                    _write_text(data, out)
+                else:
+                    _write_pdf_text(data, out)
+        except ImportError:
+            raise DiffError(415, "comparing PDFs needs pypdfium2")
+        except Exception:
+            logger.warning("text extraction of version %d failed", version.version_id, exc_info=True)
+            raise DiffError(422, f"could not extract the text of version {version.version_id}")
+        f = cache.open(name)
+    if f is None:
+        # evicted by another worker the moment it was written: the cache is far too small
+        raise DiffError(503, "the diff cache is full, try again")
+    return f
+
+
+def _read_lines(f, buffer: list[str], size: int) -> None:
+    while len(buffer) < size:
+        line = f.readline()
+        if not line:
+            return
+        buffer.append(line[:-1] if line.endswith("\n") else line)
+
+
+def _operations(fa, fb, window: int):
+    """difflib opcodes of two text files with the lines they cover, found through a window of `window`
+    lines a side. Everything up to the last run of at least SYNC_LINES matching lines in the window is
+    settled and yielded; the rest is matched again with the lines that follow. A window without such a
+    run is doubled, up to DIFF_WINDOW_GROWTH times, before its lines are taken as replaced."""
+    a: list[str] = []
+    b: list[str] = []
+    a0 = b0 = 0
+    size = window
+    while True:
+        _read_lines(fa, a, size)
+        _read_lines(fb, b, size)
+        if not a and not b:
+            return
+        head = 0
+        while head < len(a) and head < len(b) and a[head] == b[head]:
+            head += 1
+        if head:
+            # the common stretch needs no matching, however long
+            yield "equal", a0, a0 + head, b0, b0 + head, a[:head], b[:head]
+            del a[:head], b[:head]
+            a0, b0 = a0 + head, b0 + head
+            continue
+        codes = difflib.SequenceMatcher(None, a, b).get_opcodes()
+        at_end = len(a) < size and len(b) < size
+        cut = None
+        if at_end or not a or not b:
+            cut = len(codes)
+        else:
+            for k in range(len(codes) - 1, 0, -1):
+                tag, i1, i2, _, _ = codes[k]
+                if tag == "equal" and i2 - i1 >= SYNC_LINES:
+                    cut = k + 1
+                    break
+            if cut is None:
+                if size < window * DIFF_WINDOW_GROWTH:
+                    size *= 2
+                    continue
+                cut = len(codes)
+        for tag, i1, i2, j1, j2 in codes[:cut]:
+            yield tag, a0 + i1, a0 + i2, b0 + j1, b0 + j2, a[i1:i2], b[j1:j2]
+        _, _, i, _, j = codes[cut - 1]
+        del a[:i], b[:j]
+        a0, b0 = a0 + i, b0 + j
+        size = window
+
+
+class _Unchanged:
+    """A run of unchanged lines between changes: its length and first and last `context` lines."""
+
+    def __init__(self, context: int):
+        self.context = context
+        self.n = 0
+        self.head: list[str] = []
+        self.tail: list[str] = []
+
+    def extend(self, lines: list[str]) -> None:
+        c = self.context
+        self.n += len(lines)
+        if len(self.head) < c:
+            self.head += lines[:c - len(self.head)]
+        self.tail = (self.tail + lines[-c:])[-c:] if c else []
+
+    def lines(self) -> list[str]:
+        """All of them; only for runs of at most twice the context."""
+        return self.head + self.tail[len(self.tail) - (self.n - len(self.head)):] if self.n > len(self.head) else self.head
+
+
+def _word_segments(old: list[str], new: list[str]) -> list[list[str]]:
+    a = _WORD.findall("\n".join(old))
+    b = _WORD.findall("\n".join(new))
+    segments: list[list[str]] = []
+
+    def add(op, tokens):
+        if not tokens:
+            return
+        if segments and segments[-1][0] == op:
+            segments[-1][1] += "".join(tokens)
+        else:
+            segments.append([op, "".join(tokens)])
+
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == "equal":
+            add("=", a[i1:i2])
+        else:
+            add("-", a[i1:i2])
+            add("+", b[j1:j2])
+    return segments
+
+
+def _records(operations, context: int, granularity: str):
+    """Stream records of the operations: changes grouped into hunks with up to `context` unchanged lines
+    around them (as difflib.unified_diff). A hunk is sent once it has HUNK_MAX_LINES lines even if the
+    changes go on, so none is held in memory whole."""
+    hunk = None
+    run = None
+    hunks = added = removed = 0
+
+    def close():
+        a_start, b_start, a_end, b_end, records = hunk
+        # line numbers as in unified diffs: an empty range starts at the line before it
+        yield {"type": "hunk", "a_start": a_start + 1 if a_end > a_start else a_start, "a_lines": a_end - a_start,
+               "b_start": b_start + 1 if b_end > b_start else b_start, "b_lines": b_end - b_start}
+        yield from records
+
+    for tag, i1, i2, j1, j2, old, new in operations:
+        if tag == "equal":
+            if run is None:
+                run = _Unchanged(context)
+            run.extend(old)
+            continue
+        if hunk is not None and run is not None and run.n > 2 * context:
+            hunk[4].extend({"type": "line", "op": " ", "text": t} for t in run.head)
+            hunk[2] += len(run.head)
+            hunk[3] += len(run.head)
+            yield from close()
+            hunk = None
+        if hunk is None:
+            hunks += 1
+            lead = run.tail if run is not None else []
+            hunk = [i1 - len(lead), j1 - len(lead), i1 - len(lead), j1 - len(lead), []]
+        elif run is not None:
+            lead = run.lines()
+        else:
+            lead = []
+        run = None
+        records = hunk[4]
+        records.extend({"type": "line", "op": " ", "text": t} for t in lead)
+        if tag == "replace" and granularity == "word" and len(old) <= DIFF_WORD_MAX_LINES and len(new) <= DIFF_WORD_MAX_LINES:
+            records.append({"type": "words", "segments": _word_segments(old, new)})
+        else:
+            records.extend({"type": "line", "op": "-", "text": t} for t in old)
+            records.extend({"type": "line", "op": "+", "text": t} for t in new)
+        hunk[2], hunk[3] = i2, j2
+        removed += i2 - i1
+        added += j2 - j1
+        if len(records) >= HUNK_MAX_LINES:
+            yield from close()
+            hunk = None
+    if hunk is not None:
+        if run is not None:
+            hunk[4].extend({"type": "line", "op": " ", "text": t} for t in run.head)
+            hunk[2] += len(run.head)
+            hunk[3] += len(run.head)
+        yield from close()
+    yield {"type": "end", "hunks": hunks, "added": added, "removed": removed}
+
+
+class Diff:
+    """A prepared comparison holding open files: the memoised stream, or both texts."""
+
+    def __init__(self, name: str, granularity: str, context: int, memo=None, text_a=None, text_b=None):
+        self.name = name
+        self.granularity = granularity
+        self.context = context
+        self.memo = memo
+        self.text_a, self.text_b = text_a, text_b
+
+    @property
+    def cached(self) -> bool:
+        return self.memo is not None
+
+    def close(self) -> None:
+        for f in (self.memo, self.text_a, self.text_b):
+            if f is not None:
+                f.close()
+
+    def stream(self, start: dict):
+        """The NDJSON stream as byte chunks: `start` first, then the memoised records or, computing
+        them, the records as they are found (written to the cache on the way). Closes the files."""
+        try:
+            yield (json.dumps(start) + "\n").encode()
+            if self.memo is not None:
+                while block := self.memo.read(STREAM_CHUNK_BYTES):
+                    yield block
+                return
+            with cache.writer(self.name) as out:
+                pending: list[str] = []
+                size = 0
+                for record in _records(_operations(self.text_a, self.text_b, DIFF_WINDOW_LINES), self.context, self.granularity):
+                    line = json.dumps(record, ensure_ascii=False) + "\n"
+                    out.write(line)
+                    pending.append(line)
+                    size += len(line)
+                    if size >= STREAM_CHUNK_BYTES:
+                        yield "".join(pending).encode()
+                        pending, size = [], 0
+                if pending:
+                    yield "".join(pending).encode()
+        finally:
+            self.close()
+
+
+def prepare(db: Session, version_a: models.DocumentVersion, version_b: models.DocumentVersion,
+            granularity: str = "line", context: int = DIFF_CONTEXT_LINES) -> Diff:
+    """The diff from version_a to version_b: memoised, or with both texts extracted. The files are open
+    already, so that streaming cannot fail on them (whatever is evicted meanwhile). Raises DiffError."""
+    text_a = open_text(db, version_a)
+    try:
+        text_b = open_text(db, version_b)
+    except BaseException:
+        text_a.close()
+        raise
+    name = f"diff/{version_a.content_sha256[:2]}/{version_a.content_sha256}-{version_b.content_sha256}-{granularity}-{context}.ndjson"
+    memo = cache.open(name, binary=True)
+    DIFF_CACHE_REQUESTS.labels("hit" if memo is not None else "miss").inc()
+    if memo is not None:
+        text_a.close()
+        text_b.close()
+        return Diff(name, granularity, context, memo=memo)
+    return Diff(name, granularity, context, text_a=text_a, text_b=text_b)
+
+
+def main(argv: list[str]) -> int:
+    p = argparse.ArgumentParser(prog="python -m backend.app.diffs", description="Cache of extracted texts and diffs.")
+    p.add_argument("command", choices=["stats", "clear"])
+    args = p.parse_args(argv)
+    if args.command == "clear":
+        print(f"removed {cache.clear()} cached texts and diffs")
+        return 0
+    stats = cache.stats()
+    print(f"{stats['texts']} texts, {stats['diffs']} diffs, {stats['bytes']} of {stats['max_bytes']} bytes in {cache.root}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
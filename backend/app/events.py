@@ -0,0 +1,318 @@
+"""Change feed: document changes pushed to the users who can see them, as Server-Sent Events.
+
+Mutating endpoints call notify_documents() after they commit. Each changed document is serialised
+once, in the DocumentWithLatestVersion shape that /documents/me returns, together with its audience:
+public flag, departments with view access (the materialized access table), owner and users with edit
+rights. Every open stream (GET /events/stream) filters the messages against its user:
+
+    event: document.created | document.updated   data: {"document_id": .., "document": {..}}
+    event: document.permissions                   data: same; view/edit grants of the document changed
+    event: document.removed                       data: {"document_id": ..}; the user lost access
+    event: tag.deleted                            data: {"tag_id": ..}
+    event: resync                                 the stream fell behind; re-fetch, then reconnect
+
+Clients apply these as deltas to the lists they already have instead of re-fetching them. There is no
+replay: a client that (re)connects fetches its lists once and then follows the stream.
+
+Messages go through a broker. MemoryBroker (default) reaches the streams of this process only, which
+is exact for a single worker. With several workers set EVENTS_BACKEND=redis (EVENTS_REDIS_URL); each
+worker then publishes to one Redis channel and relays what it receives to its own streams.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import threading
+from typing import NamedTuple
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import and_
+import backend.app.models as models
+
+logger = logging.getLogger("backend.app.events")
+
+EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "memory")
+EVENTS_REDIS_URL = os.getenv("EVENTS_REDIS_URL", "redis://localhost:6379/0")
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "document-events")
+# Undelivered events per stream before it is told to resync and closed
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", 256))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", 15))
+# Streams end after this long and the browser reconnects, which also spreads them over the workers
+EVENTS_MAX_STREAM_SECONDS = float(os.getenv("EVENTS_MAX_STREAM_SECONDS", 900))
+EVENTS_MAX_STREAMS_PER_USER = int(os.getenv("EVENTS_MAX_STREAMS_PER_USER", 5))
+# Reconnect delay suggested to EventSource clients
+EVENTS_RETRY_MS = int(os.getenv("EVENTS_RETRY_MS", 3000))
+
+
+class Audience(NamedTuple):
+    public: bool
+    departments: frozenset
+    users: frozenset
+
+
+class Viewer(NamedTuple):
+    user_id: int
+    department_id: int | None
+    is_admin: bool
+
+
+def _can_see(audience: Audience, viewer: Viewer) -> bool:
+    return (viewer.is_admin or audience.public or viewer.user_id in audience.users
+            or (viewer.department_id is not None and viewer.department_id in audience.departments))
+
+
+_CLOSE = object()
+_RESYNC = object()
+
+
+class Subscription:
+    """One open stream. Messages are offered from any thread and filtered on the stream's event loop."""
+
+    def __init__(self, viewer: Viewer, loop: asyncio.AbstractEventLoop, max_queue: int = EVENTS_QUEUE_SIZE):
+        self.viewer = viewer
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(max_queue)
+
+    def offer(self, message) -> None:
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            pass  # loop already closed; the stream is gone
+
+    def _put(self, message) -> None:
+        if message is _CLOSE:
+            item = _CLOSE
+        else:
+            item = self._render(message)
+            if item is None:
+                return
+        if self.queue.full():
+            # too slow to keep up: drop what is queued and let the client re-fetch instead
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            item = _RESYNC
+        self.queue.put_nowait(item)
+
+    def _render(self, message: dict) -> tuple[str, str] | None:
+        audience = message.get("audience")
+        if audience is None or _can_see(audience, self.viewer):
+            return message["type"], message["data"]
+        previous = message.get("previous")
+        if previous is not None and _can_see(previous, self.viewer):
+            return "document.removed", json.dumps({"document_id": message["document_id"]})
+        return None
+
+
+class MemoryBroker:
+    """Delivers messages to the streams of this process."""
+
+    def __init__(self):
+        self._subscriptions: dict[int, Subscription] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def streams_of(self, user_id: int) -> int:
+        with self._lock:
+            return sum(1 for s in self._subscriptions.values() if s.viewer.user_id == user_id)
+
+    def subscribe(self, subscription: Subscription) -> int | None:
+        """Register a stream; None if its user already has EVENTS_MAX_STREAMS_PER_USER open here."""
+        with self._lock:
+            open_streams = sum(1 for s in self._subscriptions.values() if s.viewer.user_id == subscription.viewer.user_id)
+            if open_streams >= EVENTS_MAX_STREAMS_PER_USER:
+                return None
+            sub_id = next(self._ids)
+            self._subscriptions[sub_id] = subscription
+            return sub_id
+
+    def unsubscribe(self, sub_id: int) -> None:
+        with self._lock:
+            self._subscriptions.pop(sub_id, None)
+
+    def has_subscribers(self) -> bool:
+        return bool(self._subscriptions)
+
+    def publish(self, message: dict) -> None:
+        self._deliver(message)
+
+    def _deliver(self, message) -> None:
+        # a copy without the lock: close_all() runs in a signal handler
+        for subscription in list(self._subscriptions.values()):
+            subscription.offer(message)
+
+    def close_all(self) -> None:
+        self._deliver(_CLOSE)
+
+
+class RedisBroker(MemoryBroker):
+    """Publishes to a Redis channel; a listener thread hands every message to this process's streams."""
+
+    def __init__(self, url: str = EVENTS_REDIS_URL, channel: str = EVENTS_CHANNEL):
+        import redis  # optional dependency, only needed for this backend
+
+        super().__init__()
+        self._redis = redis.Redis.from_url(url)
+        self._channel = channel
+        threading.Thread(target=self._listen, name="events-listener", daemon=True).start()
+
+    def has_subscribers(self) -> bool:
+        return True  # streams of other workers are not known here
+
+    def publish(self, message: dict) -> None:
+        wire = dict(message)
+        for key in ("audience", "previous"):
+            if wire.get(key) is not None:
+                a = wire[key]
+                wire[key] = {"public": a.public, "departments": sorted(a.departments), "users": sorted(a.users)}
+        self._redis.publish(self._channel, json.dumps(wire))
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._channel)
+                for raw in pubsub.listen():
+                    message = json.loads(raw["data"])
+                    for key in ("audience", "previous"):
+                        if message.get(key) is not None:
+                            a = message[key]
+                            message[key] = Audience(a["public"], frozenset(a["departments"]), frozenset(a["users"]))
+                    self._deliver(message)
+            except Exception:
+                logger.exception("event listener lost its Redis connection; reconnecting")
+                threading.Event().wait(1)
+
+
+def _create_broker(name: str):
+    if name == "memory":
+        return MemoryBroker()
+    if name == "redis":
+        return RedisBroker()
+    raise ValueError(f"unknown EVENTS_BACKEND: {name!r}")
+
+
+broker = _create_broker(EVENTS_BACKEND)
+
+
+def set_broker(new_broker) -> None:
+    """Replace the broker; it must provide the methods of MemoryBroker."""
+    global broker
+    broker = new_broker
+
+
+def close_streams() -> None:
+    """End every open stream (on shutdown, so they do not hold up the graceful drain)."""
+    broker.close_all()
+
+
+def document_audiences(db: Session, document_ids) -> dict[int, Audience]:
+    """Who can see each document: public flag, departments with view access, owner and edit users.
+    Empty when no stream is open, since audiences only matter for notifications."""
+    document_ids = list(document_ids)
+    if not document_ids or not broker.has_subscribers():
+        return {}
+    D = models.Document
+    A = models.DepartmentDocumentAccess
+    E = models.DocumentEditPermission
+    departments: dict[int, set] = {}
+    for department_id, document_id in (db.query(A.department_id, A.document_id)
+                                       .filter(A.document_id.in_(document_ids)).all()):
+        departments.setdefault(document_id, set()).add(department_id)
+    users: dict[int, set] = {}
+    for document_id, user_id in db.query(E.document_id, E.user_id).filter(E.document_id.in_(document_ids)).all():
+        users.setdefault(document_id, set()).add(user_id)
+    return {
+        document_id: Audience(bool(is_public), frozenset(departments.get(document_id, ())),
+                              frozenset(users.get(document_id, set()) | {owner_id}))
+        for document_id, is_public, owner_id in (db.query(D.document_id, D.is_public, D.owner_user_id)
+                                                 .filter(D.document_id.in_(document_ids), D.deleted_at.is_(None)).all())
+    }
+
+
+def notify_documents(db: Session, document_ids, event_type: str = "document.updated",
+                     previous: dict[int, Audience] | None = None) -> None:
+    """Publish the committed state of documents. `previous` holds their audiences from before a change
+    that may have taken access away (document_audiences() called before it), so those users get
+    document.removed."""
+    from backend.app.routers.helpers import _serialize_document_with_latest
+
+    document_ids = list(dict.fromkeys(document_ids))
+    if not document_ids or not broker.has_subscribers():
+        return
+    D = models.Document
+    V = models.DocumentVersion
+    try:
+        audiences = document_audiences(db, document_ids)
+        rows = (
+            db.query(D, V)
+            .options(selectinload(D.tags), selectinload(D.department), selectinload(D.owner))
+            .outerjoin(V, and_(V.document_id == D.document_id, V.version_number == D.latest_version_number))
+            .filter(D.document_id.in_(document_ids), D.deleted_at.is_(None))
+            .all()
+        )
+        for doc, ver in rows:
+            document = _serialize_document_with_latest(doc, ver).model_dump(mode="json")
+            broker.publish({
+                "type": event_type, "document_id": doc.document_id,
+                "data": json.dumps({"document_id": doc.document_id, "document": document}),
+                "audience": audiences[doc.document_id],
+                "previous": (previous or {}).get(doc.document_id),
+            })
+    except Exception:
+        # the change is committed; a lost notification must not turn the request into an error
+        logger.exception("could not publish changes of documents %s", document_ids[:10])
+
+
+def notify_removed(document_ids, previous: dict[int, Audience]) -> None:
+    """Tell the users who could see documents (`previous`, from document_audiences() before they were
+    trashed) that they are gone."""
+    try:
+        for document_id in dict.fromkeys(document_ids):
+            audience = previous.get(document_id)
+            if audience is not None:
+                broker.publish({"type": "document.removed", "document_id": document_id,
+                                "data": json.dumps({"document_id": document_id}), "audience": audience, "previous": None})
+    except Exception:
+        logger.exception("could not publish removal of documents %s", list(document_ids)[:10])
+
+
+def notify_all(event_type: str, payload: dict) -> None:
+    """Publish an event every stream receives (e.g. a deleted tag)."""
+    if not broker.has_subscribers():
+        return
+    try:
+        broker.publish({"type": event_type, "data": json.dumps(payload), "audience": None, "previous": None})
+    except Exception:
+        logger.exception("could not publish %s", event_type)
+
+
+async def stream(viewer: Viewer):
+    """SSE body of one stream: events for `viewer`, heartbeats, and an end after EVENTS_MAX_STREAM_SECONDS."""
+    loop = asyncio.get_running_loop()
+    subscription = Subscription(viewer, loop)
+    sub_id = broker.subscribe(subscription)
+    if sub_id is None:
+        # lost a race with another stream of the same user opening (the endpoint checked the limit)
+        yield "event: resync\ndata: {}\n\n"
+        return
+    try:
+        yield f"retry: {EVENTS_RETRY_MS}\nevent: ready\ndata: {{}}\n\n"
+        deadline = loop.time() + EVENTS_MAX_STREAM_SECONDS
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                item = await asyncio.wait_for(subscription.queue.get(), min(EVENTS_HEARTBEAT_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if item is _CLOSE:
+                return
+            if item is _RESYNC:
+                yield "event: resync\ndata: {}\n\n"
+                return
+            event_type, data = item
+            yield f"event: {event_type}\ndata: {data}\n\n"
+    finally:
+        broker.unsubscribe(sub_id)
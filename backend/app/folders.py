@@ -0,0 +1,287 @@
+"""Folders: a tree to file documents in, with view grants inherited down the tree.
+
+The tree is stored twice: `folders.parent_id`, and `folder_closure`, one row per (ancestor, descendant)
+pair with its depth, (f, f) included. Every question about a subtree is then one indexed join:
+
+    below F        SELECT descendant_id FROM folder_closure WHERE ancestor_id = F      (primary key)
+    above F        SELECT ancestor_id FROM folder_closure WHERE descendant_id = F      (breadcrumbs)
+    my documents   documents.folder_id IN (below F) AND document_id IN (access table rows of my department)
+
+A folder belongs to a department, whose members manage it. A view grant on a folder
+(`folder_view_permissions`) reaches every document below it: it is materialized into
+`department_document_access` like a document's own grants (backend.app.access), so listing stays a
+lookup. Folders are visible to their department and to departments granted on them or above them.
+
+Creating a folder adds depth + 1 closure rows. Moving a subtree of S folders from under A old ancestors
+to under B new ones deletes A * S rows and inserts B * S, with two set-based statements; the documents
+below only have their access recomputed when the inherited grants actually differ. Deleting a folder
+deletes its subfolders and moves the documents filed below it to its parent.
+
+    python -m backend.benchmarks.folders      # depth 10, a million folders
+    python -m backend.app.folders check       # closure rows against parent_id (exit code 1 on drift)
+    python -m backend.app.folders rebuild     # then the access table, which inherits grants through it
+"""
+import sys
+from sqlalchemy import select, delete, insert, update, literal, exists, true, except_
+from sqlalchemy.orm import Session
+import backend.app.models as models
+from backend.app.access import sync_documents_access, rebuild_access
+
+# Deepest folder allowed (a root folder has depth 0)
+MAX_FOLDER_DEPTH = 32
+
+
+class FolderError(Exception):
+    """An invalid tree operation (cycle, too deep, name taken); the message is meant for the client."""
+
+
+def _is_admin(user: models.User) -> bool:
+    return user.role_id == 0 or getattr(user.role, "name", None) == "admin"
+
+
+def subtree_ids(folder_id: int):
+    """Select of the ids of `folder_id` and every folder below it."""
+    C = models.FolderClosure
+    return select(C.descendant_id).where(C.ancestor_id == folder_id)
+
+
+def subtree_document_ids(folder_id: int):
+    """Select of the ids of the documents filed in `folder_id` or below it."""
+    D = models.Document
+    return select(D.document_id).where(D.folder_id.in_(subtree_ids(folder_id)))
+
+
+def ancestors(db: Session, folder_id: int) -> list[models.Folder]:
+    """The folders from the root down to `folder_id`, itself included."""
+    C = models.FolderClosure
+    F = models.Folder
+    return (db.query(F).join(C, C.ancestor_id == F.folder_id)
+            .filter(C.descendant_id == folder_id).order_by(C.depth.desc()).all())
+
+
+def depth(db: Session, folder_id: int) -> int:
+    C = models.FolderClosure
+    return db.query(C.depth).filter(C.descendant_id == folder_id).order_by(C.depth.desc()).limit(1).scalar() or 0
+
+
+def inherited_departments(db: Session, folder_id: int | None) -> set[int]:
+    """Departments granted on `folder_id` or a folder above it."""
+    if folder_id is None:
+        return set()
+    C = models.FolderClosure
+    P = models.FolderViewPermission
+    return {r[0] for r in db.query(P.department_id).join(C, C.ancestor_id == P.folder_id)
+            .filter(C.descendant_id == folder_id).distinct()}
+
+
+def visible_folder_ids(user: models.User):
+    """Select of the folders `user` may see (all of them for admins: None)."""
+    if _is_admin(user):
+        return None
+    F = models.Folder
+    C = models.FolderClosure
+    P = models.FolderViewPermission
+    if user.department_id is None:
+        return select(F.folder_id).where(literal(False))
+    return select(F.folder_id).where(F.department_id == user.department_id).union(
+        select(C.descendant_id).join(P, P.folder_id == C.ancestor_id).where(P.department_id == user.department_id)
+    )
+
+
+def can_view(db: Session, folder: models.Folder, user: models.User) -> bool:
+    if _is_admin(user) or (user.department_id is not None and folder.department_id == user.department_id):
+        return True
+    return user.department_id is not None and user.department_id in inherited_departments(db, folder.folder_id)
+
+
+def can_manage(folder: models.Folder, user: models.User) -> bool:
+    return _is_admin(user) or (user.department_id is not None and folder.department_id == user.department_id)
+
+
+def _check_name(db: Session, parent_id: int | None, name: str, folder_id: int | None = None) -> None:
+    F = models.Folder
+    q = db.query(F.folder_id).filter(F.parent_id.is_(None) if parent_id is None else F.parent_id == parent_id,
+                                     F.name == name)
+    if folder_id is not None:
+        q = q.filter(F.folder_id != folder_id)
+    if q.first() is not None:
+        raise FolderError(f"a folder named {name!r} already exists there")
+
+
+def create_folder(db: Session, name: str, parent: models.Folder | None, department_id: int,
+                  created_by: int | None) -> models.Folder:
+    """Create a folder under `parent` (None: a root) with its closure rows. Does not commit."""
+    C = models.FolderClosure
+    if parent is not None and depth(db, parent.folder_id) + 1 > MAX_FOLDER_DEPTH:
+        raise FolderError(f"folders cannot be nested more than {MAX_FOLDER_DEPTH} levels deep")
+    _check_name(db, parent.folder_id if parent is not None else None, name)
+    folder = models.Folder(name=name, parent_id=parent.folder_id if parent is not None else None,
+                           department_id=department_id, created_by=created_by)
+    db.add(folder)
+    db.flush()
+    db.execute(insert(C).values(ancestor_id=folder.folder_id, descendant_id=folder.folder_id, depth=0))
+    if parent is not None:
+        db.execute(insert(C).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(C.ancestor_id, literal(folder.folder_id), C.depth + 1).where(C.descendant_id == parent.folder_id),
+        ))
+    return folder
+
+
+def move_folder(db: Session, folder: models.Folder, new_parent: models.Folder | None) -> bool:
+    """Move `folder` and everything below it under `new_parent` (None: make it a root). Does not commit.
+    Returns whether the documents below inherit different grants now (their access was recomputed)."""
+    C = models.FolderClosure
+    new_parent_id = new_parent.folder_id if new_parent is not None else None
+    if new_parent_id == folder.parent_id:
+        return False
+    if new_parent_id is not None:
+        if db.query(exists().where(C.ancestor_id == folder.folder_id, C.descendant_id == new_parent_id)).scalar():
+            raise FolderError("a folder cannot be moved into itself or below itself")
+        height = db.query(C.depth).filter(C.ancestor_id == folder.folder_id).order_by(C.depth.desc()).limit(1).scalar() or 0
+        if depth(db, new_parent_id) + 1 + height > MAX_FOLDER_DEPTH:
+            raise FolderError(f"folders cannot be nested more than {MAX_FOLDER_DEPTH} levels deep")
+    _check_name(db, new_parent_id, folder.name, folder.folder_id)
+    before = inherited_departments(db, folder.parent_id)
+    after = inherited_departments(db, new_parent_id)
+
+    subtree = select(C.descendant_id).where(C.ancestor_id == folder.folder_id).scalar_subquery()
+    # paths from the old ancestors into the subtree
+    db.execute(delete(C).where(C.descendant_id.in_(subtree), C.ancestor_id.notin_(subtree))
+               .execution_options(synchronize_session=False))
+    if new_parent_id is not None:
+        # every new ancestor x every folder of the subtree
+        above = select(C.ancestor_id, C.depth).where(C.descendant_id == new_parent_id).subquery()
+        below = select(C.descendant_id, C.depth).where(C.ancestor_id == folder.folder_id).subquery()
+        db.execute(insert(C).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(above.c.ancestor_id, below.c.descendant_id, above.c.depth + below.c.depth + 1).select_from(above).join(below, true()),
+        ))
+    folder.parent_id = new_parent_id
+    if before == after:
+        return False
+    sync_documents_access(db, subtree_document_ids(folder.folder_id))
+    return True
+
+
+def delete_folder(db: Session, folder: models.Folder) -> list[int]:
+    """Delete `folder` and its subfolders, moving the documents filed below it to its parent. Does not
+    commit. Returns the ids of the documents moved."""
+    D = models.Document
+    F = models.Folder
+    moved = [r[0] for r in db.execute(subtree_document_ids(folder.folder_id)).all()]
+    P = models.FolderViewPermission
+    # grants held anywhere in the subtree stop applying; those from above the parent still do
+    grants_lost = db.query(exists().where(P.folder_id.in_(subtree_ids(folder.folder_id)))).scalar()
+    if moved:
+        db.execute(update(D).where(D.document_id.in_(moved)).values(folder_id=folder.parent_id)
+                   .execution_options(synchronize_session=False))
+    doomed = [r[0] for r in db.execute(subtree_ids(folder.folder_id)).all()]
+    # closure and grant rows go by FK cascade; delete children first for databases without it (SQLite)
+    db.execute(delete(models.FolderClosure).where(models.FolderClosure.descendant_id.in_(doomed)))
+    db.execute(delete(P).where(P.folder_id.in_(doomed)))
+    db.execute(delete(F).where(F.folder_id.in_(doomed)).execution_options(synchronize_session=False))
+    if moved and grants_lost:
+        sync_documents_access(db, moved)
+    return moved
+
+
+def file_documents(db: Session, document_ids: list[int], folder: models.Folder | None) -> None:
+    """File documents into `folder` (None: unfile them) and recompute their access. Does not commit."""
+    D = models.Document
+    if not document_ids:
+        return
+    db.execute(update(D).where(D.document_id.in_(document_ids))
+               .values(folder_id=folder.folder_id if folder is not None else None)
+               .execution_options(synchronize_session=False))
+    sync_documents_access(db, document_ids)
+
+
+def set_folder_grant(db: Session, folder: models.Folder, department_id: int, granted: bool) -> bool:
+    """Grant or revoke a department's view access to everything below `folder`. Does not commit.
+    Returns whether anything changed."""
+    P = models.FolderViewPermission
+    existing = db.get(P, (folder.folder_id, department_id))
+    if granted == (existing is not None):
+        return False
+    if granted:
+        db.add(P(folder_id=folder.folder_id, department_id=department_id))
+    else:
+        db.delete(existing)
+    sync_documents_access(db, subtree_document_ids(folder.folder_id))
+    return True
+
+
+def _expected_closure():
+    """Select of the (ancestor_id, descendant_id, depth) rows that `folders.parent_id` alone implies.
+    Stops at MAX_FOLDER_DEPTH, so that a cycle in parent_id cannot recurse forever."""
+    F = models.Folder
+    paths = select(F.folder_id.label("ancestor_id"), F.folder_id.label("descendant_id"),
+                   literal(0).label("depth")).cte("paths", recursive=True)
+    paths = paths.union_all(
+        select(paths.c.ancestor_id, F.folder_id, paths.c.depth + 1)
+        .join(F, F.parent_id == paths.c.descendant_id).where(paths.c.depth < MAX_FOLDER_DEPTH)
+    )
+    return select(paths.c.ancestor_id, paths.c.descendant_id, paths.c.depth)
+
+
+def check_closure(db: Session, limit: int = 1000) -> dict:
+    """Compare `folder_closure` against the tree of `folders.parent_id`.
+    Returns up to `limit` missing and extra (ancestor_id, descendant_id, depth) rows each."""
+    C = models.FolderClosure
+    expected_q = _expected_closure()
+    actual_q = select(C.ancestor_id, C.descendant_id, C.depth)
+    missing = db.execute(except_(expected_q, actual_q).limit(limit)).all()
+    extra = db.execute(except_(actual_q, expected_q).limit(limit)).all()
+    return {
+        "missing": [{"ancestor_id": a, "descendant_id": d, "depth": n} for a, d, n in missing],
+        "extra": [{"ancestor_id": a, "descendant_id": d, "depth": n} for a, d, n in extra],
+    }
+
+
+def rebuild_closure(db: Session) -> int:
+    """Repopulate `folder_closure` from `folders.parent_id`. Does not commit, nor rebuild the access table,
+    which inherits folder grants through it. Returns the number of rows written."""
+    C = models.FolderClosure
+    paths = _expected_closure().subquery()
+    cyclic = db.execute(select(paths.c.ancestor_id)
+                        .where(paths.c.ancestor_id == paths.c.descendant_id, paths.c.depth > 0).limit(1)).scalar()
+    if cyclic is not None:
+        raise FolderError(f"folder {cyclic} is its own ancestor by parent_id; fix parent_id first")
+    db.execute(delete(C))
+    db.execute(insert(C).from_select(["ancestor_id", "descendant_id", "depth"], _expected_closure()))
+    return db.query(C).count()
+
+
+def main(argv: list[str]) -> int:
+    from backend.app.database import SessionLocal, init_db
+
+    if len(argv) != 1 or argv[0] not in ("check", "rebuild"):
+        print("usage: python -m backend.app.folders check|rebuild", file=sys.stderr)
+        return 2
+    init_db()
+    db = SessionLocal()
+    try:
+        if argv[0] == "rebuild":
+            try:
+                rows = rebuild_closure(db)
+            except FolderError as exc:
+                print(f"error: {exc}", file=sys.stderr)
+                return 1
+            access_rows = rebuild_access(db)
+            db.commit()
+            print(f"rebuilt folder_closure: {rows} rows, department_document_access: {access_rows} rows")
+            return 0
+        report = check_closure(db)
+        print(f"missing: {len(report['missing'])}  extra: {len(report['extra'])}")
+        for row in report["missing"]:
+            print(f"  missing ancestor={row['ancestor_id']} descendant={row['descendant_id']} depth={row['depth']}")
+        for row in report["extra"]:
+            print(f"  extra   ancestor={row['ancestor_id']} descendant={row['descendant_id']} depth={row['depth']}")
+        return 1 if report["missing"] or report["extra"] else 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -2,14 +2,57 @@ import os
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from backend.app.database import init_db
-from backend.app.routers import documents_router, tags_router, permissions_router, auth_router, admin_router
+from fastapi.responses import FileResponse, Response
+from backend.app.database import init_db, engine, FAST_START
+from backend.app.metrics import MetricsMiddleware, instrument_engine, render_metrics
+from backend.app.tracing import TracingMiddleware, configure_tracing
+from backend.app.profiling import ProfilingMiddleware
+from backend.app.retention import start_sweeper
+from backend.app.storage import start_tiering, stop_tiering
+from backend.app.changelog import start_compactor
+from backend.app.uploads import start_cleanup
+from backend.app.trash import start_purger
+from backend.app.audit import start_writer as start_audit_writer, stop_writer as stop_audit_writer
+from backend.app.server import prepare_worker, on_exit_signal
+from backend.app.events import close_streams
+from backend.app.routers import documents_router, tags_router, permissions_router, auth_router, admin_router, events_router, uploads_router, folders_router
 
 async def lifespan(app: FastAPI):
-    # Create tables
-    init_db()
+    # Create tables (skipped with FAST_START: the schema check is DDL round trips on every boot)
+    if not FAST_START:
+        init_db()
+    # threadpool size and pre-warmed pools, before this worker accepts connections (backend.app.server)
+    await prepare_worker()
+    # end open event streams as soon as the worker is told to stop, so they do not hold up the drain
+    on_exit_signal(close_streams)
+    # periodic version retention sweep (RETENTION_SWEEP_INTERVAL_SECONDS, 0 disables)
+    stop_sweeper = start_sweeper()
+    # batched last-access writes and cold-tier migration (TIERING_INTERVAL_SECONDS)
+    tiering = start_tiering()
+    # change log compaction (CHANGE_LOG_COMPACT_INTERVAL_SECONDS)
+    stop_compactor = start_compactor()
+    # expired resumable upload sessions (UPLOAD_CLEANUP_INTERVAL_SECONDS)
+    stop_cleanup = start_cleanup()
+    # thumbnails and text snippets of new contents (PREVIEW_INTERVAL_SECONDS); imported here, as the
+    # upload and preview endpoints do, so that importing the app does not
+    from backend.app.previews import start_generator, stop_generator
+    stop_previews = start_generator()
+    # purge of documents and versions trashed TRASH_RETENTION_DAYS ago (TRASH_PURGE_INTERVAL_SECONDS)
+    stop_purger = start_purger()
+    # batched audit log writes (AUDIT_SINK, AUDIT_FLUSH_INTERVAL_SECONDS)
+    stop_audit = start_audit_writer()
     yield
+    if stop_sweeper is not None:
+        stop_sweeper.set()
+    if stop_compactor is not None:
+        stop_compactor.set()
+    if stop_cleanup is not None:
+        stop_cleanup.set()
+    if stop_purger is not None:
+        stop_purger.set()
+    stop_generator(stop_previews)
+    stop_tiering(tiering)
+    stop_audit_writer(stop_audit)
 
 app = FastAPI(title="Document Repository", lifespan=lifespan)
 
@@ -20,8 +63,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # read by the dashboard after an upload (backend.app.dedup)
+    expose_headers=["X-Duplicate-Of", "X-Upload-Deduplicated"],
 )
 
+# opt-in profiling of single requests (X-Profile header, switched on via /admin/profiling)
+app.add_middleware(ProfilingMiddleware)
+
+# request spans (TRACING_EXPORTER selects where they go; no-op when unset)
+configure_tracing()
+app.add_middleware(TracingMiddleware)
+
+# request/DB metrics (outermost middleware so CORS handling is timed too), exposed at /metrics
+app.add_middleware(MetricsMiddleware)
+instrument_engine(engine)
+
 # mount frontend static build if present (serves index.html)
 frontend_dir = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "..", "frontend", "static-site"))
 if os.path.isdir(frontend_dir):
@@ -33,6 +89,9 @@ app.include_router(auth_router, prefix="/auth", tags=["auth"])
 app.include_router(documents_router, prefix="/documents", tags=["documents"])
 app.include_router(tags_router, prefix="/tags", tags=["tags"])
 app.include_router(permissions_router, prefix="/permissions", tags=["permissions"])
+app.include_router(events_router, prefix="/events", tags=["events"])
+app.include_router(uploads_router, prefix="/uploads", tags=["uploads"])
+app.include_router(folders_router, prefix="/folders", tags=["folders"])
 
 @app.get("/", include_in_schema=False)
 def index():
@@ -40,4 +99,9 @@ def index():
     index_path = os.path.join(frontend_dir, "dashboard.html")
     if os.path.isfile(index_path):
         return FileResponse(index_path)
-    return {"message": "Welcome to the Document Repository API"}
\ No newline at end of file
+    return {"message": "Welcome to the Document Repository API"}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
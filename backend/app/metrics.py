@@ -0,0 +1,140 @@
+"""Prometheus metrics for the API and its database usage.
+
+MetricsMiddleware times every request by route template and tracks in-flight requests;
+instrument_engine() hooks SQLAlchemy cursor events to count and time the statements each
+request issues and to log slow statements together with the route that ran them.
+Upload/download byte counters are fed by the document endpoints, payload cache counters by
+backend.app.payload_cache, audit counters by backend.app.audit. Everything is exposed at
+GET /metrics in the Prometheus text format.
+"""
+import contextvars
+import logging
+import os
+import time
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+logger = logging.getLogger("backend.app.metrics")
+
+# Statements slower than this many seconds are logged with their route; 0 disables the log
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", 0.5))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests", ["method", "route", "status"])
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency", ["method", "route"], buckets=LATENCY_BUCKETS)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served")
+DB_QUERIES = Counter("db_queries_total", "SQL statements executed", ["route"])
+DB_QUERY_SECONDS = Counter("db_query_seconds_total", "Time spent executing SQL statements", ["route"])
+DB_QUERIES_PER_REQUEST = Histogram("db_queries_per_request", "SQL statements per HTTP request", ["route"], buckets=QUERY_COUNT_BUCKETS)
+DB_SLOW_QUERIES = Counter("db_slow_queries_total", "SQL statements slower than SLOW_QUERY_SECONDS", ["route"])
+DB_POOL_SIZE = Gauge("db_pool_size", "Configured connection pool size")
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections currently checked out of the pool")
+DB_POOL_OVERFLOW = Gauge("db_pool_overflow", "Connections opened beyond the pool size")
+UPLOAD_BYTES = Counter("document_upload_bytes_total", "Bytes received in document uploads")
+DOWNLOAD_BYTES = Counter("document_download_bytes_total", "Bytes sent in document downloads")
+PAYLOAD_CACHE_REQUESTS = Counter("payload_cache_requests_total", "Version payload cache lookups", ["result"])
+PAYLOAD_CACHE_EVICTIONS = Counter("payload_cache_evictions_total", "Payloads evicted from the in-memory cache")
+PAYLOAD_CACHE_BYTES = Gauge("payload_cache_bytes", "Bytes held by the in-memory payload cache")
+AUDIT_EVENTS = Counter("audit_events_total", "Audit events by what became of them", ["outcome"])
+AUDIT_BUFFERED = Gauge("audit_events_buffered", "Audit events waiting in memory to be written")
+DIFF_CACHE_REQUESTS = Counter("diff_cache_requests_total", "Version diffs served from the diff cache or computed", ["result"])
+
+
+class _RequestStats:
+    __slots__ = ("scope", "queries", "seconds")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.queries = 0
+        self.seconds = 0.0
+
+
+# Stats of the request being served. Starlette copies the context into the threadpool that runs
+# sync endpoints and dependencies, so cursor events fired there see the right request.
+_request_stats: contextvars.ContextVar = contextvars.ContextVar("request_stats", default=None)
+
+
+def route_label(scope) -> str:
+    """Route template (e.g. /documents/{document_id}/versions) instead of the raw path, to bound label cardinality."""
+    route = scope.get("route")
+    if route is not None:
+        return getattr(route, "path", "unmatched")
+    # mounts (static files) only leave their prefix in root_path
+    return scope.get("root_path") or "unmatched"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware (no per-request task or body buffering) recording request metrics."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = _RequestStats(scope)
+        token = _request_stats.set(stats)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_FLIGHT.dec()
+            _request_stats.reset(token)
+            route = route_label(scope)
+            HTTP_LATENCY.labels(scope["method"], route).observe(elapsed)
+            HTTP_REQUESTS.labels(scope["method"], route, str(status[0])).inc()
+            DB_QUERIES_PER_REQUEST.labels(route).observe(stats.queries)
+            if stats.queries:
+                DB_QUERIES.labels(route).inc(stats.queries)
+                DB_QUERY_SECONDS.labels(route).inc(stats.seconds)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.seconds += elapsed
+    if SLOW_QUERY_SECONDS and elapsed >= SLOW_QUERY_SECONDS:
+        route = route_label(stats.scope) if stats is not None else "background"
+        DB_SLOW_QUERIES.labels(route).inc()
+        logger.warning("slow query (%.3fs) on %s: %s", elapsed, route, " ".join(statement.split())[:1000])
+
+
+def instrument_engine(engine) -> None:
+    """Attach query timing hooks and pool gauges to a SQLAlchemy engine."""
+    from sqlalchemy import event
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    pool = engine.pool
+    # read at scrape time only; pools without sizing (e.g. SQLite's SingletonThreadPool) report 0
+    DB_POOL_SIZE.set_function(lambda: getattr(pool, "size", lambda: 0)())
+    DB_POOL_CHECKED_OUT.set_function(lambda: getattr(pool, "checkedout", lambda: 0)())
+    DB_POOL_OVERFLOW.set_function(lambda: max(0, getattr(pool, "overflow", lambda: 0)()))
+
+
+def record_upload(n_bytes: int) -> None:
+    UPLOAD_BYTES.inc(n_bytes)
+
+
+def record_download(n_bytes: int) -> None:
+    DOWNLOAD_BYTES.inc(n_bytes)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
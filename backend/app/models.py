@@ -1,5 +1,6 @@
 from sqlalchemy import (
-    Column, Integer, String, Text, Boolean, Date, TIMESTAMP, LargeBinary, BigInteger, ForeignKey, UniqueConstraint
+    Column, Integer, String, Text, Boolean, Date, TIMESTAMP, LargeBinary, BigInteger, ForeignKey, UniqueConstraint, Index,
+    CheckConstraint, DDL, event
 )
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
@@ -41,7 +42,25 @@ class User(Base):
     department = relationship("Department", back_populates="users")
     role = relationship("Role", back_populates="users")
     # one-to-many relationship with DocumentVersion
-    uploaded_versions = relationship("DocumentVersion", back_populates="uploader")
+    uploaded_versions = relationship("DocumentVersion", back_populates="uploader", foreign_keys="DocumentVersion.uploader_id")
+
+# lower-cased full name as matched by the uploader search (must stay identical to use the index below)
+def user_full_name_lower(U=User):
+    return func.lower(func.coalesce(U.first_name, '') + ' ' + func.coalesce(U.last_name, ''))
+
+# Uploader search indexes on PostgreSQL: trigram for "contains", text_pattern_ops for "prefix".
+# create_all only builds them for new tables; existing databases apply db_migrations/002_uploader_search_indexes.sql
+event.listen(User.__table__, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+event.listen(User.__table__, "after_create", DDL(
+    "CREATE INDEX IF NOT EXISTS ix_users_username_prefix ON users (lower(username) text_pattern_ops)"
+).execute_if(dialect="postgresql"))
+event.listen(User.__table__, "after_create", DDL(
+    "CREATE INDEX IF NOT EXISTS ix_users_username_trgm ON users USING gin (lower(username) gin_trgm_ops)"
+).execute_if(dialect="postgresql"))
+event.listen(User.__table__, "after_create", DDL(
+    "CREATE INDEX IF NOT EXISTS ix_users_full_name_trgm ON users USING gin "
+    "(lower(coalesce(first_name, '') || ' ' || coalesce(last_name, '')) gin_trgm_ops)"
+).execute_if(dialect="postgresql"))
 
 class Document(Base):
     __tablename__ = "documents"
@@ -53,6 +72,12 @@ class Document(Base):
     latest_version_number = Column(Integer)
     is_public = Column(Boolean, nullable=False, default=True)
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    # folder the document is filed in (NULL: unfiled); view grants of the folder and its ancestors apply
+    folder_id = Column(Integer, ForeignKey("folders.folder_id", ondelete="SET NULL"), index=True)
+    # set while the document is in the trash (backend.app.trash): it has no access rows, so every
+    # access-filtered query skips it; purged for good TRASH_RETENTION_DAYS later
+    deleted_at = Column(TIMESTAMP(timezone=True))
+    deleted_by = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL"))
     # one-to-many relationship with DocumentVersion
     versions = relationship(
         "DocumentVersion",
@@ -68,6 +93,10 @@ class Document(Base):
     # one-to-many relationship with document_tags and document_view_permissions
     tags = relationship("Tag", secondary="document_tags", back_populates="documents")
     allowed_departments = relationship("Department", secondary="document_view_permissions", back_populates="accessible_documents")
+    # only trashed rows are indexed: the trash view and the purge job scan them, live rows never need it
+    __table_args__ = (
+        Index('ix_documents_trashed', 'deleted_at', postgresql_where=deleted_at.isnot(None), sqlite_where=deleted_at.isnot(None)),
+    )
 
 class DocumentVersion(Base):
     __tablename__ = "document_versions"
@@ -80,11 +109,27 @@ class DocumentVersion(Base):
     file_data = Column(LargeBinary)
     file_size = Column(BigInteger)
     upload_date = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    # "hot": bytes in file_data; "cold": file_data is NULL and the bytes live under storage_key in the
+    # cold store (backend.app.storage); "linked": the bytes are those of the version whose id is in
+    # storage_key (backend.app.dedup). last_accessed_at is written in batches, not on every download.
+    storage_tier = Column(String(8), nullable=False, default="hot", server_default="hot")
+    storage_key = Column(Text)
+    last_accessed_at = Column(TIMESTAMP(timezone=True))
+    # hex SHA-256 of the payload, for duplicate detection (NULL for versions stored before it was recorded)
+    content_sha256 = Column(String(64))
+    # set while the version is in the trash (the latest version of a document never is)
+    deleted_at = Column(TIMESTAMP(timezone=True))
+    deleted_by = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL"))
     # many-to-one relationship with Document and User
     document = relationship("Document", back_populates="versions")
-    uploader = relationship("User", back_populates="uploaded_versions")
-    # Ensure unique version numbers per document
-    __table_args__ = (UniqueConstraint('document_id', 'version_number', name='uix_doc_version'),)
+    uploader = relationship("User", back_populates="uploaded_versions", foreign_keys=[uploader_id])
+    # Ensure unique version numbers per document; (uploader_id, document_id) serves the any-version uploader filter
+    __table_args__ = (
+        UniqueConstraint('document_id', 'version_number', name='uix_doc_version'),
+        Index('ix_document_versions_uploader_document', 'uploader_id', 'document_id'),
+        Index('ix_document_versions_content_sha256', 'content_sha256'),
+        Index('ix_document_versions_trashed', 'deleted_at', postgresql_where=deleted_at.isnot(None), sqlite_where=deleted_at.isnot(None)),
+    )
 
 class Tag(Base):
     __tablename__ = "tags"
@@ -97,6 +142,8 @@ class DocumentTag(Base):
     __tablename__ = "document_tags"
     document_id = Column(Integer, ForeignKey("documents.document_id", ondelete="CASCADE"), primary_key=True)
     tag_id = Column(Integer, ForeignKey("tags.tag_id", ondelete="CASCADE"), primary_key=True)
+    # PK is (document_id, tag_id); tag filters and facets need the reverse direction
+    __table_args__ = (Index('ix_document_tags_tag_document', 'tag_id', 'document_id'),)
 
 class DocumentViewPermission(Base):
     __tablename__ = "document_view_permissions"
@@ -107,3 +154,133 @@ class DocumentEditPermission(Base):
     __tablename__ = "document_edit_permissions"
     document_id = Column(Integer, ForeignKey("documents.document_id", ondelete="CASCADE"), primary_key=True)
     user_id = Column(Integer, ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
+
+class Folder(Base):
+    # Folder tree (backend.app.folders). parent_id is the tree; folder_closure holds every ancestor/descendant
+    # pair so that subtree queries are one indexed join instead of a recursive walk.
+    __tablename__ = "folders"
+    folder_id = Column(Integer, primary_key=True)
+    parent_id = Column(Integer, ForeignKey("folders.folder_id", ondelete="CASCADE"), index=True)
+    name = Column(String(255), nullable=False)
+    # members of the owning department manage the folder and see it
+    department_id = Column(Integer, ForeignKey("departments.department_id", ondelete="RESTRICT"), nullable=False, index=True)
+    created_by = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL"))
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    __table_args__ = (UniqueConstraint('parent_id', 'name', name='uq_folders_parent_name'),)
+
+class FolderClosure(Base):
+    # One row per (ancestor, descendant) pair of the folder tree, (f, f) included at depth 0
+    __tablename__ = "folder_closure"
+    ancestor_id = Column(Integer, ForeignKey("folders.folder_id", ondelete="CASCADE"), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey("folders.folder_id", ondelete="CASCADE"), primary_key=True)
+    depth = Column(Integer, nullable=False)
+    # PK serves "everything below"; this one "everything above" (breadcrumbs, inherited grants)
+    __table_args__ = (Index('ix_folder_closure_descendant', 'descendant_id', 'ancestor_id'),)
+
+class FolderViewPermission(Base):
+    # Department view grant on a folder, inherited by every document below it (materialized into
+    # department_document_access like document grants)
+    __tablename__ = "folder_view_permissions"
+    folder_id = Column(Integer, ForeignKey("folders.folder_id", ondelete="CASCADE"), primary_key=True)
+    department_id = Column(Integer, ForeignKey("departments.department_id", ondelete="CASCADE"), primary_key=True, index=True)
+
+class DepartmentDocumentAccess(Base):
+    # Materialized view-access table: one row per (department, visible document).
+    # department_id 0 is the "everyone" bucket holding public documents (same convention as role_id 0 for admin),
+    # so it carries no FK to departments. Maintained incrementally by backend.app.access.
+    __tablename__ = "department_document_access"
+    department_id = Column(Integer, primary_key=True)
+    document_id = Column(Integer, ForeignKey("documents.document_id", ondelete="CASCADE"), primary_key=True, index=True)
+
+class RetentionPolicy(Base):
+    # Version retention for the documents of one department or carrying one tag (exactly one of the two).
+    # A version is kept if any rule of any policy applying to its document keeps it; the latest version
+    # is always kept and documents without a policy keep everything. Applied by backend.app.retention.
+    __tablename__ = "retention_policies"
+    policy_id = Column(Integer, primary_key=True, index=True)
+    department_id = Column(Integer, ForeignKey("departments.department_id", ondelete="CASCADE"), unique=True)
+    tag_id = Column(Integer, ForeignKey("tags.tag_id", ondelete="CASCADE"), unique=True)
+    # keep the newest N versions
+    keep_last = Column(Integer)
+    # keep versions uploaded in the last N days
+    keep_days = Column(Integer)
+    # keep the newest version of each of the last N calendar months (monthly snapshots)
+    keep_monthly = Column(Integer)
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    __table_args__ = (
+        CheckConstraint("(department_id IS NULL) <> (tag_id IS NULL)", name="ck_retention_policy_scope"),
+    )
+
+class DocumentChange(Base):
+    # Change log behind GET /documents/changes (backend.app.changelog): one row per change to a document,
+    # written in the same transaction as the change. change_id is the clients' sync cursor. No FK to
+    # documents, so entries can outlive the rows they describe.
+    __tablename__ = "document_changes"
+    change_id = Column(Integer, primary_key=True)
+    document_id = Column(Integer, nullable=False, index=True)
+    # created | updated | tags | versions | publicity | permissions | folder | deleted | restored | purged
+    change_type = Column(String(16), nullable=False)
+    # the change may have taken access away from someone (kept through compaction)
+    access_changed = Column(Boolean, nullable=False, default=False)
+    changed_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), index=True)
+
+class ContentPreview(Base):
+    # Thumbnail and text snippet of a distinct version content (backend.app.previews), shared by every
+    # version with that content hash. A missing row means the preview is still to be generated.
+    __tablename__ = "content_previews"
+    content_sha256 = Column(String(64), primary_key=True)
+    # ready | unsupported | too_large | failed
+    status = Column(String(12), nullable=False)
+    # image | pdf | text | binary
+    kind = Column(String(12), nullable=False)
+    thumbnail = Column(LargeBinary)
+    thumbnail_type = Column(String(32))
+    snippet = Column(Text)
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+
+class UploadSession(Base):
+    # Resumable upload in progress (backend.app.uploads). The bytes are staged in a file on disk and
+    # become a DocumentVersion on finalize, in the transaction that deletes the session.
+    __tablename__ = "upload_sessions"
+    upload_id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.user_id", ondelete="CASCADE"), nullable=False, index=True)
+    # append a version to this document; NULL: create one (or append by title, as /documents/upload does)
+    document_id = Column(Integer, ForeignKey("documents.document_id", ondelete="CASCADE"))
+    title = Column(Text)
+    file_name = Column(Text)
+    is_public = Column(Boolean, nullable=False, default=True)
+    size = Column(BigInteger, nullable=False)
+    chunk_size = Column(Integer, nullable=False)
+    # optional SHA-256 of the whole file, checked on finalize
+    sha256 = Column(String(64))
+    # open | finalizing
+    status = Column(String(12), nullable=False, default="open")
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=False, index=True)
+
+class UploadChunk(Base):
+    # A chunk of an upload session that is on disk (written and fsynced), with its verified SHA-256
+    __tablename__ = "upload_chunks"
+    upload_id = Column(String(32), ForeignKey("upload_sessions.upload_id", ondelete="CASCADE"), primary_key=True)
+    chunk_index = Column(Integer, primary_key=True)
+    size = Column(Integer, nullable=False)
+    sha256 = Column(String(64), nullable=False)
+
+class AuditEvent(Base):
+    # Who downloaded or changed which document (backend.app.audit). Append-only and written in batches
+    # after the fact, so occurred_at (the time of the request) is what orders entries. No FKs: entries
+    # outlive the users, documents and versions they name.
+    __tablename__ = "audit_log"
+    event_id = Column(Integer, primary_key=True)
+    occurred_at = Column(TIMESTAMP(timezone=True), nullable=False, index=True)
+    user_id = Column(Integer)
+    # download | created | updated | publicity | view_grant | view_revoke | edit_grant | edit_revoke | tags
+    # | folder | deleted | restored | version_deleted | version_restored
+    action = Column(String(16), nullable=False)
+    document_id = Column(Integer)
+    version_id = Column(Integer)
+    detail = Column(Text)
+    __table_args__ = (
+        Index("ix_audit_log_document", "document_id", "occurred_at"),
+        Index("ix_audit_log_user", "user_id", "occurred_at"),
+    )
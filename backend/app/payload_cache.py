@@ -0,0 +1,250 @@
+"""Byte-bounded LRU cache of version payloads, with an optional local disk tier.
+
+Version payloads never change once written, so entries need no invalidation: the download endpoint
+looks the version row up before asking the cache, so entries of deleted versions are never served and
+age out (retention also discards them, in case the database reuses the ids).
+Memory holds at most PAYLOAD_CACHE_BYTES; payloads larger than PAYLOAD_CACHE_MAX_ITEM_BYTES are
+never cached. With PAYLOAD_CACHE_DIR set, payloads evicted from memory stay on local disk and are
+promoted back on their next read. The workers of a host share the directory: each reads from it what
+any of them wrote, keeps recency in the files' mtime, and re-reads the directory before evicting once
+its index is DISK_RESCAN_SECONDS old, so PAYLOAD_CACHE_DISK_BYTES bounds all of them together.
+
+Concurrent misses for the same key are collapsed: one thread loads, the others wait for its result,
+so a burst of downloads of a cold template costs one database read.
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from backend.app.metrics import PAYLOAD_CACHE_REQUESTS, PAYLOAD_CACHE_BYTES, PAYLOAD_CACHE_EVICTIONS
+
+logger = logging.getLogger("backend.app.payload_cache")
+
+PAYLOAD_CACHE_BYTES_LIMIT = int(os.getenv("PAYLOAD_CACHE_BYTES", 64 * 1024 * 1024))
+PAYLOAD_CACHE_MAX_ITEM_BYTES = int(os.getenv("PAYLOAD_CACHE_MAX_ITEM_BYTES", 8 * 1024 * 1024))
+PAYLOAD_CACHE_DIR = os.getenv("PAYLOAD_CACHE_DIR", "")
+PAYLOAD_CACHE_DISK_BYTES = int(os.getenv("PAYLOAD_CACHE_DISK_BYTES", 1024 * 1024 * 1024))
+# Age of a worker's index of the disk tier after which it is read again before evicting
+DISK_RESCAN_SECONDS = 60
+
+
+class _Loading:
+    __slots__ = ("done", "data", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.data = None
+        self.error = None
+
+
+class PayloadCache:
+    def __init__(self, max_bytes: int = PAYLOAD_CACHE_BYTES_LIMIT, max_item_bytes: int = PAYLOAD_CACHE_MAX_ITEM_BYTES,
+                 disk_dir: str = PAYLOAD_CACHE_DIR, disk_max_bytes: int = PAYLOAD_CACHE_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = min(max_item_bytes, max_bytes)
+        self._items: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._loading: dict = {}
+        self.hits = self.disk_hits = self.misses = self.evictions = 0
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = disk_max_bytes
+        # LRU index of the disk tier: key -> size
+        self._disk: OrderedDict = OrderedDict()
+        self._disk_bytes = 0
+        self._disk_scanned = 0.0
+        if self.disk_dir:
+            self._load_disk_index()
+
+    # -- disk tier -----------------------------------------------------------------------------
+    def _disk_path(self, key) -> str:
+        return os.path.join(self.disk_dir, f"{key}.bin")
+
+    def _load_disk_index(self) -> None:
+        # at start and then under the lock: what is on disk, whichever worker wrote it
+        os.makedirs(self.disk_dir, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".bin"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.disk_dir, name))
+            except FileNotFoundError:
+                continue
+            key = name[:-4]
+            entries.append((st.st_mtime, int(key) if key.isdigit() else key, st.st_size))
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._disk_scanned = time.monotonic()
+
+    def _disk_adopt(self, key, size: int) -> None:
+        # a file this worker reads or finds: most recently used, here and (mtime) for the others
+        try:
+            os.utime(self._disk_path(key))
+        except OSError:
+            pass
+        with self._lock:
+            self._disk_bytes += size - self._disk.pop(key, 0)
+            self._disk[key] = size
+
+    def _disk_get(self, key) -> bytes | None:
+        # the directory, not the index, says what is cached: other workers write to it too
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self._disk_bytes -= self._disk.pop(key, 0)
+            return None
+        self._disk_adopt(key, len(data))
+        return data
+
+    def _disk_put(self, key, data: bytes) -> None:
+        if len(data) > self.disk_max_bytes:
+            return
+        if os.path.exists(self._disk_path(key)):
+            # payloads never change: whoever wrote it wrote the same bytes
+            self._disk_adopt(key, len(data))
+            return
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._disk_path(key))
+        except OSError:
+            logger.exception("could not write payload cache file for %s", key)
+            return
+        doomed = []
+        with self._lock:
+            if time.monotonic() - self._disk_scanned > DISK_RESCAN_SECONDS:
+                # so that the limit holds for the files of all workers together
+                self._load_disk_index()
+            self._disk_bytes += len(data) - self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            while self._disk_bytes > self.disk_max_bytes and self._disk:
+                old, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                doomed.append(old)
+        for old in doomed:
+            try:
+                os.remove(self._disk_path(old))
+            except FileNotFoundError:
+                pass
+
+    # -- memory tier ---------------------------------------------------------------------------
+    def get(self, key) -> bytes | None:
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+                return data
+        return None
+
+    def put(self, key, data: bytes) -> None:
+        if len(data) > self.max_item_bytes:
+            return
+        evicted = []
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                old_key, old_data = self._items.popitem(last=False)
+                self._bytes -= len(old_data)
+                self.evictions += 1
+                evicted.append((old_key, old_data))
+        if evicted:
+            PAYLOAD_CACHE_EVICTIONS.inc(len(evicted))
+        if self.disk_dir:
+            for old_key, old_data in evicted:
+                self._disk_put(old_key, old_data)
+
+    def get_or_load(self, key, loader) -> tuple[bytes, str]:
+        """Payload for `key`, calling loader() on a miss. Returns (data, "memory" | "disk" | "load")."""
+        data = self.get(key)
+        if data is not None:
+            self._count("memory")
+            return data, "memory"
+        with self._lock:
+            pending = self._loading.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._loading[key] = _Loading()
+        if not owner:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            self._count("memory")
+            return pending.data, "memory"
+        try:
+            source = "load"
+            data = self._disk_get(key) if self.disk_dir else None
+            if data is not None:
+                source = "disk"
+            else:
+                data = loader()
+            self.put(key, data)
+            pending.data = data
+            self._count(source)
+            return data, source
+        except BaseException as exc:
+            pending.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+            pending.done.set()
+
+    def _count(self, source: str) -> None:
+        with self._lock:
+            if source == "memory":
+                self.hits += 1
+            elif source == "disk":
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+        PAYLOAD_CACHE_REQUESTS.labels("hit" if source == "memory" else "disk_hit" if source == "disk" else "miss").inc()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_ratio": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "items": len(self._items), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                "disk_items": len(self._disk), "disk_bytes": self._disk_bytes,
+            }
+
+    def discard(self, keys) -> None:
+        """Drop entries of deleted versions (their ids may be reused by databases that recycle rowids)."""
+        keys = list(keys)
+        with self._lock:
+            for key in keys:
+                data = self._items.pop(key, None)
+                if data is not None:
+                    self._bytes -= len(data)
+                self._disk_bytes -= self._disk.pop(key, 0)
+        if not self.disk_dir:
+            return
+        # whichever worker wrote them
+        for key in keys:
+            try:
+                os.remove(self._disk_path(key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+
+payload_cache = PayloadCache()
+PAYLOAD_CACHE_BYTES.set_function(lambda: payload_cache._bytes)
@@ -0,0 +1,315 @@
+"""Version previews: a small thumbnail and a text snippet per distinct content.
+
+Previews are keyed by content hash (document_versions.content_sha256, see backend.app.dedup): versions
+with the same bytes share one, and a preview never changes once generated. That makes them cacheable
+for good: GET /documents/versions/{id}/preview (status, kind, snippet) and .../thumbnail are served
+with the hash as ETag and Cache-Control max-age PREVIEW_CACHE_SECONDS, immutable.
+
+A background thread generates the previews that are missing, up to PREVIEW_BATCH_SIZE contents every
+PREVIEW_INTERVAL_SECONDS (one worker at a time), and right after an upload for the contents that worker
+received (request()). Only local libraries are used; what a preview holds depends on the content:
+
+    image   thumbnail of at most PREVIEW_THUMBNAIL_PX pixels a side (needs Pillow)
+    pdf     the first page rendered as a thumbnail (needs pypdfium2 and Pillow) and its text (pypdfium2)
+    text    the first PREVIEW_SNIPPET_CHARS characters, whitespace collapsed
+
+Contents the installed libraries cannot preview are marked unsupported, payloads larger than
+PREVIEW_MAX_SOURCE_BYTES too_large. Previews of contents no version has any more are pruned. By hand
+(`reset` drops previews of a status, e.g. after installing Pillow, so they are generated again):
+
+    python -m backend.app.previews generate
+    python -m backend.app.previews reset unsupported
+"""
+import argparse
+import io
+import logging
+import mimetypes
+import os
+import sys
+import threading
+import time
+from sqlalchemy import delete, exists, func
+from sqlalchemy.orm import Session
+import backend.app.models as models
+from backend.app.database import insert_ignore
+from backend.app.storage import peek_version_data
+
+logger = logging.getLogger("backend.app.previews")
+
+PREVIEW_INTERVAL_SECONDS = float(os.getenv("PREVIEW_INTERVAL_SECONDS", 60))
+PREVIEW_BATCH_SIZE = int(os.getenv("PREVIEW_BATCH_SIZE", 20))
+PREVIEW_THUMBNAIL_PX = int(os.getenv("PREVIEW_THUMBNAIL_PX", 256))
+PREVIEW_SNIPPET_CHARS = int(os.getenv("PREVIEW_SNIPPET_CHARS", 500))
+PREVIEW_MAX_SOURCE_BYTES = int(os.getenv("PREVIEW_MAX_SOURCE_BYTES", 50 * 1024 ** 2))
+PREVIEW_CACHE_SECONDS = int(os.getenv("PREVIEW_CACHE_SECONDS", 365 * 24 * 3600))
+# Arbitrary key for the PostgreSQL advisory lock making sure only one worker runs a full pass at a time
+PREVIEW_LOCK_KEY = 7306
+
+READY = "ready"
+UNSUPPORTED = "unsupported"
+TOO_LARGE = "too_large"
+FAILED = "failed"
+
+_IMAGE_MAGIC = (b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff", b"GIF87a", b"GIF89a", b"BM", b"II*\x00", b"MM\x00*")
+
+
+def sniff(data: bytes, file_name: str | None) -> str:
+    """image | pdf | text | binary, from the content first and the file name second."""
+    if data.startswith(b"%PDF-"):
+        return "pdf"
+    if data.startswith(_IMAGE_MAGIC) or (data[:4] == b"RIFF" and data[8:12] == b"WEBP"):
+        return "image"
+    mime = mimetypes.guess_type(file_name or "")[0] or ""
+    if mime == "application/pdf":
+        return "pdf"
+    if mime.startswith("image/"):
+        return "image"
+    if data and _decode_head(data) is not None:
+        return "text"
+    return "binary"
+
+
+def _decode_head(data: bytes) -> str | None:
+    """The start of `data` as text, or None if it does not look like UTF-8 text."""
+    head = data[:PREVIEW_SNIPPET_CHARS * 4]
+    if b"\x00" in head:
+        return None
+    try:
+        return head.decode("utf-8-sig")
+    except UnicodeDecodeError as e:
+        # a character cut in half at the end of the head is fine
+        if e.start < len(head) - 3 or len(head) == len(data):
+            return None
+        return head[:e.start].decode("utf-8-sig")
+
+
+def _snippet(text: str) -> str | None:
+    return " ".join(text.split())[:PREVIEW_SNIPPET_CHARS] or None
+
+
+def _encode_thumbnail(image) -> tuple[bytes, str]:
+    """JPEG, or PNG for images with transparency."""
+    out = io.BytesIO()
+    if "A" in image.getbands() or "transparency" in image.info:
+        image.convert("RGBA").save(out, "PNG", optimize=True)
+        return out.getvalue(), "image/png"
+    image.convert("RGB").save(out, "JPEG", quality=80, optimize=True)
+    return out.getvalue(), "image/jpeg"
+
+
+def _image_thumbnail(data: bytes) -> tuple[bytes, str]:
+    from PIL import Image  # optional dependency, only needed for image previews
+
+    with Image.open(io.BytesIO(data)) as image:
+        # JPEGs are decoded at a reduced scale straight away
+        image.draft("RGB", (PREVIEW_THUMBNAIL_PX, PREVIEW_THUMBNAIL_PX))
+        image.thumbnail((PREVIEW_THUMBNAIL_PX, PREVIEW_THUMBNAIL_PX))
+        return _encode_thumbnail(image)
+
+
+def _pdf_preview(data: bytes) -> tuple[tuple[bytes, str] | None, str | None]:
+    import pypdfium2 as pdfium  # optional dependency, only needed for PDF previews
+
+    pdf = pdfium.PdfDocument(data)
+    try:
+        page = pdf[0]
+        text = page.get_textpage().get_text_range()
+        try:
+            bitmap = page.render(scale=PREVIEW_THUMBNAIL_PX / max(page.get_size()))
+            thumbnail = _encode_thumbnail(bitmap.to_pil())
+        except ImportError:
+            # rendering works, but turning the bitmap into a JPEG needs Pillow
+            thumbnail = None
+    finally:
+        pdf.close()
+    return thumbnail, _snippet(text)
+
+
+def generate(data: bytes, file_name: str | None) -> dict:
+    """Column values of the preview of `data` (everything but the hash)."""
+    kind = sniff(data, file_name)
+    preview = {"status": UNSUPPORTED, "kind": kind, "thumbnail": None, "thumbnail_type": None, "snippet": None}
+    try:
+        if kind == "text":
+            preview["snippet"] = _snippet(_decode_head(data))
+        elif kind == "image":
+            preview["thumbnail"], preview["thumbnail_type"] = _image_thumbnail(data)
+        elif kind == "pdf":
+            thumbnail, preview["snippet"] = _pdf_preview(data)
+            if thumbnail is not None:
+                preview["thumbnail"], preview["thumbnail_type"] = thumbnail
+    except ImportError as e:
+        logger.debug("no %s preview without %s", kind, e.name)
+    except Exception:
+        # corrupt files, decompression bombs (Pillow refuses them), ...
+        logger.warning("preview of a %s file failed", kind, exc_info=True)
+        preview["status"] = FAILED
+        return preview
+    if preview["thumbnail"] is not None or preview["snippet"] is not None:
+        preview["status"] = READY
+    return preview
+
+
+def pending(db: Session, limit: int) -> dict[str, int]:
+    """Content hash -> a version with that content, for contents without a preview, newest first."""
+    V = models.DocumentVersion
+    P = models.ContentPreview
+    rows = (db.query(V.content_sha256, func.min(V.version_id))
+            .filter(V.content_sha256.isnot(None), ~exists().where(P.content_sha256 == V.content_sha256))
+            .group_by(V.content_sha256)
+            .order_by(func.max(V.version_id).desc())
+            .limit(limit).all())
+    return dict(rows)
+
+
+def generate_previews(db: Session, targets: dict[str, int]) -> int:
+    """Generate and store the previews of `targets` (content hash -> version id), committing after each.
+    Returns the number stored."""
+    V = models.DocumentVersion
+    P = models.ContentPreview
+    stored = 0
+    for digest, version_id in targets.items():
+        if db.query(exists().where(P.content_sha256 == digest)).scalar():
+            continue
+        row = db.query(V.file_name, V.file_size).filter(V.version_id == version_id).one_or_none()
+        if row is None:
+            # deleted by retention since
+            continue
+        file_name, size = row
+        if size is not None and size > PREVIEW_MAX_SOURCE_BYTES:
+            preview = {"status": TOO_LARGE, "kind": sniff(b"", file_name)}
+        else:
+            try:
+                preview = generate(peek_version_data(db, version_id), file_name)
+            except KeyError:
+                logger.warning("cold object of version %d missing, no preview", version_id)
+                preview = {"status": FAILED, "kind": sniff(b"", file_name)}
+        insert_ignore(db, P, [{"content_sha256": digest, **preview}])
+        db.commit()
+        stored += 1
+    return stored
+
+
+def prune(db: Session) -> int:
+    """Delete previews of contents no version has any more. Commits."""
+    V = models.DocumentVersion
+    P = models.ContentPreview
+    deleted = db.execute(delete(P).where(~exists().where(V.content_sha256 == P.content_sha256))).rowcount
+    db.commit()
+    return deleted
+
+
+_requested: dict[str, int] = {}
+_requested_lock = threading.Lock()
+_wake = threading.Event()
+_running = False
+
+
+def request(digest: str, version_id: int) -> None:
+    """Generate the preview of a new upload's content soon (in this worker), not at the next full pass."""
+    if not _running:
+        return
+    with _requested_lock:
+        _requested[digest] = version_id
+    _wake.set()
+
+
+def _generate_requested() -> None:
+    from backend.app.database import SessionLocal
+
+    with _requested_lock:
+        targets = dict(_requested)
+        _requested.clear()
+    if not targets:
+        return
+    db = SessionLocal()
+    try:
+        generate_previews(db, targets)
+    finally:
+        db.close()
+
+
+def _generate_once(batch_size: int = PREVIEW_BATCH_SIZE) -> None:
+    from backend.app.database import SessionLocal, try_advisory_lock
+
+    with try_advisory_lock(PREVIEW_LOCK_KEY) as locked:
+        if not locked:
+            return
+        db = SessionLocal()
+        try:
+            stored = generate_previews(db, pending(db, batch_size))
+            pruned = prune(db)
+        finally:
+            db.close()
+    if stored or pruned:
+        logger.info("generated %d previews, pruned %d", stored, pruned)
+
+
+def start_generator(interval: float = PREVIEW_INTERVAL_SECONDS) -> threading.Event | None:
+    """Generate previews on a daemon thread: requested ones as they come, the rest every `interval`
+    seconds. Returns an Event that stops it."""
+    global _running
+    if interval <= 0:
+        return None
+    stop = threading.Event()
+
+    def loop():
+        global _running
+        # wake-ups for uploads must not hold off the full pass (backlog, other workers' uploads, pruning)
+        next_pass = time.monotonic() + interval
+        while not stop.is_set():
+            woken = _wake.wait(max(0.0, next_pass - time.monotonic()))
+            _wake.clear()
+            if stop.is_set():
+                break
+            try:
+                if woken:
+                    _generate_requested()
+                if time.monotonic() >= next_pass:
+                    next_pass = time.monotonic() + interval
+                    _generate_once()
+            except Exception:
+                logger.exception("preview generation failed")
+        _running = False
+
+    _running = True
+    threading.Thread(target=loop, name="preview-generator", daemon=True).start()
+    return stop
+
+
+def stop_generator(stop: threading.Event | None) -> None:
+    if stop is not None:
+        stop.set()
+        _wake.set()
+
+
+def main(argv: list[str]) -> int:
+    from backend.app.database import SessionLocal, init_db
+
+    p = argparse.ArgumentParser(prog="python -m backend.app.previews", description="Generate version previews.")
+    p.add_argument("command", choices=["generate", "reset"])
+    p.add_argument("status", nargs="?", choices=[UNSUPPORTED, TOO_LARGE, FAILED], help="reset: previews to drop")
+    p.add_argument("--batch-size", type=int, default=PREVIEW_BATCH_SIZE)
+    args = p.parse_args(argv)
+    if args.command == "reset" and args.status is None:
+        p.error("reset needs a status")
+    init_db()
+    db = SessionLocal()
+    try:
+        if args.command == "reset":
+            P = models.ContentPreview
+            deleted = db.execute(delete(P).where(P.status == args.status)).rowcount
+            db.commit()
+            print(f"dropped {deleted} {args.status} previews")
+            return 0
+        total = 0
+        while stored := generate_previews(db, pending(db, args.batch_size)):
+            total += stored
+        print(f"generated {total} previews, pruned {prune(db)}")
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
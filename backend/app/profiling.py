@@ -0,0 +1,183 @@
+"""Opt-in, sampled cProfile capture of single requests.
+
+Admins switch profiling on with POST /admin/profiling (off by default). While it is on, a request
+carrying an `X-Profile` header is profiled when it comes from an admin, or otherwise with probability
+`sample_rate`. The report (pstats, sorted by cumulative time) is kept in a small in-memory ring and
+its id returned in the `X-Profile-Id` response header; admins read it from GET /admin/profiling/reports/{id}.
+An admin sending `X-Profile: inline` gets the report as the response body instead.
+
+The switch and the reports live in the process. Under the multi-worker launcher (backend.app.server)
+POST /admin/profiling reaches only the worker that served it, and a report only the worker that made
+it: start every worker with PROFILING_ENABLED (and PROFILING_SAMPLE_RATE) to profile them all, and
+use `X-Profile: inline` to get the report back whichever worker answers.
+
+cProfile only sees the thread it is enabled on, and sync endpoints run in Starlette's threadpool,
+so the profiler is switched on inside the endpoint call by ProfiledRoute (the route_class of every
+router); dependencies such as authentication are not part of the report.
+"""
+import contextvars
+import cProfile
+import functools
+import inspect
+import io
+import itertools
+import os
+import random
+import threading
+import time
+from collections import deque
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+from backend.app.metrics import route_label
+
+MAX_STORED_PROFILES = 50
+REPORT_LINES = 60
+
+# initial state of every worker; POST /admin/profiling changes only the worker serving it
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", 0.0))
+
+_state = {"enabled": PROFILING_ENABLED, "sample_rate": min(1.0, max(0.0, PROFILING_SAMPLE_RATE))}
+_profiles: deque = deque(maxlen=MAX_STORED_PROFILES)
+_profiles_lock = threading.Lock()
+_ids = itertools.count(1)
+_active_profile: contextvars.ContextVar = contextvars.ContextVar("active_profile", default=None)
+
+
+def get_settings() -> dict:
+    return dict(_state)
+
+
+def set_settings(enabled: bool, sample_rate: float) -> dict:
+    _state["enabled"] = bool(enabled)
+    _state["sample_rate"] = min(1.0, max(0.0, float(sample_rate)))
+    return dict(_state)
+
+
+def list_profiles() -> list[dict]:
+    with _profiles_lock:
+        return [{k: v for k, v in p.items() if k != "report"} for p in reversed(_profiles)]
+
+
+def get_profile(profile_id: int) -> dict | None:
+    with _profiles_lock:
+        return next((p for p in _profiles if p["profile_id"] == profile_id), None)
+
+
+def _profiled(endpoint):
+    """Wrap an endpoint so it runs under the request's profiler (if any) on whichever thread executes it."""
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            prof = _active_profile.get()
+            if prof is None:
+                return await endpoint(*args, **kwargs)
+            prof.enable()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                prof.disable()
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        prof = _active_profile.get()
+        if prof is None:
+            return endpoint(*args, **kwargs)
+        return prof.runcall(endpoint, *args, **kwargs)
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """APIRoute whose endpoint can be profiled per request (see module docstring)."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _profiled(endpoint), **kwargs)
+
+
+def _requester_is_admin(scope) -> bool:
+    """Resolve the bearer token of a profiling request to an admin flag (only runs when X-Profile is sent)."""
+    import jwt
+    from backend.app.database import SessionLocal
+    from backend.app.routers.helpers import SECRET_KEY, ALGORITHM
+    import backend.app.models as models
+
+    headers = dict(scope.get("headers", []))
+    auth = headers.get(b"authorization", b"").decode("latin-1")
+    if not auth.lower().startswith("bearer "):
+        return False
+    try:
+        user_id = int(jwt.decode(auth[7:], SECRET_KEY, algorithms=[ALGORITHM]).get("sub"))
+    except Exception:
+        return False
+    db = SessionLocal()
+    try:
+        user = db.query(models.User).filter(models.User.user_id == user_id).one_or_none()
+        return user is not None and (user.role_id == 0 or getattr(user.role, "name", None) == "admin")
+    finally:
+        db.close()
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware deciding which requests to profile and storing/returning their reports."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _state["enabled"]:
+            return await self.app(scope, receive, send)
+        mode = dict(scope.get("headers", [])).get(b"x-profile")
+        if mode is None:
+            return await self.app(scope, receive, send)
+        mode = mode.decode("latin-1").strip().lower()
+        is_admin = await run_in_threadpool(_requester_is_admin, scope)
+        if not is_admin and random.random() >= _state["sample_rate"]:
+            return await self.app(scope, receive, send)
+
+        profile_id = next(_ids)
+        prof = cProfile.Profile()
+        token = _active_profile.set(prof)
+        inline = is_admin and mode == "inline"
+        status = [0]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if inline:
+                    return
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", str(profile_id).encode())]
+            elif inline:
+                return
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _active_profile.reset(token)
+        elapsed = time.perf_counter() - start
+
+        import pstats  # only needed once a request has actually been profiled
+
+        out = io.StringIO()
+        try:
+            pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(REPORT_LINES)
+        except TypeError:
+            # nothing was recorded (e.g. the route is not a ProfiledRoute)
+            out.write("no profile data recorded\n")
+        entry = {
+            "profile_id": profile_id, "method": scope["method"], "path": scope["path"], "route": route_label(scope),
+            "status": status[0], "duration_ms": round(elapsed * 1000, 2), "created_at": time.time(),
+            "report": out.getvalue(),
+        }
+        with _profiles_lock:
+            _profiles.append(entry)
+        if inline:
+            body = entry["report"].encode()
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": [(b"content-type", b"text/plain; charset=utf-8"),
+                                    (b"content-length", str(len(body)).encode()),
+                                    (b"x-profile-id", str(profile_id).encode())]})
+            await send({"type": "http.response.body", "body": body})
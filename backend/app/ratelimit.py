@@ -0,0 +1,276 @@
+"""Token-bucket rate limits and per-user concurrency caps for expensive endpoints.
+
+Endpoints opt in with a decorator below the route decorator:
+
+    @router.post("/upload", response_model=...)
+    @rate_limited("upload", concurrent=True)
+    def upload_document(..., current_user: models.User = Depends(get_current_user)):
+
+rate_limited(budget) keys the bucket by the id of the endpoint's current_user; with per_user=False it
+keys it by client IP (the endpoint takes `request: Request`), for anonymous endpoints such as login;
+concurrent=True also caps the user's simultaneous requests. Budgets are
+"<requests>/<seconds>" strings: up to <requests> at once, refilled evenly over <seconds>. Rejected
+requests get 429 with a Retry-After header (seconds until a token is available).
+
+Buckets and concurrency slots live in the process by default (MemoryBackend), which is exact for a
+single worker. With several workers or hosts set RATE_LIMIT_BACKEND=redis (RATE_LIMIT_REDIS_URL), or
+install any object with the same take/acquire/release methods through set_backend().
+"""
+import functools
+import math
+import os
+import threading
+import time
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() not in ("0", "false", "no")
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+# Behind a reverse proxy the client address is the proxy's; trust X-Forwarded-For only when told to
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() in ("1", "true", "yes")
+
+# budget name -> "<requests>/<seconds>", overridable with RATE_LIMIT_<NAME>
+DEFAULT_BUDGETS = {
+    "login": "10/60",
+    "search": "60/60",
+    "upload": "30/60",
+    # one request per chunk of a resumable upload (backend.app.uploads)
+    "upload_chunk": "600/60",
+    "download": "120/60",
+    # signed download URLs, per client IP (no user to key by)
+    "signed_download": "600/60",
+    # version diffs (backend.app.diffs): the first of a pair extracts and compares both texts
+    "diff": "30/60",
+}
+# concurrent requests per user, overridable with MAX_CONCURRENT_<NAME>
+DEFAULT_CONCURRENCY = {
+    "upload": 2,
+    "upload_chunk": 4,
+    "download": 4,
+    "diff": 2,
+}
+# Upper bound on buckets kept by the memory backend before idle (full) buckets are dropped
+MAX_MEMORY_BUCKETS = 100000
+
+
+def parse_budget(spec: str) -> tuple[float, float]:
+    """"30/60" -> (capacity 30, refill 0.5 tokens per second)."""
+    count, _, seconds = spec.partition("/")
+    capacity = float(count)
+    period = float(seconds or 1)
+    if capacity <= 0 or period <= 0:
+        raise ValueError(f"invalid rate limit budget: {spec!r}")
+    return capacity, capacity / period
+
+
+BUDGETS = {name: parse_budget(os.getenv(f"RATE_LIMIT_{name.upper()}", spec)) for name, spec in DEFAULT_BUDGETS.items()}
+CONCURRENCY = {name: int(os.getenv(f"MAX_CONCURRENT_{name.upper()}", n)) for name, n in DEFAULT_CONCURRENCY.items()}
+
+
+class MemoryBackend:
+    """Per-process buckets and counters guarded by one lock (the critical sections are a few arithmetic ops)."""
+
+    def __init__(self, max_buckets: int = MAX_MEMORY_BUCKETS):
+        self._buckets: dict[str, list[float]] = {}
+        self._slots: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._max_buckets = max_buckets
+
+    def take(self, key: str, capacity: float, refill_per_second: float) -> float:
+        """Consume one token; return 0 if allowed, else the seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self._max_buckets:
+                    self._prune(now)
+                self._buckets[key] = [capacity - 1, now, capacity, refill_per_second]
+                return 0.0
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * refill_per_second)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0.0
+            bucket[0] = tokens
+            return (1 - tokens) / refill_per_second
+
+    def _prune(self, now: float) -> None:
+        # a bucket that has refilled completely behaves exactly like a missing one
+        full = [k for k, (tokens, ts, cap, rate) in self._buckets.items() if tokens + (now - ts) * rate >= cap]
+        for k in full:
+            del self._buckets[k]
+        if len(self._buckets) >= self._max_buckets:
+            for k in sorted(self._buckets, key=lambda k: self._buckets[k][1])[:self._max_buckets // 2]:
+                del self._buckets[k]
+
+    def acquire(self, key: str, limit: int) -> bool:
+        with self._lock:
+            n = self._slots.get(key, 0)
+            if n >= limit:
+                return False
+            self._slots[key] = n + 1
+            return True
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            n = self._slots.get(key, 0) - 1
+            if n > 0:
+                self._slots[key] = n
+            else:
+                self._slots.pop(key, None)
+
+
+class RedisBackend:
+    """Buckets shared by all workers. Each check is one round trip running a Lua script atomically."""
+
+    TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+    # slot counters expire so a crashed worker cannot hold a user's slots forever
+    SLOT_TTL_SECONDS = 300
+
+    def __init__(self, url: str = RATE_LIMIT_REDIS_URL, prefix: str = "ratelimit:"):
+        import redis  # optional dependency, only needed for this backend
+
+        self._redis = redis.Redis.from_url(url)
+        self._take = self._redis.register_script(self.TAKE_SCRIPT)
+        self._prefix = prefix
+
+    def take(self, key: str, capacity: float, refill_per_second: float) -> float:
+        return float(self._take(keys=[self._prefix + key], args=[capacity, refill_per_second]))
+
+    def acquire(self, key: str, limit: int) -> bool:
+        k = self._prefix + "slots:" + key
+        pipe = self._redis.pipeline()
+        pipe.incr(k)
+        pipe.expire(k, self.SLOT_TTL_SECONDS)
+        n, _ = pipe.execute()
+        if n > limit:
+            self._redis.decr(k)
+            return False
+        return True
+
+    def release(self, key: str) -> None:
+        self._redis.decr(self._prefix + "slots:" + key)
+
+
+def _create_backend(name: str):
+    if name == "memory":
+        return MemoryBackend()
+    if name == "redis":
+        return RedisBackend()
+    raise ValueError(f"unknown RATE_LIMIT_BACKEND: {name!r}")
+
+
+backend = _create_backend(RATE_LIMIT_BACKEND)
+
+
+def set_backend(new_backend) -> None:
+    """Replace the limiter backend (e.g. a shared store); it must provide take/acquire/release."""
+    global backend
+    backend = new_backend
+
+
+def client_ip(request: Request) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def check_rate(budget: str, key: str) -> None:
+    """Raise 429 with Retry-After if the bucket of (budget, key) is empty."""
+    capacity, refill = BUDGETS[budget]
+    wait = backend.take(f"{budget}:{key}", capacity, refill)
+    if wait > 0:
+        raise HTTPException(status_code=429, detail="rate limit exceeded",
+                            headers={"Retry-After": str(max(1, math.ceil(wait)))})
+
+
+def rate_limited(budget: str, per_user: bool = True, concurrent: bool = False):
+    """Endpoint decorator enforcing BUDGETS[budget], keyed by the `current_user` argument's id, or by the
+    client IP of the `request` argument with per_user=False. With concurrent=True it also holds one of
+    the user's CONCURRENCY[budget] slots while the endpoint runs, and while the body of a StreamingResponse
+    it returns is sent, as that is where the work of a streamed response happens (429 when all are busy).
+
+    A decorator rather than a dependency: the endpoint already resolves current_user, and every extra
+    dependency FastAPI resolves costs more than the limiter itself."""
+    if budget not in BUDGETS:
+        raise ValueError(f"unknown rate limit budget: {budget}")
+    if concurrent and (not per_user or budget not in CONCURRENCY):
+        raise ValueError(f"no per-user concurrency limit for: {budget}")
+
+    def decorator(endpoint):
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            if not RATE_LIMIT_ENABLED:
+                return endpoint(*args, **kwargs)
+            if not per_user:
+                check_rate(budget, "ip:" + client_ip(kwargs["request"]))
+                return endpoint(*args, **kwargs)
+            user_id = kwargs["current_user"].user_id
+            check_rate(budget, f"user:{user_id}")
+            if not concurrent:
+                return endpoint(*args, **kwargs)
+            key = f"{budget}:slots:user:{user_id}"
+            # the slot goes back where it was taken, even if set_backend() runs meanwhile
+            limiter = backend
+            if not limiter.acquire(key, CONCURRENCY[budget]):
+                raise HTTPException(status_code=429, detail=f"too many concurrent {budget}s",
+                                    headers={"Retry-After": "1"})
+            try:
+                response = endpoint(*args, **kwargs)
+            except BaseException:
+                limiter.release(key)
+                raise
+            if isinstance(response, StreamingResponse):
+                response.body_iterator = _SlotHeldWhileStreaming(response.body_iterator, limiter, key)
+            else:
+                limiter.release(key)
+            return response
+        return wrapper
+    return decorator
+
+
+class _SlotHeldWhileStreaming:
+    """Body of a streamed response that holds a concurrency slot until it is sent, fails, is cancelled
+    (client gone), or is dropped unsent."""
+
+    def __init__(self, iterator, limiter, key: str):
+        self._iterator = iterator
+        self._limiter = limiter
+        self._key = key
+        self._held = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._iterator.__anext__()
+        except BaseException:
+            # StopAsyncIteration included
+            self.release()
+            raise
+
+    def release(self) -> None:
+        if self._held:
+            self._held = False
+            self._limiter.release(self._key)
+
+    def __del__(self):
+        self.release()
@@ -0,0 +1,252 @@
+"""Version retention: prune old document versions according to `retention_policies`.
+
+A sweep walks the documents covered by a policy (department or tag) in batches of `batch_size`
+documents ordered by id. Each batch reads version metadata only (never file_data), decides which
+versions the applicable policies keep and deletes the rest in its own short transaction, so no lock
+is held across batches and uploads are never blocked for long. Decisions are made on a snapshot, so
+a version uploaded concurrently can only make the sweep delete less, never more; the next sweep
+catches up. The latest version of a document is never deleted. Trashed documents and versions are
+left to the trash purge (backend.app.trash).
+
+Cold-tier copies of deleted versions are removed from the cold store after each batch commits. A
+deleted version that deduplicated versions link to first hands its bytes to one of them
+(dedup.release_links), so links never dangle.
+The freed bytes are reusable by the database immediately (after autovacuum on PostgreSQL); pass
+vacuum=True to also return the space to the operating system. A background thread sweeps every
+RETENTION_SWEEP_INTERVAL_SECONDS (0 disables it); sweeps can also be run from the CLI:
+
+    python -m backend.app.retention sweep --dry-run
+    python -m backend.app.retention sweep --batch-size 200 --vacuum
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, delete, func, or_, case, text
+from sqlalchemy.orm import Session
+import backend.app.models as models
+from backend.app.payload_cache import payload_cache
+from backend.app.changelog import record_changes
+from backend.app.storage import COLD, LINKED, delete_cold_objects
+from backend.app.dedup import release_links
+
+logger = logging.getLogger("backend.app.retention")
+
+RETENTION_SWEEP_INTERVAL_SECONDS = float(os.getenv("RETENTION_SWEEP_INTERVAL_SECONDS", 3600))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", 100))
+# Pause between batches so a large sweep does not monopolise the database
+RETENTION_BATCH_PAUSE_SECONDS = float(os.getenv("RETENTION_BATCH_PAUSE_SECONDS", 0.05))
+# At most this many deleted versions are listed in a sweep report (counts are always exact)
+MAX_REPORTED_VERSIONS = 1000
+# Arbitrary key for the PostgreSQL advisory lock making sure only one worker sweeps at a time
+SWEEP_LOCK_KEY = 7301
+
+
+def _aware(ts: datetime | None) -> datetime | None:
+    # SQLite hands back naive timestamps; they are stored in UTC
+    if ts is not None and ts.tzinfo is None:
+        return ts.replace(tzinfo=timezone.utc)
+    return ts
+
+
+def versions_to_keep(policy: models.RetentionPolicy, versions: list, now: datetime) -> set[int]:
+    """Version ids one policy keeps. `versions` are (version_id, version_number, upload_date) rows
+    of one document, newest first."""
+    keep: set[int] = set()
+    if policy.keep_last:
+        keep.update(v[0] for v in versions[:policy.keep_last])
+    if policy.keep_days:
+        cutoff = now - timedelta(days=policy.keep_days)
+        keep.update(v[0] for v in versions if v[2] is not None and _aware(v[2]) >= cutoff)
+    if policy.keep_monthly:
+        first_month = now.year * 12 + now.month - 1 - (policy.keep_monthly - 1)
+        seen_months: set[int] = set()
+        for version_id, _, uploaded in versions:
+            if uploaded is None:
+                continue
+            month = uploaded.year * 12 + uploaded.month - 1
+            if month >= first_month and month not in seen_months:
+                # newest first, so the first version seen in a month is that month's snapshot
+                seen_months.add(month)
+                keep.add(version_id)
+    return keep
+
+
+def _covered_documents(db: Session, after_id: int, limit: int) -> list[int]:
+    """Next batch of document ids (ordered, > after_id) that some policy applies to and that have old versions."""
+    D = models.Document
+    P = models.RetentionPolicy
+    DT = models.DocumentTag
+    policy_departments = select(P.department_id).where(P.department_id.isnot(None))
+    policy_tagged = select(DT.document_id).join(P, P.tag_id == DT.tag_id)
+    rows = (
+        db.query(D.document_id)
+        .filter(D.document_id > after_id, D.latest_version_number > 1, D.deleted_at.is_(None),
+                or_(D.department_id.in_(policy_departments), D.document_id.in_(policy_tagged)))
+        .order_by(D.document_id)
+        .limit(limit)
+        .all()
+    )
+    return [r[0] for r in rows]
+
+
+def _plan_batch(db: Session, document_ids: list[int], policies: list[models.RetentionPolicy], now: datetime) -> list[tuple]:
+    """(version_id, document_id, version_number, size, cold storage key) of every version in the batch no
+    policy keeps. Linked versions have size 0: deleting them frees nothing."""
+    D = models.Document
+    V = models.DocumentVersion
+    by_department = {p.department_id: p for p in policies if p.department_id is not None}
+    by_tag = {p.tag_id: p for p in policies if p.tag_id is not None}
+
+    docs = dict(db.query(D.document_id, D.department_id).filter(D.document_id.in_(document_ids)).all())
+    tags: dict[int, list[int]] = {}
+    if by_tag:
+        for doc_id, tag_id in (db.query(models.DocumentTag.document_id, models.DocumentTag.tag_id)
+                               .filter(models.DocumentTag.document_id.in_(document_ids),
+                                       models.DocumentTag.tag_id.in_(list(by_tag))).all()):
+            tags.setdefault(doc_id, []).append(tag_id)
+
+    versions: dict[int, list[tuple]] = {}
+    size = case((V.storage_tier == LINKED, 0), else_=func.coalesce(V.file_size, func.length(V.file_data)))
+    cold_key = case((V.storage_tier == COLD, V.storage_key))
+    for row in (db.query(V.version_id, V.document_id, V.version_number, V.upload_date, size, cold_key)
+                .filter(V.document_id.in_(document_ids), V.deleted_at.is_(None))
+                .order_by(V.document_id, V.version_number.desc()).all()):
+        versions.setdefault(row[1], []).append(row)
+
+    doomed = []
+    for doc_id, doc_versions in versions.items():
+        applicable = [by_department[docs[doc_id]]] if docs.get(doc_id) in by_department else []
+        applicable += [by_tag[t] for t in tags.get(doc_id, [])]
+        if not applicable or len(doc_versions) < 2:
+            continue
+        rows = [(v[0], v[2], v[3]) for v in doc_versions]
+        keep = {rows[0][0]}  # latest version
+        for policy in applicable:
+            keep |= versions_to_keep(policy, rows, now)
+        doomed.extend((v[0], v[1], v[2], v[4] or 0, v[5]) for v in doc_versions if v[0] not in keep)
+    return doomed
+
+
+def sweep(db: Session, dry_run: bool = False, batch_size: int = RETENTION_BATCH_SIZE,
+          vacuum: bool = False, pause: float = RETENTION_BATCH_PAUSE_SECONDS) -> dict:
+    """Apply all retention policies. Commits after every batch (unless dry_run) and returns a report."""
+    report = {"dry_run": dry_run, "documents_scanned": 0, "versions_deleted": 0, "bytes_freed": 0,
+              "batches": 0, "versions": []}
+    policies = db.query(models.RetentionPolicy).all()
+    if not policies:
+        return report
+    for p in policies:
+        db.expunge(p)
+    now = datetime.now(timezone.utc)
+    after_id = 0
+    while True:
+        document_ids = _covered_documents(db, after_id, batch_size)
+        if not document_ids:
+            break
+        after_id = document_ids[-1]
+        doomed = _plan_batch(db, document_ids, policies, now)
+        if doomed:
+            # locked so that an upload linking to one of them (dedup.payload_columns) commits first and is
+            # seen by release_links, or waits and stores its own bytes
+            V = models.DocumentVersion
+            db.query(V.version_id).filter(V.version_id.in_([v[0] for v in doomed])).with_for_update().all()
+        # versions other versions link to hand their bytes over first (rolled back in a dry run)
+        handed_over = release_links(db, [v[0] for v in doomed])
+        doomed = [v if v[0] not in handed_over else (v[0], v[1], v[2], 0, None) for v in doomed]
+        if doomed and not dry_run:
+            db.execute(delete(models.DocumentVersion)
+                       .where(models.DocumentVersion.version_id.in_([v[0] for v in doomed])))
+            record_changes(db, [v[1] for v in doomed], "versions")
+        # end the batch transaction either way so no snapshot or lock outlives it
+        if dry_run:
+            db.rollback()
+        else:
+            db.commit()
+            delete_cold_objects([v[4] for v in doomed if v[4]])
+            payload_cache.discard([v[0] for v in doomed])
+        report["batches"] += 1
+        report["documents_scanned"] += len(document_ids)
+        report["versions_deleted"] += len(doomed)
+        report["bytes_freed"] += sum(v[3] for v in doomed)
+        room = MAX_REPORTED_VERSIONS - len(report["versions"])
+        report["versions"].extend({"version_id": v[0], "document_id": v[1], "version_number": v[2], "size": v[3]}
+                                  for v in doomed[:max(room, 0)])
+        if pause and len(document_ids) == batch_size:
+            time.sleep(pause)
+    if vacuum and not dry_run and report["versions_deleted"]:
+        vacuum_versions(db.get_bind())
+    return report
+
+
+def vacuum_versions(engine) -> None:
+    """Return the space of deleted versions to the OS (VACUUM cannot run inside a transaction)."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if engine.dialect.name == "postgresql":
+            conn.execute(text("VACUUM (ANALYZE) document_versions"))
+        elif engine.dialect.name == "sqlite":
+            conn.execute(text("VACUUM"))
+
+
+def _sweep_once() -> None:
+    from backend.app.database import SessionLocal, try_advisory_lock
+
+    # several workers each run a sweeper; only the one holding the lock sweeps
+    with try_advisory_lock(SWEEP_LOCK_KEY) as locked:
+        if not locked:
+            return
+        db = SessionLocal()
+        try:
+            report = sweep(db)
+        finally:
+            db.close()
+    if report["versions_deleted"]:
+        logger.info("retention sweep deleted %d versions (%d bytes) in %d documents",
+                    report["versions_deleted"], report["bytes_freed"], report["documents_scanned"])
+
+
+def start_sweeper(interval: float = RETENTION_SWEEP_INTERVAL_SECONDS) -> threading.Event | None:
+    """Run sweep() every `interval` seconds on a daemon thread. Returns an Event that stops it."""
+    if interval <= 0:
+        return None
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                _sweep_once()
+            except Exception:
+                logger.exception("retention sweep failed")
+
+    threading.Thread(target=loop, name="retention-sweeper", daemon=True).start()
+    return stop
+
+
+def main(argv: list[str]) -> int:
+    from backend.app.database import SessionLocal, init_db
+
+    p = argparse.ArgumentParser(prog="python -m backend.app.retention", description="Apply version retention policies.")
+    p.add_argument("command", choices=["sweep"])
+    p.add_argument("--dry-run", action="store_true", help="report what would be deleted without deleting")
+    p.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE)
+    p.add_argument("--vacuum", action="store_true", help="VACUUM afterwards to return the space to the OS")
+    args = p.parse_args(argv)
+    init_db()
+    db = SessionLocal()
+    try:
+        report = sweep(db, dry_run=args.dry_run, batch_size=args.batch_size, vacuum=args.vacuum)
+    finally:
+        db.close()
+    verb = "would delete" if args.dry_run else "deleted"
+    for v in report["versions"]:
+        print(f"  {verb} document={v['document_id']} version={v['version_number']} ({v['size']} bytes)")
+    print(f"{verb} {report['versions_deleted']} versions, {report['bytes_freed']} bytes "
+          f"({report['documents_scanned']} documents in {report['batches']} batches)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
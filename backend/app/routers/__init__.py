@@ -3,5 +3,8 @@ from backend.app.routers.tags import router as tags_router
 from backend.app.routers.permissions import router as permissions_router
 from backend.app.routers.auth import router as auth_router
 from backend.app.routers.admin import router as admin_router
+from backend.app.routers.events import router as events_router
+from backend.app.routers.uploads import router as uploads_router
+from backend.app.routers.folders import router as folders_router
 
-__all__ = ["documents_router", "tags_router", "permissions_router", "auth_router", "admin_router"]
\ No newline at end of file
+__all__ = ["documents_router", "tags_router", "permissions_router", "auth_router", "admin_router", "events_router", "uploads_router", "folders_router"]
\ No newline at end of file
@@ -1,11 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime, timedelta, timezone
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
 from sqlalchemy.orm import Session
 import backend.app.models as models
 import backend.app.schemas as schemas
 from backend.app.database import get_db
 from backend.app.routers.helpers import get_current_user, require_admin
+from backend.app.access import remove_department_access, check_access, rebuild_access
+from backend.app import profiling, retention, storage, changelog, dedup, trash, audit
+from backend.app.folders import FolderError, check_closure, rebuild_closure
+from backend.app.changelog import record_changes
+from backend.app.payload_cache import payload_cache
+from backend.app.profiling import ProfiledRoute
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 @router.post("/users/{user_id}/role", response_model=schemas.User)
 def assign_role(user_id: int, role_id: int,
@@ -115,8 +123,22 @@ def delete_department(department_id: int,
     doc_count = db.query(models.Document).filter(models.Document.department_id == department_id).count()
     if doc_count > 0:
         raise HTTPException(status_code=400, detail="department owns documents")
+    if db.query(models.Folder.folder_id).filter(models.Folder.department_id == department_id).first():
+        raise HTTPException(status_code=400, detail="department owns folders")
+    # its view grants, on documents and on folders, go with it (FK cascade)
+    P = models.DocumentViewPermission
+    FP = models.FolderViewPermission
+    C = models.FolderClosure
+    granted = [r[0] for r in db.query(P.document_id).filter(P.department_id == department_id).all()]
+    granted += [r[0] for r in db.query(models.Document.document_id)
+                .join(C, C.descendant_id == models.Document.folder_id)
+                .join(FP, FP.folder_id == C.ancestor_id)
+                .filter(FP.department_id == department_id).distinct()]
+    remove_department_access(db, department_id)
     db.delete(dept)
+    record_changes(db, granted, "permissions")
     db.commit()
+    audit.record(current_user, "view_revoke", granted, f"department {department_id} deleted")
     return {"detail": "deleted"}
 
 @router.get("/users", response_model=list[schemas.User])
@@ -132,4 +154,195 @@ def list_users(current_user: models.User = Depends(get_current_user), db: Sessio
         u.department_name = dept_name
         u.role_name = role_name
         result.append(schemas.User.model_validate(u))
-    return result
\ No newline at end of file
+    return result
+
+@router.get("/access/check", response_model=schemas.AccessConsistency)
+def check_department_access(current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Report rows missing from / extra in the materialized department access table."""
+    require_admin(current_user)
+    return schemas.AccessConsistency(**check_access(db))
+
+@router.post("/access/rebuild")
+def rebuild_department_access(current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Rebuild the materialized department access table from documents and view permissions."""
+    require_admin(current_user)
+    rows = rebuild_access(db)
+    db.commit()
+    return {"detail": "rebuilt", "rows": rows}
+
+@router.get("/folders/closure/check", response_model=schemas.FolderClosureConsistency)
+def check_folder_closure(current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Report rows missing from / extra in the folder closure table, against the folders' parent_id."""
+    require_admin(current_user)
+    return schemas.FolderClosureConsistency(**check_closure(db))
+
+@router.post("/folders/closure/rebuild")
+def rebuild_folder_closure(current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Rebuild the folder closure table from the folders' parent_id, then the access table, which
+    inherits folder grants through it."""
+    require_admin(current_user)
+    try:
+        rows = rebuild_closure(db)
+    except FolderError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    rebuild_access(db)
+    db.commit()
+    return {"detail": "rebuilt", "rows": rows}
+
+@router.get("/profiling", response_model=schemas.ProfilingSettings)
+def get_profiling(current_user: models.User = Depends(get_current_user)):
+    require_admin(current_user)
+    return schemas.ProfilingSettings(**profiling.get_settings())
+
+@router.post("/profiling", response_model=schemas.ProfilingSettings)
+def set_profiling(settings: schemas.ProfilingSettings, current_user: models.User = Depends(get_current_user)):
+    """Switch request profiling on/off. While on, requests sending an X-Profile header are profiled
+    (always for admins, with probability sample_rate for everyone else). Per process: with several
+    workers this reaches only the one serving the request (PROFILING_ENABLED sets them all at start)."""
+    require_admin(current_user)
+    return schemas.ProfilingSettings(**profiling.set_settings(settings.enabled, settings.sample_rate))
+
+@router.get("/profiling/reports", response_model=list[schemas.ProfileSummary])
+def list_profile_reports(current_user: models.User = Depends(get_current_user)):
+    """Most recent profile reports first (the last MAX_STORED_PROFILES are kept in the memory of the
+    worker that made them; with several workers, only this worker's)."""
+    require_admin(current_user)
+    return [schemas.ProfileSummary(**p) for p in profiling.list_profiles()]
+
+@router.get("/profiling/reports/{profile_id}", response_class=PlainTextResponse)
+def get_profile_report(profile_id: int, current_user: models.User = Depends(get_current_user)):
+    require_admin(current_user)
+    entry = profiling.get_profile(profile_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="profile not found")
+    return entry["report"]
+
+@router.get("/retention/policies", response_model=list[schemas.RetentionPolicy])
+def list_retention_policies(current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    require_admin(current_user)
+    policies = db.query(models.RetentionPolicy).order_by(models.RetentionPolicy.policy_id).all()
+    return [schemas.RetentionPolicy.model_validate(p) for p in policies]
+
+@router.post("/retention/policies", response_model=schemas.RetentionPolicy)
+def create_retention_policy(req: schemas.RetentionPolicyRequest,
+                            current_user: models.User = Depends(get_current_user),
+                            db: Session = Depends(get_db)):
+    """Create the retention policy of a department or a tag. Old versions of covered documents are deleted by
+    the next sweep unless some rule (keep_last / keep_days / keep_monthly) of some applicable policy keeps them."""
+    require_admin(current_user)
+    if (req.department_id is None) == (req.tag_id is None):
+        raise HTTPException(status_code=400, detail="exactly one of department_id and tag_id is required")
+    rules = (req.keep_last, req.keep_days, req.keep_monthly)
+    if all(r is None for r in rules):
+        raise HTTPException(status_code=400, detail="at least one of keep_last, keep_days, keep_monthly is required")
+    if any(r is not None and r < 1 for r in rules):
+        raise HTTPException(status_code=400, detail="retention values must be positive")
+    if req.department_id is not None:
+        if not db.query(models.Department).filter(models.Department.department_id == req.department_id).one_or_none():
+            raise HTTPException(status_code=404, detail="department not found")
+        existing = db.query(models.RetentionPolicy).filter(models.RetentionPolicy.department_id == req.department_id).one_or_none()
+    else:
+        if not db.query(models.Tag).filter(models.Tag.tag_id == req.tag_id).one_or_none():
+            raise HTTPException(status_code=404, detail="tag not found")
+        existing = db.query(models.RetentionPolicy).filter(models.RetentionPolicy.tag_id == req.tag_id).one_or_none()
+    if existing:
+        raise HTTPException(status_code=400, detail="retention policy already exists")
+    policy = models.RetentionPolicy(**req.model_dump())
+    db.add(policy)
+    db.commit()
+    db.refresh(policy)
+    return schemas.RetentionPolicy.model_validate(policy)
+
+@router.delete("/retention/policies/{policy_id}")
+def delete_retention_policy(policy_id: int,
+                            current_user: models.User = Depends(get_current_user),
+                            db: Session = Depends(get_db)):
+    require_admin(current_user)
+    policy = db.query(models.RetentionPolicy).filter(models.RetentionPolicy.policy_id == policy_id).one_or_none()
+    if not policy:
+        raise HTTPException(status_code=404, detail="retention policy not found")
+    db.delete(policy)
+    db.commit()
+    return {"detail": "deleted"}
+
+@router.post("/retention/sweep", response_model=schemas.RetentionSweepReport)
+def sweep_retention(dry_run: bool = True, batch_size: int = Query(retention.RETENTION_BATCH_SIZE, ge=1, le=10000),
+                    vacuum: bool = False,
+                    current_user: models.User = Depends(get_current_user),
+                    db: Session = Depends(get_db)):
+    """Apply the retention policies now. Defaults to a dry run reporting what would be deleted."""
+    require_admin(current_user)
+    return schemas.RetentionSweepReport(**retention.sweep(db, dry_run=dry_run, batch_size=batch_size, vacuum=vacuum))
+
+@router.post("/trash/purge", response_model=schemas.TrashPurgeReport)
+def purge_trash(days: float = Query(trash.TRASH_RETENTION_DAYS, ge=0),
+                batch_size: int = Query(trash.TRASH_PURGE_BATCH_SIZE, ge=1, le=10000),
+                vacuum: bool = False,
+                current_user: models.User = Depends(get_current_user),
+                db: Session = Depends(get_db)):
+    """Purge documents and versions trashed more than `days` ago now (0: everything in the trash)."""
+    require_admin(current_user)
+    report = trash.purge(db, datetime.now(timezone.utc) - timedelta(days=days), batch_size=batch_size, vacuum=vacuum)
+    return schemas.TrashPurgeReport(**report)
+
+@router.get("/audit", response_model=schemas.AuditPage)
+def list_audit_events(document_id: int | None = None,
+                      user_id: int | None = None,
+                      action: str | None = None,
+                      since: datetime | None = None,
+                      until: datetime | None = None,
+                      before_id: int | None = None,
+                      limit: int = Query(audit.AUDIT_PAGE_SIZE, ge=1, le=audit.AUDIT_MAX_PAGE_SIZE),
+                      current_user: models.User = Depends(get_current_user),
+                      db: Session = Depends(get_db)):
+    """Audit events, newest first, by document, user, action and/or time range [since, until). Pass the
+    last event_id as before_id for the next page."""
+    require_admin(current_user)
+    if audit.AUDIT_SINK != "table":
+        raise HTTPException(status_code=409, detail=f"audit events are not stored in the database (AUDIT_SINK={audit.AUDIT_SINK})")
+    # whatever this worker still buffers, so an admin sees their own latest actions
+    audit.flush()
+    rows, has_more = audit.query(db, document_id, user_id, action, since, until, before_id, limit)
+    events = []
+    for event, username in rows:
+        item = schemas.AuditEvent.model_validate(event)
+        item.username = username
+        events.append(item)
+    return schemas.AuditPage(events=events, has_more=has_more)
+
+@router.post("/changes/compact", response_model=schemas.ChangeLogCompactReport)
+def compact_change_log(days: float = Query(changelog.CHANGE_LOG_RETENTION_DAYS, ge=0),
+                       current_user: models.User = Depends(get_current_user),
+                       db: Session = Depends(get_db)):
+    """Compact change log entries older than `days` now (the newest entry of each document is kept)."""
+    require_admin(current_user)
+    deleted = changelog.compact(db, datetime.now(timezone.utc) - timedelta(days=days))
+    return schemas.ChangeLogCompactReport(entries_deleted=deleted, head=changelog.head(db))
+
+@router.get("/storage/stats", response_model=list[schemas.StorageTierStats])
+def storage_stats(current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Version count and payload bytes per storage tier."""
+    require_admin(current_user)
+    return [schemas.StorageTierStats(**row) for row in storage.tier_stats(db)]
+
+@router.get("/dedup/report", response_model=schemas.DuplicateReport)
+def dedup_report(limit: int = Query(100, ge=1, le=1000),
+                 current_user: models.User = Depends(get_current_user),
+                 db: Session = Depends(get_db)):
+    """Content stored more than once, with the bytes linking the copies would reclaim."""
+    require_admin(current_user)
+    return schemas.DuplicateReport(**dedup.duplicate_report(db, limit))
+
+@router.get("/cache/stats", response_model=schemas.PayloadCacheStats)
+def cache_stats(current_user: models.User = Depends(get_current_user)):
+    """Hit/miss counters and size of this worker's version payload cache."""
+    require_admin(current_user)
+    return schemas.PayloadCacheStats(**payload_cache.stats())
+
+@router.post("/storage/migrate", response_model=schemas.TieringReport)
+def migrate_cold_versions(older_than_days: float = Query(storage.COLD_AFTER_DAYS, ge=0), dry_run: bool = True,
+                          current_user: models.User = Depends(get_current_user),
+                          db: Session = Depends(get_db)):
+    """Move versions not read for older_than_days to the cold store now. Defaults to a dry run."""
+    require_admin(current_user)
+    return schemas.TieringReport(**storage.migrate_cold(db, older_than_days=older_than_days, dry_run=dry_run))
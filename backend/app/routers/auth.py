@@ -1,19 +1,21 @@
-from fastapi import APIRouter, Depends,HTTPException, status
+from fastapi import APIRouter, Depends,HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 import backend.app.models as models
 import backend.app.schemas as schemas
 from backend.app.database import get_db
 from backend.app.routers.helpers import create_access_token, authenticate_user, get_current_user, bcrypt_context
+from backend.app.profiling import ProfiledRoute
+from backend.app.ratelimit import rate_limited
 
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 @router.post("/signup", response_model=schemas.User)
 def signup(user_req: schemas.UserRequest, db: Session = Depends(get_db)):
     """Create a new user (password is hashed). Returns the created user (no password)."""
     # Hash the password
-    hashed_password = bcrypt_context.hash(user_req.password)
+    hashed_password = bcrypt_context().hash(user_req.password)
     # Create the user in the database
     user = models.User(
         username=user_req.username,
@@ -33,7 +35,8 @@ def signup(user_req: schemas.UserRequest, db: Session = Depends(get_db)):
     return schemas.User.model_validate(user)
 
 @router.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+@rate_limited("login", per_user=False)
+def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """Authenticate user and return JWT access token."""
     user = authenticate_user(form_data.username, form_data.password, db)
     if not user:
@@ -1,17 +1,40 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Request, Response, Header
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm import Session, selectinload, aliased, defer
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import and_, select, func
+from sqlalchemy import and_, or_, select, func, literal, case, union_all, Integer, String
 from backend.app.database import get_db
-from backend.app.routers.helpers import get_current_user, can_access_document, require_admin, authorize_document_manage, _serialize_document_with_latest
+from backend.app.routers.helpers import get_current_user, can_access_document, require_admin, authorize_document_manage, get_document, _serialize_document_with_latest
+from backend.app.routers.helpers import download_signature, check_download_signature, DOWNLOAD_URL_TTL_SECONDS, DOWNLOAD_URL_MAX_TTL_SECONDS
 import backend.app.models as models
 import backend.app.schemas as schemas
+from backend.app.access import sync_document_access, accessible_document_ids
+from backend.app.metrics import record_upload, record_download
+from backend.app.profiling import ProfiledRoute
+from backend.app.tracing import tracer
+from backend.app.ratelimit import rate_limited
+from backend.app.storage import read_version_data, read_version_data_by_id
+from backend.app import dedup, trash, audit
+from backend.app.trash import TrashError
+from backend.app.events import notify_documents, notify_removed, document_audiences
+from backend.app.changelog import record_changes, changes_since, head as changelog_head, CHANGE_LOG_PAGE_SIZE, CHANGE_LOG_MAX_PAGE_SIZE
+from opentelemetry import trace
 import io
+import os
+import time
+from datetime import datetime, timezone
+import threading
 import mimetypes
 import urllib.parse
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
+
+# Facet aggregates are cached per (department, filters) for this many seconds; 0 disables the cache
+SEARCH_FACET_CACHE_SECONDS = float(os.getenv("SEARCH_FACET_CACHE_SECONDS", 30))
+SEARCH_FACET_CACHE_SIZE = 1024
+SEARCH_FACETS = ("tag", "department", "owner", "visibility")
+_facet_cache: dict[tuple, tuple[float, dict]] = {}
+_facet_cache_lock = threading.Lock()
 
 
 # for testing: checks for all documents in the database
@@ -28,6 +51,7 @@ def list_documents(db: Session = Depends(get_db),
         .options(selectinload(D.tags), selectinload(D.department), selectinload(D.owner))
         .outerjoin(V, and_(V.document_id == D.document_id,
                                 V.version_number == D.latest_version_number))
+        .filter(D.deleted_at.is_(None))
         .all()
     )
 
@@ -45,7 +69,7 @@ def list_document_versions(
 
     versions = (
         db.query(models.DocumentVersion)
-        .filter(models.DocumentVersion.document_id == document_id)
+        .filter(models.DocumentVersion.document_id == document_id, models.DocumentVersion.deleted_at.is_(None))
         .order_by(models.DocumentVersion.version_number)
         .all()
     )
@@ -77,16 +101,9 @@ def get_accessible_documents(current_user: models.User = Depends(get_current_use
 
     D = models.Document
     V = models.DocumentVersion
-    P = models.DocumentViewPermission
-    E = models.DocumentEditPermission
 
-    # Document id sets for each rule:
-    ids_public = set(db.execute(select(D.document_id).where(D.is_public == True)).scalars().all()) # public docs
-    ids_dept   = set(db.execute(select(D.document_id).where(D.department_id == user.department_id)).scalars().all()) # docs with user's dept id
-    ids_perm   = set(db.execute(select(P.document_id).where(P.department_id == user.department_id)).scalars().all()) # docs with explicit permission for user dept
-    ids_edit  = set(db.execute(select(E.document_id).where(E.user_id == user.user_id)).scalars().all()) # user has explicit edit permission
-
-    doc_ids = ids_public | ids_dept | ids_perm | ids_edit
+    # public docs, user's department docs, explicit department permissions and edit permissions
+    doc_ids = accessible_document_ids(user)
 
     user_model = schemas.User.model_validate(user)
 
@@ -103,39 +120,87 @@ def get_accessible_documents(current_user: models.User = Depends(get_current_use
         if role is not None:
             user_model.role_name = role.name
 
-    if not doc_ids:
-        return schemas.AccessibleDocuments(user=user_model, documents=[])
-
     # Fetch documents with their latest version
-    rows = (
-        db.query(D, V)
-        .options(selectinload(D.tags), selectinload(D.department), selectinload(D.owner))
-        .outerjoin(V, and_(V.document_id == D.document_id, V.version_number == D.latest_version_number))
-        .filter(D.document_id.in_(list(doc_ids)))
-        .all()
-    )
-
-    documents = [_serialize_document_with_latest(doc, ver) for doc, ver in rows]
+    with tracer.start_as_current_span("documents.query"):
+        rows = (
+            db.query(D, V)
+            .options(selectinload(D.tags), selectinload(D.department), selectinload(D.owner))
+            .outerjoin(V, and_(V.document_id == D.document_id, V.version_number == D.latest_version_number))
+            .filter(D.document_id.in_(doc_ids))
+            .all()
+        )
+
+    with tracer.start_as_current_span("documents.serialize") as span:
+        span.set_attribute("documents.count", len(rows))
+        documents = [_serialize_document_with_latest(doc, ver) for doc, ver in rows]
     return schemas.AccessibleDocuments(user=user_model, documents=documents)
 
 
+@router.get("/changes", response_model=schemas.DocumentChanges)
+def get_document_changes(
+    cursor: int | None = Query(None, ge=0, description="cursor returned by the previous call; omit to get the current head"),
+    limit: int = Query(CHANGE_LOG_PAGE_SIZE, ge=1, le=CHANGE_LOG_MAX_PAGE_SIZE),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Documents changed since `cursor` that the user can see, with their current state, in change order
+    (see backend.app.changelog). Without a cursor only the current head is returned: take it before the
+    initial /documents/me fetch and sync from there."""
+    if cursor is None:
+        return schemas.DocumentChanges(cursor=changelog_head(db))
+    D = models.Document
+    V = models.DocumentVersion
+    is_admin = current_user.role_id == 0 or getattr(current_user.role, "name", None) == "admin"
+    with tracer.start_as_current_span("documents.query"):
+        changes, next_cursor, has_more = changes_since(db, current_user, cursor, limit, is_admin=is_admin)
+        visible = [c.document_id for c in changes if not c.removed]
+        rows = (
+            db.query(D, V)
+            .options(selectinload(D.tags), selectinload(D.department), selectinload(D.owner))
+            .outerjoin(V, and_(V.document_id == D.document_id, V.version_number == D.latest_version_number))
+            .filter(D.document_id.in_(visible))
+            .all()
+        ) if visible else []
+    documents = {doc.document_id: _serialize_document_with_latest(doc, ver) for doc, ver in rows}
+    return schemas.DocumentChanges(
+        changes=[schemas.DocumentChange(change_id=c.change_id, document_id=c.document_id, change_type=c.change_type,
+                                        removed=c.removed, document=documents.get(c.document_id))
+                 for c in changes],
+        cursor=next_cursor,
+        has_more=has_more,
+    )
+
+
 @router.post("/upload", response_model=schemas.DocumentWithLatestVersion)
+@rate_limited("upload", concurrent=True)
 def upload_document(
     file: UploadFile = File(...),
     is_public: bool | None = Form(True),
     title: str | None = Form(None),
+    response: Response = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
     """Create a new Document and its initial version in one request.
-    If a document with the same title (case-insensitive) exists, appends a new version to it instead."""
+    If a document with the same title (case-insensitive) exists, appends a new version to it instead.
+    Content that already exists is reported or deduplicated according to UPLOAD_DEDUP_MODE."""
 
     # Read and validate file
-    file_bytes = file.file.read()
+    file_bytes, digest = dedup.read_and_hash(file.file)
     if not file_bytes:
         raise HTTPException(status_code=400, detail="empty file uploaded")
-    file_size = len(file_bytes)
+    record_upload(len(file_bytes))
+    return store_upload(db, current_user, file.filename, file_bytes, title, is_public, digest, response)
+
 
+def store_upload(db: Session, current_user: models.User, file_name: str | None, file_bytes: bytes,
+                 title: str | None, is_public: bool | None, digest: str | None = None,
+                 response: Response | None = None) -> schemas.DocumentWithLatestVersion:
+    """Body of /upload, shared with resumable uploads (backend.app.uploads): append a version to the
+    document titled `title`, or create a document. Commits, together with whatever `db` has pending."""
+    from backend.app import previews
+
+    digest = digest or dedup.content_hash(file_bytes)
     uploader_id = current_user.user_id
     if current_user.department_id is None:
         raise HTTPException(status_code=400, detail="uploader must belong to a department")
@@ -146,29 +211,38 @@ def upload_document(
     if title:
         # Find a document whose latest version title matches exactly but case-insensitively.
         doc = (db.query(models.Document)
-            .filter(func.lower(models.Document.latest_version_title) == title.lower())
+            .filter(func.lower(models.Document.latest_version_title) == title.lower(), models.Document.deleted_at.is_(None))
             .one_or_none())
 
         if doc is not None:
             doc = authorize_document_manage(db, doc.document_id, current_user)
+            same = dedup.unchanged_latest(db, doc, digest, title)
+            if same is not None:
+                db.commit()
+                dedup.report_duplicates(db, current_user, digest, same, response, skipped=True)
+                return _serialize_document_with_latest(doc, same)
             next_version = (doc.latest_version_number or 0) + 1
             new_version = models.DocumentVersion(
                 uploader_id=uploader_id,
                 document_id=doc.document_id,
                 version_number=next_version,
                 title=title,
-                file_name=file.filename,
-                file_data=file_bytes,
-                file_size=file_size,
+                file_name=file_name,
+                **dedup.payload_columns(db, file_bytes, digest),
             )
             db.add(new_version)
             doc.latest_version_number = next_version
             doc.latest_version_title = title
 
             try:
+                record_changes(db, [doc.document_id], "updated")
                 db.commit()
                 db.refresh(doc)
                 db.refresh(new_version)
+                notify_documents(db, [doc.document_id])
+                audit.record(current_user, "updated", [doc.document_id], version_id=new_version.version_id)
+                dedup.report_duplicates(db, current_user, digest, new_version, response)
+                previews.request(digest, new_version.version_id)
                 doc_model = schemas.DocumentWithLatestVersion.model_validate(doc)
                 doc_model.latest_version = schemas.DocumentVersion.model_validate(new_version)
                 doc_model.latest_version_title = new_version.title
@@ -187,18 +261,23 @@ def upload_document(
         document_id=doc.document_id,
         version_number=1,
         title=title,
-        file_name=file.filename,
-        file_data=file_bytes,
-        file_size=file_size,
+        file_name=file_name,
+        **dedup.payload_columns(db, file_bytes, digest),
     )
     db.add(new_version)
     doc.latest_version_number = 1
     doc.latest_version_title = title
+    sync_document_access(db, doc)
 
     try:
+        record_changes(db, [doc.document_id], "created")
         db.commit()
         db.refresh(doc)
         db.refresh(new_version)
+        notify_documents(db, [doc.document_id], "document.created")
+        audit.record(current_user, "created", [doc.document_id], version_id=new_version.version_id)
+        dedup.report_duplicates(db, current_user, digest, new_version, response)
+        previews.request(digest, new_version.version_id)
         doc_model = schemas.DocumentWithLatestVersion.model_validate(doc)
         doc_model.latest_version = schemas.DocumentVersion.model_validate(new_version)
         doc_model.latest_version_title = new_version.title
@@ -209,22 +288,40 @@ def upload_document(
 
 
 @router.post("/{document_id}/update", response_model=schemas.DocumentVersion)
+@rate_limited("upload", concurrent=True)
 def upload_new_version(
     document_id: int,
     file: UploadFile = File(...),
     title: str | None = Form(None),
+    response: Response = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
-    """Append a new version to an existing document by document_id."""
+    """Append a new version to an existing document by document_id.
+    Content that already exists is reported or deduplicated according to UPLOAD_DEDUP_MODE."""
     
     # Read and validate file
-    file_bytes = file.file.read()
+    file_bytes, digest = dedup.read_and_hash(file.file)
     if not file_bytes:
         raise HTTPException(status_code=400, detail="empty file uploaded")
-    file_size = len(file_bytes)
+    record_upload(len(file_bytes))
+    return store_new_version(db, current_user, document_id, file.filename, file_bytes, title, digest, response)
+
+
+def store_new_version(db: Session, current_user: models.User, document_id: int, file_name: str | None,
+                      file_bytes: bytes, title: str | None, digest: str | None = None,
+                      response: Response | None = None) -> models.DocumentVersion:
+    """Body of /{document_id}/update, shared with resumable uploads. Commits, together with whatever
+    `db` has pending. Returns the document's latest version when the upload was a skipped no-op."""
+    from backend.app import previews
 
+    digest = digest or dedup.content_hash(file_bytes)
     doc = authorize_document_manage(db, document_id, current_user)
+    same = dedup.unchanged_latest(db, doc, digest, title)
+    if same is not None:
+        db.commit()
+        dedup.report_duplicates(db, current_user, digest, same, response, skipped=True)
+        return same
 
     # Document exists and user is authorized adding new version
     next_version = (doc.latest_version_number or 0) + 1
@@ -233,9 +330,8 @@ def upload_new_version(
         document_id=document_id,
         version_number=next_version,
         title=title,
-        file_name=file.filename,
-        file_data=file_bytes,
-        file_size=file_size,
+        file_name=file_name,
+        **dedup.payload_columns(db, file_bytes, digest),
     )
 
     db.add(new_version)
@@ -243,43 +339,206 @@ def upload_new_version(
     doc.latest_version_title = title
 
     try:
+        record_changes(db, [document_id], "updated")
         db.commit()
         db.refresh(new_version)
+        notify_documents(db, [document_id])
+        audit.record(current_user, "updated", [document_id], version_id=new_version.version_id)
+        dedup.report_duplicates(db, current_user, digest, new_version, response)
+        previews.request(digest, new_version.version_id)
         return new_version
     except IntegrityError:
         db.rollback()
         raise HTTPException(status_code=409, detail="could not create version due to conflict")
 
 @router.get("/versions/{version_id}/download")
+@rate_limited("download", concurrent=True)
 def download_version(
     version_id: int, 
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
     """Download a specific document version by version_id."""
-    version = db.query(models.DocumentVersion).filter(models.DocumentVersion.version_id == version_id).first()
+    # file_data is deferred: it is only read on a payload cache miss
+    version = (db.query(models.DocumentVersion).options(defer(models.DocumentVersion.file_data))
+               .filter(models.DocumentVersion.version_id == version_id, models.DocumentVersion.deleted_at.is_(None)).first())
     if not version:
         raise HTTPException(status_code=404, detail="version not found")
     # Check if user can access the document
     can_access_document(version.document_id, current_user, db)
 
+    with tracer.start_as_current_span("storage.read") as span:
+        span.set_attribute("storage.tier", version.storage_tier)
+        file_data = read_version_data(db, version)
+        span.set_attribute("storage.bytes", len(file_data))
+
+    record_download(len(file_data))
+    audit.record(current_user, "download", [version.document_id], version_id=version.version_id)
+    return _file_response(file_data, version.file_name or f"document_{version.version_id}")
+
+def _file_response(file_data: bytes, filename: str) -> StreamingResponse:
     # determine mime type from filename if possible
-    mime_type, _ = mimetypes.guess_type(version.file_name or "")
+    mime_type, _ = mimetypes.guess_type(filename)
     media_type = mime_type or "application/octet-stream"
 
     # inline for viewable types, otherwise attachment
     inline_types = ("image/", "text/", "application/pdf")
     disposition_kind = "inline" if any(media_type.startswith(t) for t in inline_types) else "attachment"
 
-    filename = version.file_name or f"document_{version.version_id}"
     filename_quoted = urllib.parse.quote(filename)
-
     return StreamingResponse(
-        io.BytesIO(version.file_data),
+        io.BytesIO(file_data),
         media_type=media_type,
         headers={"Content-Disposition": f'{disposition_kind}; filename="{filename_quoted}"'}
     )
 
+@router.post("/versions/{version_id}/signed-url", response_model=schemas.SignedDownloadUrl)
+def create_signed_download_url(
+    version_id: int,
+    request: Request,
+    ttl: int = Query(DOWNLOAD_URL_TTL_SECONDS, ge=1, le=DOWNLOAD_URL_MAX_TTL_SECONDS),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """A URL that downloads the version without authentication until it expires (`ttl` seconds), for
+    embedded viewers and sharing. Access is checked now, once: like any bearer link it keeps working
+    until it expires, even if the user loses access or the version is trashed meanwhile."""
+    V = models.DocumentVersion
+    version = (db.query(V.document_id, V.file_name)
+               .filter(V.version_id == version_id, V.deleted_at.is_(None)).one_or_none())
+    if version is None:
+        raise HTTPException(status_code=404, detail="version not found")
+    can_access_document(version.document_id, current_user, db)
+    expires = int(time.time()) + ttl
+    file_name = version.file_name or f"document_{version_id}"
+    params = {"d": version.document_id, "u": current_user.user_id, "exp": expires, "name": file_name,
+              "sig": download_signature(version_id, version.document_id, current_user.user_id, expires, file_name)}
+    url = f"{request.url_for('download_signed_version', version_id=version_id)}?{urllib.parse.urlencode(params)}"
+    return schemas.SignedDownloadUrl(url=url, expires_at=datetime.fromtimestamp(expires, timezone.utc))
+
+@router.get("/versions/{version_id}/signed")
+@rate_limited("signed_download", per_user=False)
+def download_signed_version(
+    version_id: int,
+    request: Request,
+    d: int,
+    u: int,
+    exp: int,
+    name: str,
+    sig: str,
+):
+    """Download through a signed URL from /signed-url. No user, permission or session lookup: the
+    signature is the authorization, and the payload comes from the payload cache when it is there."""
+    if not check_download_signature(version_id, d, u, exp, name, sig):
+        raise HTTPException(status_code=403, detail="invalid or expired link")
+    with tracer.start_as_current_span("storage.read") as span:
+        file_data = read_version_data_by_id(version_id)
+        if file_data is None:
+            raise HTTPException(status_code=404, detail="version not found")
+        span.set_attribute("storage.bytes", len(file_data))
+    record_download(len(file_data))
+    audit.record(u, "download", [d], "signed link", version_id=version_id)
+    return _file_response(file_data, name)
+
+@router.get("/versions/{version_id}/diff/{other_version_id}")
+@rate_limited("diff", concurrent=True)
+def diff_versions(
+    version_id: int,
+    other_version_id: int,
+    granularity: str = Query("line", pattern="^(line|word)$"),
+    # diffs.DIFF_CONTEXT_LINES and DIFF_MAX_CONTEXT, spelled out so that the app does not import diffs (and
+    # difflib) before the first diff
+    context: int = Query(3, ge=0, le=100),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Changes from one version of a document to another (either order), streamed as NDJSON hunks
+    (backend.app.diffs). Texts are extracted once per content and diffs memoised per pair of contents."""
+    from backend.app import diffs
+
+    V = models.DocumentVersion
+    versions = {v.version_id: v for v in db.query(V).options(defer(V.file_data))
+                .filter(V.version_id.in_([version_id, other_version_id]), V.deleted_at.is_(None)).all()}
+    if version_id not in versions or other_version_id not in versions:
+        raise HTTPException(status_code=404, detail="version not found")
+    version_a, version_b = versions[version_id], versions[other_version_id]
+    if version_a.document_id != version_b.document_id:
+        raise HTTPException(status_code=400, detail="versions belong to different documents")
+    can_access_document(version_a.document_id, current_user, db)
+    try:
+        with tracer.start_as_current_span("diff.prepare") as span:
+            diff = diffs.prepare(db, version_a, version_b, granularity, context)
+            span.set_attribute("diff.cache", "hit" if diff.cached else "miss")
+    except diffs.DiffError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    audit.record(current_user, "diff", [version_a.document_id], f"against version {version_id}", version_id=other_version_id)
+    start = {"type": "start", "version_a": version_id, "version_b": other_version_id, "granularity": granularity, "context": context}
+    return StreamingResponse(diff.stream(start), media_type="application/x-ndjson",
+                             headers={"X-Diff-Cache": "hit" if diff.cached else "miss"})
+
+def _version_preview(db: Session, version_id: int, current_user: models.User) -> tuple[models.DocumentVersion, models.ContentPreview | None]:
+    V = models.DocumentVersion
+    version = db.query(V).options(defer(V.file_data)).filter(V.version_id == version_id, V.deleted_at.is_(None)).first()
+    if not version:
+        raise HTTPException(status_code=404, detail="version not found")
+    can_access_document(version.document_id, current_user, db)
+    preview = None
+    if version.content_sha256 is not None:
+        preview = db.get(models.ContentPreview, version.content_sha256)
+    return version, preview
+
+
+def _preview_cache_headers(preview: models.ContentPreview) -> dict:
+    from backend.app import previews
+
+    # a ready preview belongs to the content, which never changes; private: it is only for users with access
+    if preview.status == previews.READY:
+        return {"ETag": f'"{preview.content_sha256}"',
+                "Cache-Control": f"private, max-age={previews.PREVIEW_CACHE_SECONDS}, immutable"}
+    # the others are redone after `python -m backend.app.previews reset`: revalidated, and their tag changes then
+    return {"ETag": f'"{preview.content_sha256}-{preview.status}"', "Cache-Control": "private, no-cache"}
+
+
+@router.get("/versions/{version_id}/preview", response_model=schemas.VersionPreview)
+def get_version_preview(
+    version_id: int,
+    response: Response,
+    if_none_match: str | None = Header(None),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Preview of a version (backend.app.previews): status, kind, text snippet and whether there is a
+    thumbnail. Generated in the background; until then the status is pending."""
+    version, preview = _version_preview(db, version_id, current_user)
+    if preview is None:
+        status = "pending" if version.content_sha256 is not None else "unavailable"
+        return schemas.VersionPreview(version_id=version_id, status=status)
+    headers = _preview_cache_headers(preview)
+    if if_none_match == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return schemas.VersionPreview(version_id=version_id, status=preview.status, kind=preview.kind,
+                                  has_thumbnail=preview.thumbnail is not None, snippet=preview.snippet)
+
+
+@router.get("/versions/{version_id}/thumbnail")
+def get_version_thumbnail(
+    version_id: int,
+    if_none_match: str | None = Header(None),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Thumbnail image of a version (JPEG or PNG), if its preview has one."""
+    version, preview = _version_preview(db, version_id, current_user)
+    if preview is None:
+        raise HTTPException(status_code=404, detail="preview not generated yet", headers={"Retry-After": "10"})
+    if preview.thumbnail is None:
+        raise HTTPException(status_code=404, detail="no thumbnail for this version")
+    headers = _preview_cache_headers(preview)
+    if if_none_match == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=preview.thumbnail, media_type=preview.thumbnail_type, headers=headers)
+
 @router.post("/publicity/{document_id}/toggle", response_model=schemas.Document)
 def toggle_document_publicity(
     document_id: int, 
@@ -288,80 +547,364 @@ def toggle_document_publicity(
 ):
     """Set the publicity status of a document. Only users from the document's department may change publicity."""
     doc = authorize_document_manage(db, document_id, current_user)
-    
+    # making a document private takes access away; their users get document.removed
+    previous = document_audiences(db, [document_id])
 
     # If making a document public, remove all explicit permissions
     if not doc.is_public:
         db.query(models.DocumentViewPermission).filter(models.DocumentViewPermission.document_id == document_id).delete()
     doc.is_public = not doc.is_public
+    sync_document_access(db, doc)
+    record_changes(db, [document_id], "publicity")
     db.commit()
     db.refresh(doc)
+    notify_documents(db, [document_id], previous=previous)
+    audit.record(current_user, "publicity", [document_id], "public" if doc.is_public else "private")
     return schemas.Document.model_validate(doc)
 
-@router.get("/search", response_model=list[schemas.DocumentWithLatestVersion])
-def search_documents(
-    title: str | None = None,
-    tags: list[str] | None = Query(None, description="Tag names to match (any)"),
-    uploader_id: int | None = None,
-    uploader_name: str | None = None,
-    limit: int = 30,
-    offset: int = 0,
+@router.delete("/{document_id}")
+def delete_document(
+    document_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
-    """Search documents by title (partial, case-insensitive), tags (any), or uploader.
-    Returns only documents the current_user can access."""
+    """Move a document to the trash (managers only). It disappears for everyone at once and can be restored
+    until it is purged, TRASH_RETENTION_DAYS later."""
+    doc = authorize_document_manage(db, document_id, current_user)
+    previous = document_audiences(db, [document_id])
+    trash.trash_document(db, doc, current_user.user_id)
+    record_changes(db, [document_id], "deleted")
+    db.commit()
+    notify_removed([document_id], previous)
+    audit.record(current_user, "deleted", [document_id])
+    return {"detail": "moved to trash", "purge_after": trash.purge_after(doc.deleted_at)}
+
+@router.post("/{document_id}/restore", response_model=schemas.Document)
+def restore_document(
+    document_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Take a document out of the trash, with the access it had."""
+    D = models.Document
+    doc = authorize_document_manage(db, document_id, current_user, trashed=True)
+    # uploads append to the document with the same title, which must stay unambiguous
+    title = doc.latest_version_title
+    if title and (db.query(D.document_id)
+                  .filter(func.lower(D.latest_version_title) == title.lower(), D.deleted_at.is_(None)).first()):
+        raise HTTPException(status_code=409, detail="another document has the same title now")
+    trash.restore_document(db, doc)
+    record_changes(db, [document_id], "restored")
+    db.commit()
+    db.refresh(doc)
+    notify_documents(db, [document_id], "document.created")
+    audit.record(current_user, "restored", [document_id])
+    return schemas.Document.model_validate(doc)
+
+def _version_for_trash(db: Session, version_id: int, current_user: models.User, trashed: bool) -> tuple[models.Document, models.DocumentVersion]:
+    V = models.DocumentVersion
+    document_id = db.query(V.document_id).filter(V.version_id == version_id).scalar()
+    if document_id is None:
+        raise HTTPException(status_code=404, detail="version not found")
+    # the document first, as uploads lock it
+    doc = authorize_document_manage(db, document_id, current_user)
+    version = (db.query(V).options(defer(V.file_data)).with_for_update()
+               .filter(V.version_id == version_id, V.deleted_at.isnot(None) if trashed else V.deleted_at.is_(None))
+               .one_or_none())
+    if version is None:
+        raise HTTPException(status_code=404, detail="version not found")
+    return doc, version
+
+@router.delete("/versions/{version_id}")
+def delete_version(
+    version_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Move a version other than the latest to the trash (managers only)."""
+    doc, version = _version_for_trash(db, version_id, current_user, trashed=False)
+    try:
+        trash.trash_version(doc, version, current_user.user_id)
+    except TrashError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    record_changes(db, [doc.document_id], "versions")
+    db.commit()
+    notify_documents(db, [doc.document_id])
+    audit.record(current_user, "version_deleted", [doc.document_id], version_id=version_id)
+    return {"detail": "moved to trash", "purge_after": trash.purge_after(version.deleted_at)}
+
+@router.post("/versions/{version_id}/restore", response_model=schemas.DocumentVersion)
+def restore_version(
+    version_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Take a version out of the trash."""
+    doc, version = _version_for_trash(db, version_id, current_user, trashed=True)
+    trash.restore_version(version)
+    record_changes(db, [doc.document_id], "versions")
+    db.commit()
+    db.refresh(version)
+    notify_documents(db, [doc.document_id])
+    audit.record(current_user, "version_restored", [doc.document_id], version_id=version_id)
+    return schemas.DocumentVersion.model_validate(version)
+
+@router.get("/trash", response_model=schemas.Trash)
+def list_trash(
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Documents in the trash, and trashed versions of other documents, that the user may manage (admins:
+    all), most recently deleted first."""
     D = models.Document
     V = models.DocumentVersion
-    P = models.DocumentViewPermission
+    E = models.DocumentEditPermission
+    docs_q = (db.query(D, V)
+              .options(selectinload(D.tags), selectinload(D.department), selectinload(D.owner))
+              .outerjoin(V, and_(V.document_id == D.document_id, V.version_number == D.latest_version_number))
+              .filter(D.deleted_at.isnot(None)))
+    versions_q = (db.query(V).options(defer(V.file_data)).join(D, D.document_id == V.document_id)
+                  .filter(V.deleted_at.isnot(None), D.deleted_at.is_(None)))
+    if not (current_user.role_id == 0 or getattr(current_user.role, "name", None) == "admin"):
+        managed = or_(D.owner_user_id == current_user.user_id,
+                      D.document_id.in_(select(E.document_id).where(E.user_id == current_user.user_id)))
+        docs_q = docs_q.filter(managed)
+        versions_q = versions_q.filter(managed)
+    documents = []
+    for doc, ver in docs_q.order_by(D.deleted_at.desc()).limit(limit).all():
+        documents.append(schemas.TrashedDocument(**_serialize_document_with_latest(doc, ver).model_dump(),
+                                                 deleted_at=doc.deleted_at, deleted_by=doc.deleted_by,
+                                                 purge_after=trash.purge_after(doc.deleted_at)))
+    versions = []
+    for v in versions_q.order_by(V.deleted_at.desc()).limit(limit).all():
+        item = schemas.TrashedVersion.model_validate(v)
+        item.purge_after = trash.purge_after(v.deleted_at)
+        versions.append(item)
+    return schemas.Trash(documents=documents, versions=versions)
+
+def _search_filters(
+    title: str | None = None,
+    tags: list[str] | None = Query(None, description="Tag names to match"),
+    tag_mode: str = Query("any", pattern="^(any|all)$", description="Match documents with any or all of the tags"),
+    uploader_id: list[int] | None = Query(None, description="Uploader user ids (any of)"),
+    uploader_name: str | None = Query(None, description="Matched against username and full name, case-insensitive"),
+    uploader_match: str = Query("contains", pattern="^(contains|prefix)$"),
+    uploader_scope: str = Query("any", pattern="^(any|latest)$", description="Match the uploader of any version or only the latest"),
+) -> schemas.SearchFilters:
+    """Query parameters shared by /search and /search/faceted."""
+    return schemas.SearchFilters(
+        title=title, tags=tags or [], tag_mode=tag_mode, uploader_ids=uploader_id or [],
+        uploader_name=uploader_name, uploader_match=uploader_match, uploader_scope=uploader_scope,
+    )
+
 
-    # Get accessible document IDs for the current user
-    ids_public = set(db.execute(select(D.document_id).where(D.is_public == True)).scalars().all())
-    ids_dept = set()
-    ids_perm = set()
-    if getattr(current_user, "department_id", None) is not None:
-        ids_dept = set(db.execute(select(D.document_id).where(D.department_id == current_user.department_id)).scalars().all())
-        ids_perm = set(db.execute(select(P.document_id).where(P.department_id == current_user.department_id)).scalars().all())
+def _tagged_document_ids(tag_names: list[str], tag_mode: str = "any"):
+    """Select of document ids carrying any (or all) of the given tag names.
+    Runs on the document_tags(tag_id, document_id) index and never fans out the outer query."""
+    DT = models.DocumentTag
+    T = models.Tag
+    names = list(dict.fromkeys(tag_names))
+    q = select(DT.document_id).join(T, T.tag_id == DT.tag_id).where(T.tag_name.in_(names))
+    if tag_mode == "all":
+        # (document_id, tag_id) is the PK and tag names are unique, so a plain count is exact
+        q = q.group_by(DT.document_id).having(func.count(DT.tag_id) == len(names))
+    return q
+
+
+def _uploader_ids(filters: schemas.SearchFilters):
+    """Uploader ids as a list (ids only) or a select over users (name given), matched with the indexed expressions."""
+    U = models.User
+    if not filters.uploader_name:
+        return filters.uploader_ids
+    needle = filters.uploader_name.lower()
+    if filters.uploader_match == "prefix":
+        name_match = or_(func.lower(U.username).startswith(needle, autoescape=True),
+                         models.user_full_name_lower().startswith(needle, autoescape=True))
+    else:
+        name_match = or_(func.lower(U.username).contains(needle, autoescape=True),
+                         models.user_full_name_lower().contains(needle, autoescape=True))
+    q = select(U.user_id).where(name_match)
+    if filters.uploader_ids:
+        q = q.where(U.user_id.in_(filters.uploader_ids))
+    return q
+
+
+def _apply_search_filters(q, current_user: models.User, filters: schemas.SearchFilters):
+    """Apply access + search filters to a query over Document outer-joined to its latest DocumentVersion."""
+    D = models.Document
+    V = models.DocumentVersion
 
-    accessible_ids = ids_public | ids_dept | ids_perm
-    if not accessible_ids:
-        return []
+    # Accessible documents: public, user's department, explicit department permissions
+    q = q.filter(D.document_id.in_(accessible_document_ids(current_user, include_edit=False)))
+
+    # Checking for document title (partial, case-insensitive)
+    if filters.title:
+        q = q.filter(func.lower(D.latest_version_title).contains(filters.title.lower()))
 
+    # Checking for tags
+    if filters.tags:
+        q = q.filter(D.document_id.in_(_tagged_document_ids(filters.tags, filters.tag_mode)))
+
+    # Checking for uploader: semi-join over all versions driven by the (uploader_id, document_id) index,
+    # or the latest version only
+    if filters.uploader_ids or filters.uploader_name:
+        uploader_ids = _uploader_ids(filters)
+        if filters.uploader_scope == "latest":
+            q = q.filter(V.uploader_id.in_(uploader_ids))
+        else:
+            AV = aliased(models.DocumentVersion)
+            q = q.filter(D.document_id.in_(select(AV.document_id).where(AV.uploader_id.in_(uploader_ids))))
+    return q
+
+
+def _search_page(db: Session, current_user: models.User, filters: schemas.SearchFilters, limit: int, offset: int):
+    D = models.Document
+    V = models.DocumentVersion
     # Base query returning document + its latest version
     q = (
         db.query(D, V)
         .options(selectinload(D.tags), selectinload(D.department), selectinload(D.owner))
         .outerjoin(V, and_(V.document_id == D.document_id, V.version_number == D.latest_version_number))
-        .filter(D.document_id.in_(list(accessible_ids)))
     )
+    q = _apply_search_filters(q, current_user, filters)
+    with tracer.start_as_current_span("documents.query"):
+        rows = q.limit(limit).offset(offset).all()
+    with tracer.start_as_current_span("documents.serialize") as span:
+        span.set_attribute("documents.count", len(rows))
+        return [_serialize_document_with_latest(doc, ver) for doc, ver in rows]
 
-    # Checking for document title (partial, case-insensitive)
-    if title:
-        q = q.filter(func.lower(D.latest_version_title).contains(title.lower()))
-
-    # Checking for tags
-    if tags:
-        q = q.join(D.tags).filter(models.Tag.tag_name.in_(tags))
 
-    # Checking for uploader
-    if uploader_id is not None or uploader_name:
-        q = q.join(models.User, V.uploader_id == models.User.user_id)
-        if uploader_id is not None:
-            q = q.filter(models.User.user_id == uploader_id)
-        if uploader_name:
-            q = q.filter(func.lower(models.User.username).contains(uploader_name.lower()))
+@router.get("/search", response_model=list[schemas.DocumentWithLatestVersion])
+@rate_limited("search")
+def search_documents(
+    filters: schemas.SearchFilters = Depends(_search_filters),
+    limit: int = 30,
+    offset: int = 0,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Search documents by title (partial, case-insensitive), tags (any/all), or uploader(s).
+    Returns only documents the current_user can access."""
+    return _search_page(db, current_user, filters, limit, offset)
 
-    q = q.distinct().limit(limit).offset(offset)
 
-    rows = q.all()
-    return [_serialize_document_with_latest(doc, ver) for doc, ver in rows]
+def _facet_aggregate(db: Session, current_user: models.User, filters: schemas.SearchFilters,
+                     facets: list[str], facet_limit: int) -> dict:
+    """Total + requested facet buckets for the full match set, in a single UNION ALL statement over one CTE."""
+    D = models.Document
+    V = models.DocumentVersion
+    DT = models.DocumentTag
+    T = models.Tag
+    U = models.User
+    Dept = models.Department
+
+    m = _apply_search_filters(
+        db.query(D.document_id, D.department_id, D.owner_user_id, D.is_public)
+        .outerjoin(V, and_(V.document_id == D.document_id, V.version_number == D.latest_version_number)),
+        current_user, filters,
+    ).cte("matching")
+
+    def bucket(facet: str, key, name, select_from, group_by):
+        n = func.count().label("n")
+        q = (select(literal(facet).label("facet"), key.label("key"), name.label("name"), n)
+             .select_from(select_from).group_by(*group_by).order_by(n.desc()).limit(facet_limit).subquery())
+        return select(q.c.facet, q.c.key, q.c.name, q.c.n)
+
+    branches = [select(literal("total").label("facet"), literal(None, Integer).label("key"),
+                       literal(None, String).label("name"), func.count().label("n")).select_from(m)]
+    if "tag" in facets:
+        branches.append(bucket("tag", T.tag_id, T.tag_name,
+                               m.join(DT, DT.document_id == m.c.document_id).join(T, T.tag_id == DT.tag_id),
+                               (T.tag_id, T.tag_name)))
+    if "department" in facets:
+        branches.append(bucket("department", m.c.department_id, Dept.name,
+                               m.outerjoin(Dept, Dept.department_id == m.c.department_id),
+                               (m.c.department_id, Dept.name)))
+    if "owner" in facets:
+        # same preference as serialization: full name if both present, else username
+        owner_name = case((and_(U.first_name.isnot(None), U.last_name.isnot(None)), U.first_name + " " + U.last_name), else_=U.username)
+        branches.append(bucket("owner", m.c.owner_user_id, owner_name,
+                               m.outerjoin(U, U.user_id == m.c.owner_user_id),
+                               (m.c.owner_user_id, U.first_name, U.last_name, U.username)))
+    if "visibility" in facets:
+        public_key = case((m.c.is_public == True, 1), else_=0)
+        branches.append(bucket("visibility", public_key, case((m.c.is_public == True, "public"), else_="private"),
+                               m, (m.c.is_public,)))
+
+    result = {"total": 0, "tag": [], "department": [], "owner": [], "visibility": []}
+    for facet, key, name, n in db.execute(union_all(*branches)).all():
+        if facet == "total":
+            result["total"] = n
+        else:
+            result[facet].append({"key": key, "name": name, "count": n})
+    for facet in SEARCH_FACETS:
+        result[facet].sort(key=lambda b: (-b["count"], str(b["name"])))
+    return result
+
+
+def _cached_facet_aggregate(db: Session, current_user: models.User, filters: schemas.SearchFilters,
+                            facets: list[str], facet_limit: int) -> dict:
+    # Search access depends only on the department, so users of one department share entries
+    key = (getattr(current_user, "department_id", None), filters.model_dump_json(), tuple(sorted(facets)), facet_limit)
+    now = time.monotonic()
+    span = trace.get_current_span()
+    if SEARCH_FACET_CACHE_SECONDS > 0:
+        with _facet_cache_lock:
+            hit = _facet_cache.get(key)
+            if hit is not None and hit[0] > now:
+                span.set_attribute("search.facets.cache_hit", True)
+                return hit[1]
+    span.set_attribute("search.facets.cache_hit", False)
+    result = _facet_aggregate(db, current_user, filters, facets, facet_limit)
+    if SEARCH_FACET_CACHE_SECONDS > 0:
+        with _facet_cache_lock:
+            if len(_facet_cache) >= SEARCH_FACET_CACHE_SIZE:
+                # drop expired entries first, then the oldest half
+                for k in [k for k, (exp, _) in _facet_cache.items() if exp <= now]:
+                    del _facet_cache[k]
+                if len(_facet_cache) >= SEARCH_FACET_CACHE_SIZE:
+                    for k in sorted(_facet_cache, key=lambda k: _facet_cache[k][0])[:SEARCH_FACET_CACHE_SIZE // 2]:
+                        del _facet_cache[k]
+            _facet_cache[key] = (now + SEARCH_FACET_CACHE_SECONDS, result)
+    return result
+
+
+@router.get("/search/faceted", response_model=schemas.SearchResults)
+@rate_limited("search")
+def search_documents_faceted(
+    filters: schemas.SearchFilters = Depends(_search_filters),
+    facets: list[str] | None = Query(None, description="Facets to compute: tag, department, owner, visibility (default all)"),
+    facet_limit: int = Query(50, ge=1, le=1000, description="Max buckets per facet"),
+    limit: int = 30,
+    offset: int = 0,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Same filters as /search, plus the exact total and per tag/department/owner/visibility counts over the
+    whole matching set (not just the page). The aggregate is one statement and cached for
+    SEARCH_FACET_CACHE_SECONDS per department + filter combination."""
+    facets = list(facets or SEARCH_FACETS)
+    unknown = [f for f in facets if f not in SEARCH_FACETS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"unknown facet: {unknown[0]}")
+
+    documents = _search_page(db, current_user, filters, limit, offset)
+    with tracer.start_as_current_span("search.facets"):
+        agg = _cached_facet_aggregate(db, current_user, filters, facets, facet_limit)
+    return schemas.SearchResults(
+        total=agg["total"],
+        documents=documents,
+        tag_counts=[schemas.TagCount(tag_id=b["key"], tag_name=b["name"], count=b["count"]) for b in agg["tag"]],
+        department_counts=[schemas.FacetCount(**b) for b in agg["department"]],
+        owner_counts=[schemas.FacetCount(**b) for b in agg["owner"]],
+        visibility_counts=[schemas.FacetCount(**b) for b in agg["visibility"]],
+    )
 
 @router.get("/{document_id}/capabilities", response_model=schemas.DocumentCapabilities)
 def document_capabilities(document_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     """Return capability flags for current user on a document (edit rights etc)."""
-    doc = db.query(models.Document).filter(models.Document.document_id == document_id).one_or_none()
-    if not doc:
-        raise HTTPException(status_code=404, detail="document not found")
+    doc = get_document(db, document_id)
     is_admin = getattr(current_user, 'role_id', None) == 0 or getattr(getattr(current_user,'role',None),'name',None) == 'admin'
     is_owner = getattr(doc, 'owner_user_id', None) == getattr(current_user, 'user_id', None)
     has_explicit_edit = bool(db.query(models.DocumentEditPermission).filter(
@@ -0,0 +1,48 @@
+import time
+from datetime import datetime, timezone
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+import backend.app.models as models
+import backend.app.schemas as schemas
+from backend.app.database import SessionLocal
+from backend.app.routers.helpers import (user_from_token, get_current_user, events_ticket, events_ticket_user,
+                                         EVENTS_TICKET_TTL_SECONDS)
+from backend.app.profiling import ProfiledRoute
+from backend.app import events
+
+router = APIRouter(route_class=ProfiledRoute)
+
+
+@router.post("/ticket", response_model=schemas.EventsTicket)
+def create_events_ticket(current_user: models.User = Depends(get_current_user)):
+    """A ticket for /events/stream?ticket=..., valid EVENTS_TICKET_TTL_SECONDS: browsers' EventSource
+    cannot send the Authorization header, and the bearer token must not end up in URLs (access logs,
+    history). The ticket opens the user's event stream and nothing else."""
+    expires = int(time.time()) + EVENTS_TICKET_TTL_SECONDS
+    return schemas.EventsTicket(ticket=events_ticket(current_user.user_id, expires),
+                                expires_at=datetime.fromtimestamp(expires, timezone.utc))
+
+
+@router.get("/stream")
+def stream_events(request: Request, ticket: str | None = Query(None, description="From POST /events/ticket (EventSource cannot send headers)")):
+    """Server-Sent Events feed of changes to documents the user can access (see backend.app.events).
+    Authenticated by the Authorization header or, for browsers' EventSource, a ticket from /events/ticket."""
+    auth = request.headers.get("authorization", "")
+    # not get_db: the session would stay open, holding a pooled connection, for the life of the stream
+    db = SessionLocal()
+    try:
+        if auth.lower().startswith("bearer "):
+            user = user_from_token(auth[7:], db)
+        else:
+            user_id = events_ticket_user(ticket) if ticket else None
+            user = db.get(models.User, user_id) if user_id is not None else None
+            if user is None:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid or expired ticket")
+        is_admin = user.role_id == 0 or getattr(user.role, "name", None) == "admin"
+        viewer = events.Viewer(user.user_id, user.department_id, is_admin)
+    finally:
+        db.close()
+    if events.broker.streams_of(viewer.user_id) >= events.EVENTS_MAX_STREAMS_PER_USER:
+        raise HTTPException(status_code=429, detail="too many open event streams")
+    return StreamingResponse(events.stream(viewer), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,240 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import and_
+from sqlalchemy.orm import Session, selectinload
+import backend.app.models as models
+import backend.app.schemas as schemas
+from backend.app.database import get_db
+from backend.app.routers.helpers import get_current_user, authorize_documents_manage, _document_error, _serialize_document_with_latest, MAX_BATCH_PAIRS
+from backend.app.access import accessible_document_ids
+from backend.app.profiling import ProfiledRoute
+from backend.app.changelog import record_changes
+from backend.app.events import notify_documents, document_audiences
+from backend.app import folders, audit
+from backend.app.folders import FolderError
+
+router = APIRouter(route_class=ProfiledRoute)
+
+# Subtree changes touching more documents than this are not pushed to event streams one by one;
+# clients see them through /documents/changes
+FOLDER_NOTIFY_MAX_DOCUMENTS = 1000
+FOLDER_PAGE_SIZE = 100
+FOLDER_MAX_PAGE_SIZE = 1000
+
+
+def _get_folder(db: Session, folder_id: int, current_user: models.User, manage: bool = False) -> models.Folder:
+    folder = db.query(models.Folder).filter(models.Folder.folder_id == folder_id).one_or_none()
+    # folders the user cannot see do not exist for them
+    if folder is None or not folders.can_view(db, folder, current_user):
+        raise HTTPException(status_code=404, detail="folder not found")
+    if manage and not folders.can_manage(folder, current_user):
+        raise HTTPException(status_code=403, detail="only admins or members of the folder's department may change it")
+    return folder
+
+
+def _subtree_changed(db: Session, folder_id: int):
+    """Ids of the documents below a folder, and their audiences before a change (if few enough to notify)."""
+    doc_ids = [r[0] for r in db.execute(folders.subtree_document_ids(folder_id)).all()]
+    previous = document_audiences(db, doc_ids) if len(doc_ids) <= FOLDER_NOTIFY_MAX_DOCUMENTS else None
+    return doc_ids, previous
+
+
+def _notify_access(db: Session, doc_ids: list[int], previous) -> None:
+    if previous is not None:
+        notify_documents(db, doc_ids, "document.permissions", previous=previous)
+
+
+@router.post("/", response_model=schemas.Folder)
+def create_folder(req: schemas.FolderCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """Create a folder at the top level (owned by the user's department) or under a folder the user manages
+    (owned by the same department as its parent)."""
+    name = req.name.strip()
+    if not name or "/" in name:
+        raise HTTPException(status_code=400, detail="folder name must be non-empty and cannot contain '/'")
+    parent = None
+    if req.parent_id is not None:
+        parent = _get_folder(db, req.parent_id, current_user, manage=True)
+        department_id = parent.department_id
+    elif current_user.department_id is None:
+        raise HTTPException(status_code=400, detail="user must belong to a department")
+    else:
+        department_id = current_user.department_id
+    try:
+        folder = folders.create_folder(db, name, parent, department_id, current_user.user_id)
+    except FolderError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    db.commit()
+    db.refresh(folder)
+    return schemas.Folder.model_validate(folder)
+
+
+@router.get("/", response_model=list[schemas.Folder])
+def list_folders(parent_id: int | None = None, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """Folders the user can see directly under `parent_id` (none: the top level the user can see, i.e.
+    folders whose parent the user cannot see)."""
+    F = models.Folder
+    visible = folders.visible_folder_ids(current_user)
+    q = db.query(F)
+    if parent_id is not None:
+        _get_folder(db, parent_id, current_user)
+        q = q.filter(F.parent_id == parent_id)
+    elif visible is None:
+        q = q.filter(F.parent_id.is_(None))
+    else:
+        q = q.filter((F.parent_id.is_(None)) | F.parent_id.notin_(visible))
+    if visible is not None:
+        q = q.filter(F.folder_id.in_(visible))
+    return [schemas.Folder.model_validate(f) for f in q.order_by(F.name).all()]
+
+
+@router.get("/{folder_id}", response_model=schemas.FolderDetail)
+def get_folder(folder_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """A folder with its path from the root and the view grants that apply below it."""
+    folder = _get_folder(db, folder_id, current_user)
+    C = models.FolderClosure
+    P = models.FolderViewPermission
+    grants = (db.query(P.department_id, P.folder_id).join(C, C.ancestor_id == P.folder_id)
+              .filter(C.descendant_id == folder_id).order_by(C.depth.desc(), P.department_id).all())
+    detail = schemas.FolderDetail.model_validate(folder)
+    detail.path = [schemas.Folder.model_validate(f) for f in folders.ancestors(db, folder_id)]
+    detail.grants = [schemas.FolderGrant(department_id=d, folder_id=f, inherited=f != folder_id) for d, f in grants]
+    detail.can_manage = folders.can_manage(folder, current_user)
+    return detail
+
+
+@router.patch("/{folder_id}", response_model=schemas.Folder)
+def update_folder(folder_id: int, req: schemas.FolderUpdate, db: Session = Depends(get_db),
+                  current_user: models.User = Depends(get_current_user)):
+    """Rename a folder and/or move it, with everything below it, under another folder the user manages."""
+    folder = _get_folder(db, folder_id, current_user, manage=True)
+    doc_ids, previous = [], None
+    try:
+        if req.name is not None:
+            name = req.name.strip()
+            if not name or "/" in name:
+                raise HTTPException(status_code=400, detail="folder name must be non-empty and cannot contain '/'")
+            folders._check_name(db, folder.parent_id, name, folder.folder_id)
+            folder.name = name
+        if "parent_id" in req.model_fields_set:
+            new_parent = None
+            if req.parent_id is not None:
+                new_parent = _get_folder(db, req.parent_id, current_user, manage=True)
+                if new_parent.department_id != folder.department_id and not folders._is_admin(current_user):
+                    raise HTTPException(status_code=400, detail="folders can only be moved within their department")
+            doc_ids, previous = _subtree_changed(db, folder_id)
+            if not folders.move_folder(db, folder, new_parent):
+                doc_ids, previous = [], None
+    except FolderError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    record_changes(db, doc_ids, "folder")
+    db.commit()
+    db.refresh(folder)
+    _notify_access(db, doc_ids, previous)
+    audit.record(current_user, "folder", doc_ids, f"folder {folder_id} moved")
+    return schemas.Folder.model_validate(folder)
+
+
+@router.delete("/{folder_id}")
+def delete_folder(folder_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """Delete a folder and its subfolders; the documents filed below it move to its parent folder."""
+    folder = _get_folder(db, folder_id, current_user, manage=True)
+    _, previous = _subtree_changed(db, folder_id)
+    moved = folders.delete_folder(db, folder)
+    record_changes(db, moved, "folder")
+    db.commit()
+    _notify_access(db, moved, previous)
+    audit.record(current_user, "folder", moved, f"folder {folder_id} deleted")
+    return {"detail": "deleted", "documents_moved": len(moved)}
+
+
+@router.get("/{folder_id}/documents", response_model=schemas.FolderDocuments)
+def list_folder_documents(
+    folder_id: int,
+    recursive: bool = False,
+    after_id: int = Query(0, ge=0),
+    limit: int = Query(FOLDER_PAGE_SIZE, ge=1, le=FOLDER_MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Documents the user can see in a folder, or anywhere below it with recursive=true, by document id
+    (pass the last id as after_id for the next page)."""
+    _get_folder(db, folder_id, current_user)
+    D = models.Document
+    V = models.DocumentVersion
+    q = (db.query(D, V)
+         .options(selectinload(D.tags), selectinload(D.department), selectinload(D.owner))
+         .outerjoin(V, and_(V.document_id == D.document_id, V.version_number == D.latest_version_number))
+         .filter(D.folder_id.in_(folders.subtree_ids(folder_id)) if recursive else D.folder_id == folder_id,
+                 D.document_id > after_id))
+    if folders._is_admin(current_user):
+        q = q.filter(D.deleted_at.is_(None))
+    else:
+        q = q.filter(D.document_id.in_(accessible_document_ids(current_user)))
+    rows = q.order_by(D.document_id).limit(limit + 1).all()
+    return schemas.FolderDocuments(folder_id=folder_id, recursive=recursive, has_more=len(rows) > limit,
+                                   documents=[_serialize_document_with_latest(d, v) for d, v in rows[:limit]])
+
+
+@router.post("/documents", response_model=schemas.FolderFilingResult)
+def file_documents(req: schemas.FolderFiling, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """File documents the user manages into a folder the user manages (folder_id null: unfile them), in one
+    transaction. Each document gets its own result."""
+    doc_ids = list(dict.fromkeys(req.document_ids))
+    if not doc_ids:
+        raise HTTPException(status_code=400, detail="batch must contain at least one document")
+    if len(doc_ids) > MAX_BATCH_PAIRS:
+        raise HTTPException(status_code=400, detail=f"batch too large (max {MAX_BATCH_PAIRS} documents)")
+    folder = _get_folder(db, req.folder_id, current_user, manage=True) if req.folder_id is not None else None
+    docs, manageable = authorize_documents_manage(db, doc_ids, current_user)
+    results: list[schemas.FolderFilingItem] = []
+    moved: list[int] = []
+    for doc_id in doc_ids:
+        item = schemas.FolderFilingItem(document_id=doc_id, status="failed")
+        error = _document_error(doc_id, docs, manageable)
+        if error:
+            item.detail = error
+        elif docs[doc_id].folder_id == req.folder_id:
+            item.status = "unchanged"
+        else:
+            item.status = "filed"
+            moved.append(doc_id)
+        results.append(item)
+    previous = document_audiences(db, moved)
+    folders.file_documents(db, moved, folder)
+    record_changes(db, moved, "folder")
+    db.commit()
+    notify_documents(db, moved, "document.permissions", previous=previous)
+    audit.record(current_user, "folder", moved, f"filed in folder {req.folder_id}" if folder is not None else "unfiled")
+    return schemas.FolderFilingResult(applied=len(moved), results=results)
+
+
+@router.post("/{folder_id}/view/grant", response_model=schemas.FolderDetail)
+def grant_folder_view(folder_id: int, dept_id: int, db: Session = Depends(get_db),
+                      current_user: models.User = Depends(get_current_user)):
+    """Let a department see everything below a folder, including documents filed there later."""
+    folder = _get_folder(db, folder_id, current_user, manage=True)
+    if folder.department_id == dept_id:
+        raise HTTPException(status_code=400, detail="folder is already accessible to the department")
+    if db.query(models.Department).filter(models.Department.department_id == dept_id).one_or_none() is None:
+        raise HTTPException(status_code=404, detail="department not found")
+    doc_ids, previous = _subtree_changed(db, folder_id)
+    if folders.set_folder_grant(db, folder, dept_id, True):
+        record_changes(db, doc_ids, "permissions")
+        db.commit()
+        _notify_access(db, doc_ids, previous)
+        audit.record(current_user, "view_grant", doc_ids, f"department {dept_id} via folder {folder_id}")
+    return get_folder(folder_id, db, current_user)
+
+
+@router.post("/{folder_id}/view/revoke", response_model=schemas.FolderDetail)
+def revoke_folder_view(folder_id: int, dept_id: int, db: Session = Depends(get_db),
+                       current_user: models.User = Depends(get_current_user)):
+    """Remove a department's grant on a folder (grants on folders above it still apply)."""
+    folder = _get_folder(db, folder_id, current_user, manage=True)
+    doc_ids, previous = _subtree_changed(db, folder_id)
+    if not folders.set_folder_grant(db, folder, dept_id, False):
+        raise HTTPException(status_code=404, detail="permission not found")
+    record_changes(db, doc_ids, "permissions")
+    db.commit()
+    _notify_access(db, doc_ids, previous)
+    audit.record(current_user, "view_revoke", doc_ids, f"department {dept_id} via folder {folder_id}")
+    return get_folder(folder_id, db, current_user)
@@ -1,24 +1,48 @@
 from dotenv import load_dotenv
+import base64
+import hashlib
+import hmac
 import os
+import time
 import jwt
 from datetime import datetime, timedelta
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from backend.app import schemas
 import backend.app.models as models
 from backend.app.database import get_db
+from backend.app.tracing import tracer
 
 # Load environment variables from .env file
 load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY", "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 90))
+# Signed download URLs: default and longest lifetime; the key defaults to one derived from SECRET_KEY
+DOWNLOAD_URL_TTL_SECONDS = int(os.getenv("DOWNLOAD_URL_TTL_SECONDS", 300))
+DOWNLOAD_URL_MAX_TTL_SECONDS = int(os.getenv("DOWNLOAD_URL_MAX_TTL_SECONDS", 3600))
+_download_url_key = (os.getenv("DOWNLOAD_URL_SECRET") or "").encode() or hashlib.sha256(b"download-url:" + SECRET_KEY.encode()).digest()
+# Event stream tickets (POST /events/ticket): what browsers' EventSource, which cannot send headers, puts
+# in the query string instead of the bearer token
+EVENTS_TICKET_TTL_SECONDS = int(os.getenv("EVENTS_TICKET_TTL_SECONDS", 60))
+_events_ticket_key = hashlib.sha256(b"events-ticket:" + SECRET_KEY.encode()).digest()
 
-bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+_bcrypt_context = None
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl="auth/login")
 
+# Upper bound on documents x targets handled by one batch request
+MAX_BATCH_PAIRS = 10000
+
+
+def bcrypt_context():
+    """The password hashing context, built on first use: passlib and its bcrypt backend are only
+    needed by signup and login, so other workers and CLI tools never pay for importing them."""
+    global _bcrypt_context
+    if _bcrypt_context is None:
+        from passlib.context import CryptContext
+        _bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _bcrypt_context
 
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
@@ -26,17 +50,54 @@ def create_access_token(data: dict) -> str:
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def download_signature(version_id: int, document_id: int, user_id: int, expires: int, file_name: str) -> str:
+    """HMAC of a signed download URL's parameters (base64url). Whoever holds the URL may download the
+    version until `expires` (unix time) without authenticating; `user_id` is who it was issued to."""
+    message = f"{version_id}:{document_id}:{user_id}:{expires}:{file_name}".encode()
+    return base64.urlsafe_b64encode(hmac.new(_download_url_key, message, hashlib.sha256).digest()).rstrip(b"=").decode()
+
+def check_download_signature(version_id: int, document_id: int, user_id: int, expires: int, file_name: str,
+                             signature: str) -> bool:
+    """Whether a signed download URL is authentic and not expired. No database access."""
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(download_signature(version_id, document_id, user_id, expires, file_name), signature)
+
+def events_ticket(user_id: int, expires: int) -> str:
+    """A ticket that opens the event stream of `user_id` until `expires` (unix time) and grants nothing
+    else: "<user_id>.<expires>.<HMAC, base64url>"."""
+    message = f"events:{user_id}:{expires}".encode()
+    signature = base64.urlsafe_b64encode(hmac.new(_events_ticket_key, message, hashlib.sha256).digest()).rstrip(b"=").decode()
+    return f"{user_id}.{expires}.{signature}"
+
+def events_ticket_user(ticket: str) -> int | None:
+    """User id of an authentic, unexpired event stream ticket, or None. No database access."""
+    try:
+        user_id, expires, _ = ticket.split(".")
+        user_id, expires = int(user_id), int(expires)
+    except ValueError:
+        return None
+    if expires < time.time() or not hmac.compare_digest(events_ticket(user_id, expires), ticket):
+        return None
+    return user_id
+
 def authenticate_user(username: str, password: str, db: Session):
     """Return user if credentials are valid, otherwise None."""
-    user = db.query(models.User).filter(models.User.username == username).one_or_none()
+    with tracer.start_as_current_span("auth.user_lookup"):
+        user = db.query(models.User).filter(models.User.username == username).one_or_none()
     if user is None:
         return None
-    if not bcrypt_context.verify(password, user.password_hash):
-        return None
+    with tracer.start_as_current_span("auth.bcrypt_verify"):
+        if not bcrypt_context().verify(password, user.password_hash):
+            return None
     return user
 
 def get_current_user(token: str = Depends(oauth2_bearer), db: Session = Depends(get_db)) -> models.User:
     """Decode JWT and return the User model or raise 401."""
+    return user_from_token(token, db)
+
+def user_from_token(token: str | None, db: Session) -> models.User:
+    """User of a bearer token, or 401. For endpoints that cannot take the token from the Authorization header."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -66,20 +127,31 @@ def require_admin(current_user: models.User = Depends(get_current_user)) -> mode
         return current_user
     raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="admin required")
 
-def get_document(db: Session, document_id: int) -> models.Document:
-    doc = db.query(models.Document).filter(models.Document.document_id == document_id).one_or_none()
+def get_document(db: Session, document_id: int, trashed: bool = False) -> models.Document:
+    """The document, 404 if it does not exist or is in the trash (or, with trashed=True, is not)."""
+    D = models.Document
+    doc = (db.query(D).filter(D.document_id == document_id, D.deleted_at.isnot(None) if trashed else D.deleted_at.is_(None))
+           .one_or_none())
     if not doc:
         raise HTTPException(status_code=404, detail="document not found")
     return doc
 
-def get_document_for_update(db: Session, document_id: int) -> models.Document:
-    doc = db.query(models.Document).with_for_update().filter(models.Document.document_id == document_id).one_or_none()
+def get_document_for_update(db: Session, document_id: int, trashed: bool = False) -> models.Document:
+    D = models.Document
+    doc = (db.query(D).with_for_update()
+           .filter(D.document_id == document_id, D.deleted_at.isnot(None) if trashed else D.deleted_at.is_(None))
+           .one_or_none())
     if not doc:
         raise HTTPException(status_code=404, detail="document not found")
     return doc
 
 def can_access_document(document_id: int, current_user: models.User, db: Session) -> models.Document:
     """Raise HTTPException if user can't access the document; return Document if allowed."""
+    with tracer.start_as_current_span("access.check") as span:
+        span.set_attribute("document.id", document_id)
+        return _check_document_access(document_id, current_user, db)
+
+def _check_document_access(document_id: int, current_user: models.User, db: Session) -> models.Document:
     doc = get_document(db, document_id)
     # Check if document is public
     if doc.is_public:
@@ -97,6 +169,18 @@ def can_access_document(document_id: int, current_user: models.User, db: Session
         )
         if perm:
             return doc
+    # view grant inherited from the document's folder or a folder above it
+    if current_user and current_user.department_id is not None and doc.folder_id is not None:
+        C = models.FolderClosure
+        F = models.FolderViewPermission
+        inherited = (
+            db.query(F.folder_id)
+            .join(C, C.ancestor_id == F.folder_id)
+            .filter(C.descendant_id == doc.folder_id, F.department_id == current_user.department_id)
+            .first()
+        )
+        if inherited:
+            return doc
     # edit permission also grants view
     if current_user:
         edit_perm = (
@@ -112,7 +196,7 @@ def can_access_document(document_id: int, current_user: models.User, db: Session
         return doc
     raise HTTPException(status_code=403, detail="forbidden")
 
-def authorize_document_manage(db: Session, doc_id: int, current_user: models.User) -> models.Document:
+def authorize_document_manage(db: Session, doc_id: int, current_user: models.User, trashed: bool = False) -> models.Document:
     """
     Ensure the current_user is allowed to manage (edit permissions/tags/versions) the document.
     Allowed if:
@@ -120,9 +204,10 @@ def authorize_document_manage(db: Session, doc_id: int, current_user: models.Use
       - OR user is the owner (owner_user_id)
       - OR user has explicit edit permission (in document_edit_permissions)
     Returns the Document orm instance on success, raises HTTPException on failure.
+    Documents in the trash are not found, unless trashed=True (which finds only those).
     """
    
-    doc = get_document_for_update(db, doc_id)
+    doc = get_document_for_update(db, doc_id, trashed)
 
     is_admin = getattr(current_user, "role_id", None) == 0 or getattr(current_user.role, "name", None) == "admin"
     is_owner = getattr(doc, "owner_user_id", None) == getattr(current_user, "user_id", None)
@@ -142,6 +227,53 @@ def authorize_document_manage(db: Session, doc_id: int, current_user: models.Use
     return doc
 
 
+def authorize_documents_manage(db: Session, doc_ids: list[int], current_user: models.User) -> tuple[dict[int, models.Document], set[int]]:
+    """
+    Set-based variant of authorize_document_manage for batch endpoints.
+    Locks every existing document in doc_ids with one query and resolves manage rights with at most one more.
+    Returns (documents by id, ids the current_user may manage); missing (or trashed) ids are simply absent from both.
+    """
+    D = models.Document
+    docs = {
+        d.document_id: d
+        for d in db.query(D).with_for_update().filter(D.document_id.in_(doc_ids), D.deleted_at.is_(None))
+        .order_by(D.document_id).all()
+    }
+    is_admin = getattr(current_user, "role_id", None) == 0 or getattr(current_user.role, "name", None) == "admin"
+    if is_admin:
+        return docs, set(docs)
+    manageable = {doc_id for doc_id, d in docs.items() if d.owner_user_id == current_user.user_id}
+    others = [doc_id for doc_id in docs if doc_id not in manageable]
+    if others:
+        edit_ids = (
+            db.query(models.DocumentEditPermission.document_id)
+            .filter(models.DocumentEditPermission.document_id.in_(others),
+                    models.DocumentEditPermission.user_id == current_user.user_id)
+            .all()
+        )
+        manageable |= {row[0] for row in edit_ids}
+    return docs, manageable
+
+
+def _batch_ids(document_ids: list[int], target_ids: list) -> tuple[list[int], list]:
+    """De-duplicate batch ids (keeping order) and enforce the batch size limit."""
+    document_ids = list(dict.fromkeys(document_ids))
+    target_ids = list(dict.fromkeys(target_ids))
+    if not document_ids or not target_ids:
+        raise HTTPException(status_code=400, detail="batch must contain at least one document and one target")
+    if len(document_ids) * len(target_ids) > MAX_BATCH_PAIRS:
+        raise HTTPException(status_code=400, detail=f"batch too large (max {MAX_BATCH_PAIRS} pairs)")
+    return document_ids, target_ids
+
+
+def _document_error(doc_id: int, docs: dict, manageable: set) -> str | None:
+    if doc_id not in docs:
+        return "document not found"
+    if doc_id not in manageable:
+        return "only admins, owner, or users with edit permission may manage this document"
+    return None
+
+
 def _serialize_document_with_latest(doc: models.Document, ver: models.DocumentVersion | None) -> schemas.DocumentWithLatestVersion:
     """Build a DocumentWithLatestVersion schema instance from ORM objects.
     Centralizes repeated serialization logic (tags, department_name, owner_name, latest version fields).
@@ -1,11 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import delete, tuple_
 from sqlalchemy.orm import Session, joinedload
 import backend.app.models as models
 import backend.app.schemas as schemas
-from backend.app.database import get_db
-from backend.app.routers.helpers import require_admin, get_current_user, authorize_document_manage
+from backend.app.database import get_db, insert_ignore
+from backend.app.routers.helpers import require_admin, get_current_user, authorize_document_manage, authorize_documents_manage, _batch_ids, _document_error
+from backend.app.access import sync_document_access, sync_documents_access
+from backend.app.profiling import ProfiledRoute
+from backend.app.changelog import record_changes
+from backend.app.events import notify_documents, document_audiences
+from backend.app import audit
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 
 @router.get("/view", response_model=list[schemas.ViewPermission])
@@ -28,6 +34,9 @@ def grant_view_permission(doc_id: int, dept_id: int, db: Session = Depends(get_d
     if dept is None:
         raise HTTPException(status_code=404, detail="department not found")
     
+    # granting makes a public document private, which takes access away from everyone else
+    previous = document_audiences(db, [doc_id])
+
     # If the document is public, make it private when granting specific permissions
     if doc.is_public:
         doc.is_public = False
@@ -41,7 +50,11 @@ def grant_view_permission(doc_id: int, dept_id: int, db: Session = Depends(get_d
 
     perm = models.DocumentViewPermission(document_id=doc_id, department_id=dept_id)
     db.add(perm)
+    sync_document_access(db, doc)
+    record_changes(db, [doc_id], "permissions")
     db.commit()
+    notify_documents(db, [doc_id], "document.permissions", previous=previous)
+    audit.record(current_user, "view_grant", [doc_id], f"department {dept_id}")
     return schemas.ViewPermission.model_validate(perm)
 
 
@@ -55,10 +68,15 @@ def revoke_view_permission(doc_id: int, dept_id: int, db: Session = Depends(get_
     if perm is None:
         raise HTTPException(status_code=404, detail="permission not found")
     
-    authorize_document_manage(db, doc_id, current_user)
+    doc = authorize_document_manage(db, doc_id, current_user)
+    previous = document_audiences(db, [doc_id])
 
     db.delete(perm)
+    sync_document_access(db, doc)
+    record_changes(db, [doc_id], "permissions")
     db.commit()
+    notify_documents(db, [doc_id], "document.permissions", previous=previous)
+    audit.record(current_user, "view_revoke", [doc_id], f"department {dept_id}")
     return {"detail": "revoked"}
 
 
@@ -70,6 +88,84 @@ def list_document_view_permissions(document_id: int, db: Session = Depends(get_d
     perms = db.query(models.DocumentViewPermission).filter(models.DocumentViewPermission.document_id == document_id).all()
     return [schemas.ViewPermission.model_validate(p) for p in perms]
 
+@router.post("/view/batch/grant", response_model=schemas.PermissionBatchResult)
+def batch_grant_view_permissions(req: schemas.ViewPermissionBatch, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """Grant every department in the batch view access to every document in the batch, in one transaction.
+    Each (document, department) pair gets its own result; failed pairs do not abort the rest."""
+    P = models.DocumentViewPermission
+    doc_ids, dept_ids = _batch_ids(req.document_ids, req.department_ids)
+    docs, manageable = authorize_documents_manage(db, doc_ids, current_user)
+    known_depts = {row[0] for row in db.query(models.Department.department_id).filter(models.Department.department_id.in_(dept_ids)).all()}
+    existing = set(db.query(P.document_id, P.department_id).filter(P.document_id.in_(doc_ids), P.department_id.in_(dept_ids)).all())
+
+    results: list[schemas.PermissionBatchItem] = []
+    rows: list[dict] = []
+    for doc_id in doc_ids:
+        doc_error = _document_error(doc_id, docs, manageable)
+        for dept_id in dept_ids:
+            item = schemas.PermissionBatchItem(document_id=doc_id, department_id=dept_id, status="failed")
+            if doc_error:
+                item.detail = doc_error
+            elif dept_id not in known_depts:
+                item.detail = "department not found"
+            elif docs[doc_id].department_id == dept_id:
+                item.detail = "document is already accessible to the department"
+            elif (doc_id, dept_id) in existing:
+                item.status = "unchanged"
+            else:
+                item.status = "granted"
+                rows.append({"document_id": doc_id, "department_id": dept_id})
+            results.append(item)
+
+    touched = {row["document_id"] for row in rows}
+    previous = document_audiences(db, touched)
+    # As with grant_view_permission, granting specific permissions makes a public document private
+    for doc_id in touched:
+        docs[doc_id].is_public = False
+    insert_ignore(db, P, rows)
+    sync_documents_access(db, touched)
+    record_changes(db, touched, "permissions")
+    db.commit()
+    notify_documents(db, touched, "document.permissions", previous=previous)
+    audit.record_pairs(current_user, "view_grant", ((r["document_id"], f"department {r['department_id']}") for r in rows))
+    return schemas.PermissionBatchResult(applied=len(rows), results=results)
+
+
+@router.post("/view/batch/revoke", response_model=schemas.PermissionBatchResult)
+def batch_revoke_view_permissions(req: schemas.ViewPermissionBatch, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """Revoke view access of every department in the batch from every document in the batch, in one transaction."""
+    P = models.DocumentViewPermission
+    doc_ids, dept_ids = _batch_ids(req.document_ids, req.department_ids)
+    docs, manageable = authorize_documents_manage(db, doc_ids, current_user)
+    existing = set(db.query(P.document_id, P.department_id).filter(P.document_id.in_(doc_ids), P.department_id.in_(dept_ids)).all())
+
+    results: list[schemas.PermissionBatchItem] = []
+    pairs: list[tuple[int, int]] = []
+    for doc_id in doc_ids:
+        doc_error = _document_error(doc_id, docs, manageable)
+        for dept_id in dept_ids:
+            item = schemas.PermissionBatchItem(document_id=doc_id, department_id=dept_id, status="failed")
+            if doc_error:
+                item.detail = doc_error
+            elif (doc_id, dept_id) not in existing:
+                item.detail = "permission not found"
+            else:
+                item.status = "revoked"
+                pairs.append((doc_id, dept_id))
+            results.append(item)
+
+    touched = {doc_id for doc_id, _ in pairs}
+    previous = document_audiences(db, touched)
+    if pairs:
+        db.execute(delete(P).where(tuple_(P.document_id, P.department_id).in_(pairs)))
+        sync_documents_access(db, touched)
+    record_changes(db, touched, "permissions")
+    db.commit()
+    notify_documents(db, touched, "document.permissions", previous=previous)
+    audit.record_pairs(current_user, "view_revoke", ((d, f"department {dept}") for d, dept in pairs))
+    return schemas.PermissionBatchResult(applied=len(pairs), results=results)
+
+
 # ---------------- Edit (per-user) permissions ----------------
 
 @router.get("/edit/document/{document_id}", response_model=list[schemas.EditPermission])
@@ -118,7 +214,10 @@ def grant_edit_permission(doc_id: int, user_id: int, db: Session = Depends(get_d
         )
     perm = models.DocumentEditPermission(document_id=doc_id, user_id=user_id)
     db.add(perm)
+    record_changes(db, [doc_id], "permissions")
     db.commit()
+    notify_documents(db, [doc_id], "document.permissions")
+    audit.record(current_user, "edit_grant", [doc_id], f"user {user_id}")
     return schemas.EditPermission(
         document_id=perm.document_id,
         user_id=perm.user_id,
@@ -136,10 +235,91 @@ def revoke_edit_permission(doc_id: int, user_id: int, db: Session = Depends(get_
     ).one_or_none()
     if not perm:
         raise HTTPException(status_code=404, detail="edit permission not found")
+    previous = document_audiences(db, [doc_id])
     db.delete(perm)
+    record_changes(db, [doc_id], "permissions")
     db.commit()
+    notify_documents(db, [doc_id], "document.permissions", previous=previous)
+    audit.record(current_user, "edit_revoke", [doc_id], f"user {user_id}")
     return {"detail": "revoked"}
 
+@router.post("/edit/batch/grant", response_model=schemas.PermissionBatchResult)
+def batch_grant_edit_permissions(req: schemas.EditPermissionBatch, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """Grant every user in the batch edit permission on every document in the batch, in one transaction."""
+    E = models.DocumentEditPermission
+    doc_ids, user_ids = _batch_ids(req.document_ids, req.user_ids)
+    docs, manageable = authorize_documents_manage(db, doc_ids, current_user)
+    users = {
+        user_id: (role_id == 0 or role_name == "admin")
+        for user_id, role_id, role_name in (
+            db.query(models.User.user_id, models.User.role_id, models.Role.name)
+            .outerjoin(models.Role, models.Role.role_id == models.User.role_id)
+            .filter(models.User.user_id.in_(user_ids))
+            .all()
+        )
+    }
+    existing = set(db.query(E.document_id, E.user_id).filter(E.document_id.in_(doc_ids), E.user_id.in_(user_ids)).all())
+
+    results: list[schemas.PermissionBatchItem] = []
+    rows: list[dict] = []
+    for doc_id in doc_ids:
+        doc_error = _document_error(doc_id, docs, manageable)
+        for user_id in user_ids:
+            item = schemas.PermissionBatchItem(document_id=doc_id, user_id=user_id, status="failed")
+            if doc_error:
+                item.detail = doc_error
+            elif user_id not in users:
+                item.detail = "user not found"
+            elif users[user_id]:
+                item.detail = "user already has inherent edit rights"
+            elif (doc_id, user_id) in existing:
+                item.status = "unchanged"
+            else:
+                item.status = "granted"
+                rows.append({"document_id": doc_id, "user_id": user_id})
+            results.append(item)
+
+    insert_ignore(db, E, rows)
+    record_changes(db, [row["document_id"] for row in rows], "permissions")
+    db.commit()
+    notify_documents(db, [row["document_id"] for row in rows], "document.permissions")
+    audit.record_pairs(current_user, "edit_grant", ((r["document_id"], f"user {r['user_id']}") for r in rows))
+    return schemas.PermissionBatchResult(applied=len(rows), results=results)
+
+
+@router.post("/edit/batch/revoke", response_model=schemas.PermissionBatchResult)
+def batch_revoke_edit_permissions(req: schemas.EditPermissionBatch, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """Revoke edit permission of every user in the batch on every document in the batch, in one transaction."""
+    E = models.DocumentEditPermission
+    doc_ids, user_ids = _batch_ids(req.document_ids, req.user_ids)
+    docs, manageable = authorize_documents_manage(db, doc_ids, current_user)
+    existing = set(db.query(E.document_id, E.user_id).filter(E.document_id.in_(doc_ids), E.user_id.in_(user_ids)).all())
+
+    results: list[schemas.PermissionBatchItem] = []
+    pairs: list[tuple[int, int]] = []
+    for doc_id in doc_ids:
+        doc_error = _document_error(doc_id, docs, manageable)
+        for user_id in user_ids:
+            item = schemas.PermissionBatchItem(document_id=doc_id, user_id=user_id, status="failed")
+            if doc_error:
+                item.detail = doc_error
+            elif (doc_id, user_id) not in existing:
+                item.detail = "edit permission not found"
+            else:
+                item.status = "revoked"
+                pairs.append((doc_id, user_id))
+            results.append(item)
+
+    touched = {doc_id for doc_id, _ in pairs}
+    previous = document_audiences(db, touched)
+    if pairs:
+        db.execute(delete(E).where(tuple_(E.document_id, E.user_id).in_(pairs)))
+    record_changes(db, touched, "permissions")
+    db.commit()
+    notify_documents(db, touched, "document.permissions", previous=previous)
+    audit.record_pairs(current_user, "edit_revoke", ((d, f"user {u}") for d, u in pairs))
+    return schemas.PermissionBatchResult(applied=len(pairs), results=results)
+
 @router.get("/edit/eligible/{document_id}", response_model=list[schemas.User])
 def list_eligible_edit_permission_users(document_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     """Return users who can still be granted edit permission for a document.
@@ -1,11 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import delete, tuple_
 from sqlalchemy.orm import Session
 import backend.app.models as models
 import backend.app.schemas as schemas
-from backend.app.database import get_db
-from backend.app.routers.helpers import authorize_document_manage, get_current_user, get_document
+from backend.app.database import get_db, insert_ignore
+from backend.app.routers.helpers import authorize_document_manage, authorize_documents_manage, get_current_user, get_document, _batch_ids, _document_error
+from backend.app.profiling import ProfiledRoute
+from backend.app.changelog import record_changes
+from backend.app.events import notify_documents, notify_all
+from backend.app import audit
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 
 @router.get("/", response_model=list[schemas.Tag])
@@ -31,8 +36,16 @@ def delete_tag(tag_id: int, db: Session = Depends(get_db), current_user: models.
     tag = db.query(models.Tag).filter(models.Tag.tag_id == tag_id).one_or_none()
     if tag is None:
         raise HTTPException(status_code=404, detail="tag not found")
-    db.delete(tag)
+    tag_name = tag.tag_name
+    DT = models.DocumentTag
+    tagged = [r[0] for r in db.query(DT.document_id).filter(DT.tag_id == tag_id).all()]
+    # set-based: db.delete(tag) would load every tagged document to clear the association rows
+    db.execute(delete(DT).where(DT.tag_id == tag_id))
+    db.execute(delete(models.Tag).where(models.Tag.tag_id == tag_id))
+    record_changes(db, tagged, "tags")
     db.commit()
+    notify_all("tag.deleted", {"tag_id": tag_id})
+    audit.record(current_user, "tags", tagged, f"tag {tag_name} deleted")
     return {"detail": "deleted"}
 
 
@@ -42,10 +55,17 @@ def assign_tag(document_id: int, tag_id: int, db: Session = Depends(get_db), cur
     tag = db.query(models.Tag).filter(models.Tag.tag_id == tag_id).one_or_none()
     if tag is None:
         raise HTTPException(status_code=404, detail="tag not found")
-    if tag in doc.tags:
+    tag_name = tag.tag_name
+    DT = models.DocumentTag
+    # membership check on the document_tags PK instead of loading doc.tags
+    exists = db.query(DT).filter(DT.document_id == doc.document_id, DT.tag_id == tag_id).one_or_none()
+    if exists:
         return {"detail": "already assigned"}
-    doc.tags.append(tag)
+    insert_ignore(db, DT, [{"document_id": doc.document_id, "tag_id": tag_id}])
+    record_changes(db, [document_id], "tags")
     db.commit()
+    notify_documents(db, [document_id])
+    audit.record(current_user, "tags", [document_id], f"assigned {tag_name}")
     return {"detail": "assigned"}
 
 
@@ -55,10 +75,15 @@ def remove_tag(document_id: int, tag_id: int, db: Session = Depends(get_db), cur
     tag = db.query(models.Tag).filter(models.Tag.tag_id == tag_id).one_or_none()
     if tag is None:
         raise HTTPException(status_code=404, detail="tag not found")
-    if tag not in doc.tags:
+    tag_name = tag.tag_name
+    DT = models.DocumentTag
+    deleted = db.execute(delete(DT).where(DT.document_id == doc.document_id, DT.tag_id == tag_id)).rowcount
+    if not deleted:
         return {"detail": "not assigned"}
-    doc.tags.remove(tag)
+    record_changes(db, [document_id], "tags")
     db.commit()
+    notify_documents(db, [document_id])
+    audit.record(current_user, "tags", [document_id], f"removed {tag_name}")
     return {"detail": "removed"}
 
 
@@ -66,3 +91,96 @@ def remove_tag(document_id: int, tag_id: int, db: Session = Depends(get_db), cur
 def list_document_tags(document_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     doc = get_document(db, document_id)
     return [schemas.Tag.model_validate(tag) for tag in doc.tags]
+
+
+def _batch_tag_names(tag_names: list[str]) -> list[str]:
+    names = [n.strip() for n in tag_names if n and n.strip()]
+    too_long = [n for n in names if len(n) > 50]
+    if too_long:
+        raise HTTPException(status_code=400, detail=f"tag name too long: {too_long[0][:60]}")
+    return names
+
+
+@router.post("/batch/assign", response_model=schemas.TagBatchResult)
+def batch_assign_tags(req: schemas.TagBatch, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """Assign tags (by name) to many documents in one transaction. Unknown tag names are created, unless
+    no document of the batch can be tagged."""
+    T = models.Tag
+    DT = models.DocumentTag
+    doc_ids, names = _batch_ids(req.document_ids, _batch_tag_names(req.tag_names))
+    docs, manageable = authorize_documents_manage(db, doc_ids, current_user)
+
+    tags = {t.tag_name: t for t in db.query(T).filter(T.tag_name.in_(names)).all()}
+    created = []
+    if any(not _document_error(doc_id, docs, manageable) for doc_id in doc_ids):
+        # every unknown name gets assigned to the documents that can be tagged
+        unknown = [n for n in names if n not in tags]
+        insert_ignore(db, T, [{"tag_name": n} for n in unknown])
+        tags = {t.tag_name: t for t in db.query(T).filter(T.tag_name.in_(names)).all()}
+        created = [schemas.Tag.model_validate(tags[n]) for n in unknown if n in tags]
+
+    tag_ids = [t.tag_id for t in tags.values()]
+    existing = set(db.query(DT.document_id, DT.tag_id).filter(DT.document_id.in_(doc_ids), DT.tag_id.in_(tag_ids)).all())
+
+    results: list[schemas.TagBatchItem] = []
+    rows: list[dict] = []
+    for doc_id in doc_ids:
+        doc_error = _document_error(doc_id, docs, manageable)
+        for name in names:
+            item = schemas.TagBatchItem(document_id=doc_id, tag_name=name, status="failed")
+            if doc_error:
+                item.detail = doc_error
+            elif (doc_id, tags[name].tag_id) in existing:
+                item.status = "unchanged"
+            else:
+                item.status = "assigned"
+                rows.append({"document_id": doc_id, "tag_id": tags[name].tag_id})
+            results.append(item)
+
+    insert_ignore(db, DT, rows)
+    record_changes(db, [row["document_id"] for row in rows], "tags")
+    tag_names = {t.tag_id: n for n, t in tags.items()}
+    db.commit()
+    notify_documents(db, [row["document_id"] for row in rows])
+    audit.record_pairs(current_user, "tags", ((r["document_id"], f"assigned {tag_names[r['tag_id']]}") for r in rows))
+    return schemas.TagBatchResult(applied=len(rows), created_tags=created, results=results)
+
+
+@router.post("/batch/remove", response_model=schemas.TagBatchResult)
+def batch_remove_tags(req: schemas.TagBatch, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """Remove tags (by name) from many documents in one transaction."""
+    T = models.Tag
+    DT = models.DocumentTag
+    doc_ids, names = _batch_ids(req.document_ids, _batch_tag_names(req.tag_names))
+    docs, manageable = authorize_documents_manage(db, doc_ids, current_user)
+
+    tags = {t.tag_name: t for t in db.query(T).filter(T.tag_name.in_(names)).all()}
+    tag_ids = [t.tag_id for t in tags.values()]
+    existing = set(db.query(DT.document_id, DT.tag_id).filter(DT.document_id.in_(doc_ids), DT.tag_id.in_(tag_ids)).all())
+
+    results: list[schemas.TagBatchItem] = []
+    pairs: list[tuple[int, int]] = []
+    for doc_id in doc_ids:
+        doc_error = _document_error(doc_id, docs, manageable)
+        for name in names:
+            item = schemas.TagBatchItem(document_id=doc_id, tag_name=name, status="failed")
+            if doc_error:
+                item.detail = doc_error
+            elif name not in tags:
+                item.detail = "tag not found"
+            elif (doc_id, tags[name].tag_id) not in existing:
+                item.status = "unchanged"
+                item.detail = "not assigned"
+            else:
+                item.status = "removed"
+                pairs.append((doc_id, tags[name].tag_id))
+            results.append(item)
+
+    if pairs:
+        db.execute(delete(DT).where(tuple_(DT.document_id, DT.tag_id).in_(pairs)))
+    record_changes(db, [doc_id for doc_id, _ in pairs], "tags")
+    tag_names = {t.tag_id: n for n, t in tags.items()}
+    db.commit()
+    notify_documents(db, [doc_id for doc_id, _ in pairs])
+    audit.record_pairs(current_user, "tags", ((d, f"removed {tag_names[t]}") for d, t in pairs))
+    return schemas.TagBatchResult(applied=len(pairs), results=results)
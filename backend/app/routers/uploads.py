@@ -0,0 +1,148 @@
+import re
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query, Response
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+import backend.app.models as models
+import backend.app.schemas as schemas
+from backend.app.database import get_db
+from backend.app.routers.helpers import get_current_user, authorize_document_manage, _serialize_document_with_latest
+from backend.app.routers.documents import store_upload, store_new_version
+from backend.app.metrics import record_upload
+from backend.app.profiling import ProfiledRoute
+from backend.app.ratelimit import rate_limited
+from backend.app import uploads
+
+router = APIRouter(route_class=ProfiledRoute)
+
+_SHA256 = re.compile(r"^[0-9a-fA-F]{64}$")
+
+
+def _get_session(db: Session, upload_id: str, current_user: models.User) -> models.UploadSession:
+    session = db.query(models.UploadSession).filter(models.UploadSession.upload_id == upload_id).one_or_none()
+    # other users' sessions do not exist for the caller
+    if session is None or session.user_id != current_user.user_id:
+        raise HTTPException(status_code=404, detail="upload not found")
+    return session
+
+
+def _status(session: models.UploadSession, received: dict) -> schemas.UploadSessionStatus:
+    return schemas.UploadSessionStatus(
+        upload_id=session.upload_id, size=session.size, chunk_size=session.chunk_size,
+        received_bytes=sum(size for size, _ in received.values()),
+        missing_offsets=uploads.missing_offsets(session, received),
+        status=session.status, expires_at=session.expires_at,
+    )
+
+
+@router.post("/", response_model=schemas.UploadSessionStatus)
+@rate_limited("upload")
+def create_upload(req: schemas.UploadSessionCreate, db: Session = Depends(get_db),
+                  current_user: models.User = Depends(get_current_user)):
+    """Start a resumable upload (see backend.app.uploads); send the chunks with PATCH, then finalize."""
+    if req.size <= 0:
+        raise HTTPException(status_code=400, detail="empty file uploaded")
+    if req.size > uploads.UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"file larger than {uploads.UPLOAD_MAX_BYTES} bytes")
+    if req.sha256 is not None and not _SHA256.match(req.sha256):
+        raise HTTPException(status_code=400, detail="sha256 must be 64 hex digits")
+    if current_user.department_id is None:
+        raise HTTPException(status_code=400, detail="uploader must belong to a department")
+    if req.document_id is not None:
+        # fail now rather than after the whole file has been sent
+        authorize_document_manage(db, req.document_id, current_user)
+    session = uploads.create_session(db, current_user.user_id, req.size, req.file_name, req.title, req.is_public,
+                                     req.document_id, req.sha256, req.chunk_size)
+    return _status(session, {})
+
+
+@router.get("/{upload_id}", response_model=schemas.UploadSessionStatus)
+def get_upload(upload_id: str, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """Progress of an upload: what to resend after an interruption."""
+    session = _get_session(db, upload_id, current_user)
+    return _status(session, uploads.received_chunks(db, upload_id))
+
+
+@router.patch("/{upload_id}", response_model=schemas.UploadSessionStatus)
+@rate_limited("upload_chunk", concurrent=True)
+def upload_chunk(
+    upload_id: str,
+    offset: int = Query(..., ge=0),
+    data: bytes = Body(..., media_type="application/octet-stream"),
+    chunk_sha256: str = Header(..., alias="X-Chunk-SHA256"),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Store one chunk, sent as the raw request body at a multiple of the session's chunk_size.
+    Resending a chunk that was already received is a no-op."""
+    session = _get_session(db, upload_id, current_user)
+    if session.status != uploads.OPEN:
+        raise HTTPException(status_code=409, detail="upload is being finalized")
+    index, rest = divmod(offset, session.chunk_size)
+    if rest or offset >= session.size:
+        raise HTTPException(status_code=400, detail=f"offset must be a multiple of {session.chunk_size} below {session.size}")
+    if len(data) != uploads.chunk_length(session, index):
+        raise HTTPException(status_code=400, detail=f"chunk at offset {offset} must be {uploads.chunk_length(session, index)} bytes")
+    digest = uploads.sha256_hex(data)
+    if digest != chunk_sha256.lower():
+        raise HTTPException(status_code=400, detail="chunk checksum mismatch")
+    received = uploads.received_chunks(db, upload_id)
+    if index in received:
+        if received[index][1] != digest:
+            raise HTTPException(status_code=409, detail=f"a different chunk was already received at offset {offset}")
+    else:
+        uploads.write_chunk(db, session, index, data, digest)
+        received[index] = (len(data), digest)
+    return _status(session, received)
+
+
+@router.post("/{upload_id}/finalize", response_model=schemas.DocumentWithLatestVersion)
+@rate_limited("upload", concurrent=True)
+def finalize_upload(upload_id: str, response: Response, db: Session = Depends(get_db),
+                    current_user: models.User = Depends(get_current_user)):
+    """Turn a complete upload into a document version; the session is deleted in the same transaction."""
+    session = _get_session(db, upload_id, current_user)
+    S = models.UploadSession
+    # one finalize at a time; chunks are refused meanwhile
+    claimed = db.execute(update(S).where(S.upload_id == upload_id, S.status == uploads.OPEN)
+                         .values(status=uploads.FINALIZING)).rowcount
+    db.commit()
+    if not claimed:
+        raise HTTPException(status_code=409, detail="upload is already being finalized")
+    try:
+        received = uploads.received_chunks(db, upload_id)
+        missing = uploads.missing_offsets(session, received)
+        if missing:
+            raise HTTPException(status_code=409, detail=f"upload incomplete: {len(missing)} chunks missing")
+        data = uploads.read_staged(session)
+        digest = uploads.sha256_hex(data)
+        if session.sha256 and digest != session.sha256:
+            raise HTTPException(status_code=400, detail="file checksum mismatch")
+        document_id, file_name, title, is_public = session.document_id, session.file_name, session.title, session.is_public
+        uploads.discard(db, upload_id)
+        # commits the version together with the session deletion
+        if document_id is None:
+            result = store_upload(db, current_user, file_name, data, title, is_public, digest, response)
+        else:
+            version = store_new_version(db, current_user, document_id, file_name, data, title, digest, response)
+            doc = db.query(models.Document).filter(models.Document.document_id == document_id).one()
+            result = _serialize_document_with_latest(doc, version)
+    except BaseException:
+        db.rollback()
+        db.execute(update(S).where(S.upload_id == upload_id).values(status=uploads.OPEN))
+        db.commit()
+        raise
+    uploads.remove_staging(upload_id)
+    record_upload(len(data))
+    return result
+
+
+@router.delete("/{upload_id}")
+def abort_upload(upload_id: str, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """Abandon an upload and delete what was received."""
+    session = _get_session(db, upload_id, current_user)
+    if session.status != uploads.OPEN:
+        raise HTTPException(status_code=409, detail="upload is being finalized")
+    uploads.discard(db, upload_id)
+    db.commit()
+    uploads.remove_staging(upload_id)
+    return {"detail": "deleted"}
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 from datetime import datetime
 
@@ -18,6 +18,7 @@ class Document(BaseModel):
     latest_version_number: Optional[int] = None
     is_public: bool
     created_at: Optional[datetime] = None
+    folder_id: Optional[int] = None
     tags: list[Tag] = []
 
     model_config = {"from_attributes": True}
@@ -33,9 +34,29 @@ class DocumentVersion(BaseModel):
     # file_data: Optional[bytes] = None
     file_size: Optional[int] = None
     upload_date: Optional[datetime] = None
+    content_sha256: Optional[str] = None
 
     model_config = {"from_attributes": True}
 
+class SignedDownloadUrl(BaseModel):
+    # absolute URL; works without authentication until expires_at
+    url: str
+    expires_at: datetime
+
+class EventsTicket(BaseModel):
+    # for /events/stream?ticket=...; opens the user's event stream until expires_at, nothing else
+    ticket: str
+    expires_at: datetime
+
+class VersionPreview(BaseModel):
+    version_id: int
+    # pending | ready | unsupported | too_large | failed | unavailable (version not hashed yet)
+    status: str
+    # image | pdf | text | binary
+    kind: Optional[str] = None
+    has_thumbnail: bool = False
+    snippet: Optional[str] = None
+
 class DocumentWithLatestVersion(Document):
     latest_version: Optional[DocumentVersion] = None
 
@@ -108,3 +129,300 @@ class Department(BaseModel):
     description: Optional[str] = None
 
     model_config = {"from_attributes": True}
+
+class AccessConsistency(BaseModel):
+    missing: list[ViewPermission] = []
+    extra: list[ViewPermission] = []
+
+class FolderClosureRow(BaseModel):
+    ancestor_id: int
+    descendant_id: int
+    depth: int
+
+class FolderClosureConsistency(BaseModel):
+    missing: list[FolderClosureRow] = []
+    extra: list[FolderClosureRow] = []
+
+class ViewPermissionBatch(BaseModel):
+    document_ids: list[int]
+    department_ids: list[int]
+
+class EditPermissionBatch(BaseModel):
+    document_ids: list[int]
+    user_ids: list[int]
+
+class PermissionBatchItem(BaseModel):
+    document_id: int
+    department_id: Optional[int] = None
+    user_id: Optional[int] = None
+    # granted | revoked | unchanged | failed
+    status: str
+    detail: Optional[str] = None
+
+class PermissionBatchResult(BaseModel):
+    applied: int
+    results: list[PermissionBatchItem]
+
+class TrashedDocument(DocumentWithLatestVersion):
+    deleted_at: Optional[datetime] = None
+    deleted_by: Optional[int] = None
+    # purged for good from then on (TRASH_RETENTION_DAYS after deleted_at)
+    purge_after: Optional[datetime] = None
+
+class TrashedVersion(DocumentVersion):
+    deleted_at: Optional[datetime] = None
+    deleted_by: Optional[int] = None
+    purge_after: Optional[datetime] = None
+
+class Trash(BaseModel):
+    # trashed documents, and trashed versions of documents that are not, the user may manage; newest first
+    documents: list[TrashedDocument] = []
+    versions: list[TrashedVersion] = []
+
+class TrashPurgeReport(BaseModel):
+    documents_purged: int
+    versions_purged: int
+    bytes_freed: int
+    batches: int
+
+class Folder(BaseModel):
+    folder_id: int
+    parent_id: Optional[int] = None
+    name: str
+    department_id: int
+    created_by: Optional[int] = None
+    created_at: Optional[datetime] = None
+
+    model_config = {"from_attributes": True}
+
+class FolderGrant(BaseModel):
+    department_id: int
+    # the folder holding the grant: this one, or one above it (inherited)
+    folder_id: int
+    inherited: bool
+
+class FolderDetail(Folder):
+    # from the root down to this folder
+    path: list[Folder] = []
+    grants: list[FolderGrant] = []
+    can_manage: bool = False
+
+class FolderCreate(BaseModel):
+    name: str
+    parent_id: Optional[int] = None
+
+class FolderUpdate(BaseModel):
+    # only the fields sent are changed; "parent_id": null moves the folder to the top level
+    name: Optional[str] = None
+    parent_id: Optional[int] = None
+
+class FolderFiling(BaseModel):
+    document_ids: list[int]
+    # None: take the documents out of their folders
+    folder_id: Optional[int] = None
+
+class FolderFilingItem(BaseModel):
+    document_id: int
+    # filed | unchanged | failed
+    status: str
+    detail: Optional[str] = None
+
+class FolderFilingResult(BaseModel):
+    applied: int
+    results: list[FolderFilingItem]
+
+class FolderDocuments(BaseModel):
+    folder_id: int
+    recursive: bool
+    documents: list[DocumentWithLatestVersion]
+    has_more: bool = False
+
+class TagBatch(BaseModel):
+    document_ids: list[int]
+    tag_names: list[str]
+
+class TagBatchItem(BaseModel):
+    document_id: int
+    tag_name: str
+    # assigned | removed | unchanged | failed
+    status: str
+    detail: Optional[str] = None
+
+class TagBatchResult(BaseModel):
+    applied: int
+    created_tags: list[Tag] = []
+    results: list[TagBatchItem]
+
+class TagCount(BaseModel):
+    tag_id: int
+    tag_name: str
+    count: int
+
+class FacetCount(BaseModel):
+    # department_id / owner_user_id, or 1/0 for public/private
+    key: Optional[int] = None
+    name: Optional[str] = None
+    count: int
+
+class SearchResults(BaseModel):
+    total: int = 0
+    documents: list[DocumentWithLatestVersion]
+    tag_counts: list[TagCount] = []
+    department_counts: list[FacetCount] = []
+    owner_counts: list[FacetCount] = []
+    visibility_counts: list[FacetCount] = []
+
+class SearchFilters(BaseModel):
+    title: Optional[str] = None
+    tags: list[str] = []
+    # any | all
+    tag_mode: str = "any"
+    uploader_ids: list[int] = []
+    uploader_name: Optional[str] = None
+    # contains | prefix
+    uploader_match: str = "contains"
+    # any (any version's uploader) | latest (latest version's uploader only)
+    uploader_scope: str = "any"
+
+class ProfilingSettings(BaseModel):
+    enabled: bool = False
+    # probability of profiling a non-admin request that asks for it with X-Profile
+    sample_rate: float = Field(0.0, ge=0.0, le=1.0)
+
+class ProfileSummary(BaseModel):
+    profile_id: int
+    method: str
+    path: str
+    route: str
+    status: int
+    duration_ms: float
+    created_at: float
+
+class RetentionPolicyRequest(BaseModel):
+    # exactly one of department_id / tag_id
+    department_id: Optional[int] = None
+    tag_id: Optional[int] = None
+    keep_last: Optional[int] = None
+    keep_days: Optional[int] = None
+    keep_monthly: Optional[int] = None
+
+class RetentionPolicy(RetentionPolicyRequest):
+    policy_id: int
+    created_at: Optional[datetime] = None
+
+    model_config = {"from_attributes": True}
+
+class RetentionSweepVersion(BaseModel):
+    version_id: int
+    document_id: int
+    version_number: int
+    size: int
+
+class RetentionSweepReport(BaseModel):
+    dry_run: bool
+    documents_scanned: int
+    versions_deleted: int
+    bytes_freed: int
+    batches: int
+    # first MAX_REPORTED_VERSIONS deleted (or, in a dry run, deletable) versions
+    versions: list[RetentionSweepVersion] = []
+
+class StorageTierStats(BaseModel):
+    tier: str
+    versions: int
+    bytes: int
+
+class PayloadCacheStats(BaseModel):
+    hits: int
+    disk_hits: int
+    misses: int
+    evictions: int
+    hit_ratio: float
+    items: int
+    bytes: int
+    max_bytes: int
+    disk_items: int
+    disk_bytes: int
+
+class TieringReport(BaseModel):
+    dry_run: bool
+    versions_moved: int
+    bytes_moved: int
+    batches: int
+
+class DocumentChange(BaseModel):
+    change_id: int
+    document_id: int
+    # created | updated | tags | versions | publicity | permissions (the newest change in this page)
+    change_type: str
+    # the user can no longer see the document; drop it
+    removed: bool = False
+    # current state, unless removed
+    document: Optional[DocumentWithLatestVersion] = None
+
+class DocumentChanges(BaseModel):
+    changes: list[DocumentChange] = []
+    # pass as ?cursor= on the next call
+    cursor: int
+    # another page is available right away
+    has_more: bool = False
+
+class ChangeLogCompactReport(BaseModel):
+    entries_deleted: int
+    head: int
+
+class DuplicateContent(BaseModel):
+    sha256: str
+    size: int
+    versions: int
+    documents: int
+    # versions holding their own copy of the bytes (not linked)
+    stored_copies: int
+    reclaimable_bytes: int
+    # first MAX_LISTED_DUPLICATES versions with this content
+    version_ids: list[int]
+
+class DuplicateReport(BaseModel):
+    groups: list[DuplicateContent]
+    duplicate_groups: int
+    reclaimable_bytes: int
+    linked_versions: int
+    unhashed_versions: int
+
+class UploadSessionCreate(BaseModel):
+    file_name: str
+    size: int
+    title: Optional[str] = None
+    is_public: bool = True
+    # append a version to this document; otherwise create one (or append by title, like /documents/upload)
+    document_id: Optional[int] = None
+    # hex SHA-256 of the whole file, checked on finalize
+    sha256: Optional[str] = None
+    # requested chunk size; the server clamps it
+    chunk_size: Optional[int] = None
+
+class UploadSessionStatus(BaseModel):
+    upload_id: str
+    size: int
+    chunk_size: int
+    received_bytes: int
+    # offsets of the chunks still to send
+    missing_offsets: list[int] = []
+    status: str
+    expires_at: datetime
+
+class AuditEvent(BaseModel):
+    event_id: int
+    occurred_at: datetime
+    user_id: Optional[int] = None
+    username: Optional[str] = None
+    action: str
+    document_id: Optional[int] = None
+    version_id: Optional[int] = None
+    detail: Optional[str] = None
+    model_config = {"from_attributes": True}
+
+class AuditPage(BaseModel):
+    # newest first; pass the last event_id as ?before_id= for the next page
+    events: list[AuditEvent] = []
+    has_more: bool = False
@@ -0,0 +1,160 @@
+"""Production entry point: runs the API on several uvicorn worker processes.
+
+    python -m backend.app.server --host 0.0.0.0 --port 8000
+    python -m backend.app.server --workers 8 --threads 32 --graceful-timeout 120
+
+Worker model. Every endpoint is a sync `def`, so a worker serves requests on anyio's threadpool:
+WEB_THREADS (default 40, anyio's own default) caps the requests one worker runs at once, and WEB_WORKERS
+processes (default: the CPUs available to the container, honouring cgroup quotas and CPU affinity)
+scale past the GIL. The launcher sizes each worker's SQLAlchemy pool to its threadpool unless
+DB_POOL_SIZE / DB_MAX_OVERFLOW are set, so threads do not queue for connections.
+
+Pre-warming. A worker's startup hook runs before it accepts connections (with several workers, new
+connections wait in the shared listen backlog meanwhile). With PREWARM=true, which the launcher sets,
+it opens PREWARM_DB_CONNECTIONS pool connections, builds the bcrypt context and loads the mimetypes
+table, so the first requests do not pay for them.
+
+Shutdown. On SIGTERM uvicorn stops accepting connections, closes idle keep-alive connections and waits
+up to GRACEFUL_TIMEOUT_SECONDS for in-flight requests, uploads included, to finish. Only then does the
+startup hook's shutdown half flush access times and stop the background jobs. Long-lived responses
+(the /events streams) are ended as soon as the signal arrives, through on_exit_signal().
+KEEP_ALIVE_SECONDS should exceed the idle timeout of the load balancer in front (60 s on most), or it
+will reuse connections the worker has already closed.
+"""
+import argparse
+import logging
+import math
+import os
+import signal
+import sys
+import threading
+import time
+
+logger = logging.getLogger("backend.app.server")
+
+WEB_THREADS = int(os.getenv("WEB_THREADS", 40))
+PREWARM = os.getenv("PREWARM", "false").lower() in ("1", "true", "yes")
+PREWARM_DB_CONNECTIONS = int(os.getenv("PREWARM_DB_CONNECTIONS", 4))
+KEEP_ALIVE_SECONDS = int(os.getenv("KEEP_ALIVE_SECONDS", 65))
+GRACEFUL_TIMEOUT_SECONDS = int(os.getenv("GRACEFUL_TIMEOUT_SECONDS", 60))
+
+
+def available_cpus() -> int:
+    """CPUs this process may use: affinity mask, capped by a cgroup v2 CPU quota (containers)."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS/Windows
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def default_workers() -> int:
+    return int(os.getenv("WEB_WORKERS", 0)) or available_cpus()
+
+
+def prewarm(connections: int = PREWARM_DB_CONNECTIONS) -> None:
+    """Fill the connection pool and load what the first requests would otherwise load lazily."""
+    import mimetypes
+    from sqlalchemy import text
+    from backend.app.database import engine
+    from backend.app.routers.helpers import bcrypt_context
+
+    conns = []
+    try:
+        # held at the same time so the pool really opens `connections` of them
+        for _ in range(connections):
+            conn = engine.connect()
+            conns.append(conn)
+            conn.execute(text("SELECT 1"))
+    finally:
+        for conn in conns:
+            conn.close()
+    bcrypt_context()
+    mimetypes.init()
+
+
+_exit_callbacks: list = []
+
+
+def on_exit_signal(callback) -> None:
+    """Call `callback` when the worker gets SIGTERM/SIGINT, before uvicorn starts draining. It runs
+    in the signal handler, so it must be quick and must not take locks."""
+    if callback not in _exit_callbacks:
+        _exit_callbacks.append(callback)
+
+
+def _chain_exit_signals() -> None:
+    # uvicorn installs its handlers with signal.signal before the startup hook runs; wrap them
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        previous = signal.getsignal(sig)
+        if not callable(previous) or getattr(previous, "_chained", False):
+            continue
+
+        def handler(signum, frame, previous=previous):
+            for callback in list(_exit_callbacks):
+                try:
+                    callback()
+                except Exception:
+                    logger.exception("exit callback failed")
+            previous(signum, frame)
+
+        handler._chained = True
+        signal.signal(sig, handler)
+
+
+async def prepare_worker() -> None:
+    """Called from the app's startup hook: size the endpoint threadpool and pre-warm (PREWARM) before
+    the worker accepts its first connection."""
+    from anyio import to_thread
+
+    to_thread.current_default_thread_limiter().total_tokens = WEB_THREADS
+    _chain_exit_signals()
+    if PREWARM:
+        start = time.perf_counter()
+        await to_thread.run_sync(prewarm)
+        logger.info("worker %d pre-warmed in %.0f ms", os.getpid(), (time.perf_counter() - start) * 1000)
+
+
+def main(argv: list[str]) -> int:
+    p = argparse.ArgumentParser(prog="python -m backend.app.server", description="Run the API on several worker processes.")
+    p.add_argument("--host", default=os.getenv("WEB_HOST", "127.0.0.1"))
+    p.add_argument("--port", type=int, default=int(os.getenv("WEB_PORT", 8000)))
+    p.add_argument("--workers", type=int, default=default_workers(), help="processes (default: available CPUs)")
+    p.add_argument("--threads", type=int, default=WEB_THREADS, help="threadpool size per worker")
+    p.add_argument("--keep-alive", type=int, default=KEEP_ALIVE_SECONDS, help="idle keep-alive timeout, seconds")
+    p.add_argument("--graceful-timeout", type=int, default=GRACEFUL_TIMEOUT_SECONDS,
+                   help="seconds to let in-flight requests finish on SIGTERM")
+    p.add_argument("--no-prewarm", action="store_true", help="do not pre-warm pools and caches at worker start")
+    p.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    args = p.parse_args(argv)
+    if args.workers < 1 or args.threads < 1:
+        p.error("--workers and --threads must be at least 1")
+
+    # workers are fresh processes that read their settings from the environment
+    os.environ["WEB_THREADS"] = str(args.threads)
+    os.environ["PREWARM"] = "false" if args.no_prewarm else "true"
+    if "DB_POOL_SIZE" not in os.environ and "DB_MAX_OVERFLOW" not in os.environ:
+        os.environ["DB_POOL_SIZE"] = str(min(args.threads, 10))
+        os.environ["DB_MAX_OVERFLOW"] = str(max(args.threads - 10, 0))
+
+    import uvicorn
+
+    logging.basicConfig(level=args.log_level.upper())
+    logger.info("starting %d workers x %d threads on %s:%d", args.workers, args.threads, args.host, args.port)
+    uvicorn.run("backend.app.main:app", host=args.host, port=args.port, workers=args.workers,
+                timeout_keep_alive=args.keep_alive, timeout_graceful_shutdown=args.graceful_timeout,
+                log_level=args.log_level)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
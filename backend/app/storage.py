@@ -0,0 +1,419 @@
+"""Tiered storage for version payloads.
+
+Hot versions keep their bytes in `document_versions.file_data`. Versions nobody has read for
+COLD_AFTER_DAYS are moved to a cheaper cold store, leaving `file_data` NULL and the object key in
+`storage_key` (`storage_tier` says where the bytes are). A "linked" version has no bytes of its own:
+it shares those of the version whose id is in `storage_key`, which has the same content (upload
+deduplication, backend.app.dedup). read_version_data() hides the differences
+from the download endpoint, behind the in-process payload cache (backend.app.payload_cache); with
+COLD_STORAGE_REWARM a cold read moves the version back to the hot tier. read_version_data_by_id() serves
+signed download URLs, which carry no session: a cache hit needs no database at all.
+
+Cold stores (COLD_STORAGE_BACKEND):
+
+    archive   gzip files under COLD_STORAGE_DIR (default)
+    s3        gzip objects in COLD_STORAGE_BUCKET on any S3-compatible endpoint (COLD_STORAGE_ENDPOINT,
+              e.g. a local MinIO); needs boto3
+
+Last access is tracked in memory (AccessTracker) and written in one batched UPDATE every
+ACCESS_FLUSH_SECONDS, so downloads add no write of their own. Migration runs on a background thread
+every TIERING_INTERVAL_SECONDS, in batches, one transaction per batch, or by hand:
+
+    python -m backend.app.storage stats
+    python -m backend.app.storage migrate --older-than-days 30 --dry-run
+"""
+import argparse
+import gzip
+import logging
+import os
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, update, bindparam, case
+from sqlalchemy.orm import Session, defer
+import backend.app.models as models
+from opentelemetry import trace
+from backend.app.payload_cache import payload_cache
+
+logger = logging.getLogger("backend.app.storage")
+
+HOT = "hot"
+COLD = "cold"
+LINKED = "linked"
+
+COLD_STORAGE_BACKEND = os.getenv("COLD_STORAGE_BACKEND", "archive")
+COLD_STORAGE_DIR = os.getenv("COLD_STORAGE_DIR", os.path.normpath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "data", "cold_storage")))
+COLD_STORAGE_BUCKET = os.getenv("COLD_STORAGE_BUCKET", "document-versions")
+COLD_STORAGE_ENDPOINT = os.getenv("COLD_STORAGE_ENDPOINT")  # None = AWS
+COLD_AFTER_DAYS = float(os.getenv("COLD_AFTER_DAYS", 90))
+# Move a version back to the hot tier when it is read from the cold one
+COLD_STORAGE_REWARM = os.getenv("COLD_STORAGE_REWARM", "true").lower() in ("1", "true", "yes")
+TIERING_INTERVAL_SECONDS = float(os.getenv("TIERING_INTERVAL_SECONDS", 3600))
+TIERING_BATCH_SIZE = int(os.getenv("TIERING_BATCH_SIZE", 50))
+ACCESS_FLUSH_SECONDS = float(os.getenv("ACCESS_FLUSH_SECONDS", 30))
+# Arbitrary key for the PostgreSQL advisory lock making sure only one worker migrates at a time
+TIERING_LOCK_KEY = 7302
+
+
+class ArchiveDirectoryStore:
+    """gzip-compressed files in a directory tree; writes are atomic (temp file + rename)."""
+
+    def __init__(self, root: str = COLD_STORAGE_DIR):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/")) + ".gz"
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(gzip.compress(data, compresslevel=6))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def get(self, key: str) -> bytes:
+        """Raises KeyError if the object does not exist."""
+        try:
+            with open(self._path(key), "rb") as f:
+                return gzip.decompress(f.read())
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class S3Store:
+    """gzip-compressed objects in an S3 bucket (AWS or a local S3-compatible server such as MinIO)."""
+
+    def __init__(self, bucket: str = COLD_STORAGE_BUCKET, endpoint_url: str | None = COLD_STORAGE_ENDPOINT):
+        import boto3  # optional dependency, only needed for this backend
+
+        self.bucket = bucket
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def put(self, key: str, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=gzip.compress(data, compresslevel=6))
+
+    def get(self, key: str) -> bytes:
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=key)
+        except self.client.exceptions.NoSuchKey:
+            raise KeyError(key)
+        return gzip.decompress(obj["Body"].read())
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+
+_cold_store = None
+_cold_store_lock = threading.Lock()
+
+
+def cold_store():
+    """The configured cold store, created on first use (so hot-only deployments never touch it)."""
+    global _cold_store
+    if _cold_store is None:
+        with _cold_store_lock:
+            if _cold_store is None:
+                if COLD_STORAGE_BACKEND == "archive":
+                    _cold_store = ArchiveDirectoryStore()
+                elif COLD_STORAGE_BACKEND == "s3":
+                    _cold_store = S3Store()
+                else:
+                    raise ValueError(f"unknown COLD_STORAGE_BACKEND: {COLD_STORAGE_BACKEND!r}")
+    return _cold_store
+
+
+def set_cold_store(store) -> None:
+    """Replace the cold store; it must provide put/get/delete (get raising KeyError when missing)."""
+    global _cold_store
+    _cold_store = store
+
+
+class AccessTracker:
+    """Last-access times collected in memory and written in one batched UPDATE per flush."""
+
+    def __init__(self):
+        self._pending: dict[int, datetime] = {}
+        self._lock = threading.Lock()
+
+    def touch(self, version_id: int) -> None:
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            self._pending[version_id] = now
+
+    def flush(self, db: Session) -> int:
+        """Write pending access times and commit. Returns the number of versions updated."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        t = models.DocumentVersion.__table__
+        try:
+            db.execute(update(t).where(t.c.version_id == bindparam("vid")).values(last_accessed_at=bindparam("ts")),
+                       [{"vid": vid, "ts": ts} for vid, ts in pending.items()])
+            db.commit()
+        except Exception:
+            db.rollback()
+            # put them back (newer touches win) so the next flush retries
+            with self._lock:
+                for vid, ts in pending.items():
+                    self._pending.setdefault(vid, ts)
+            raise
+        return len(pending)
+
+
+access_tracker = AccessTracker()
+
+
+def read_version_data(db: Session, version: models.DocumentVersion) -> bytes:
+    """Payload of a version from the payload cache or whichever tier holds it; records the access.
+    Load `version` with file_data deferred so cache hits do not read the blob."""
+    access_tracker.touch(version.version_id)
+    data, source = payload_cache.get_or_load(version.version_id, lambda: _load_version_data(db, version))
+    trace.get_current_span().set_attribute("storage.cache", source)
+    return data
+
+
+def read_version_data_by_id(version_id: int) -> bytes | None:
+    """Payload of a version for signed download URLs: from the payload cache without touching the
+    database; on a miss a session is opened just to load it. None if the version is gone or in the trash."""
+    from backend.app.database import SessionLocal
+
+    def load():
+        V = models.DocumentVersion
+        db = SessionLocal()
+        try:
+            version = (db.query(V).options(defer(V.file_data))
+                       .filter(V.version_id == version_id, V.deleted_at.is_(None)).one_or_none())
+            if version is None:
+                raise LookupError(version_id)
+            return _load_version_data(db, version)
+        finally:
+            db.close()
+
+    try:
+        data, source = payload_cache.get_or_load(version_id, load)
+    except LookupError:
+        return None
+    access_tracker.touch(version_id)
+    trace.get_current_span().set_attribute("storage.cache", source)
+    return data
+
+
+def peek_version_data(db: Session, version_id: int) -> bytes:
+    """A version's bytes for background jobs: bypasses the payload cache, access tracking and re-warming,
+    so reading a version does not make it look used."""
+    V = models.DocumentVersion
+    tier, key, data = db.query(V.storage_tier, V.storage_key, V.file_data).filter(V.version_id == version_id).one()
+    if tier == LINKED:
+        return peek_version_data(db, int(key))
+    if tier == COLD:
+        return cold_store().get(key)
+    return data or b""
+
+
+def _load_version_data(db: Session, version: models.DocumentVersion) -> bytes:
+    if version.storage_tier == LINKED:
+        V = models.DocumentVersion
+        source = (db.query(V).options(defer(V.file_data))
+                  .filter(V.version_id == int(version.storage_key)).one_or_none())
+        if source is None:
+            # the source was deleted by retention, which moved the bytes here or re-pointed the link first
+            key = version.storage_key
+            db.refresh(version)
+            if version.storage_tier == LINKED and version.storage_key == key:
+                raise LookupError(f"version {version.version_id} links to missing version {key}")
+            return _load_version_data(db, version)
+        return read_version_data(db, source)
+    if version.storage_tier != COLD:
+        return version.file_data or b""
+    try:
+        data = cold_store().get(version.storage_key)
+    except KeyError:
+        # re-warmed by a concurrent request, which removed the cold copy
+        db.refresh(version)
+        if version.storage_tier == COLD:
+            raise
+        return version.file_data or b""
+    if COLD_STORAGE_REWARM:
+        rewarm(db, version, data)
+    return data
+
+
+def rewarm(db: Session, version: models.DocumentVersion, data: bytes) -> None:
+    """Move a cold version back into the database and drop the cold copy. Commits."""
+    V = models.DocumentVersion
+    key = version.storage_key
+    result = db.execute(
+        update(V).where(V.version_id == version.version_id, V.storage_tier == COLD)
+        .values(file_data=data, storage_tier=HOT, storage_key=None, last_accessed_at=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    if result.rowcount:
+        try:
+            cold_store().delete(key)
+        except Exception:
+            logger.exception("could not delete cold copy %s of re-warmed version %s", key, version.version_id)
+
+
+def delete_cold_objects(keys) -> None:
+    """Best-effort removal of cold copies of deleted versions."""
+    for key in keys:
+        try:
+            cold_store().delete(key)
+        except Exception:
+            logger.exception("could not delete cold object %s", key)
+
+
+def migrate_cold(db: Session, older_than_days: float = COLD_AFTER_DAYS, batch_size: int = TIERING_BATCH_SIZE,
+                 dry_run: bool = False) -> dict:
+    """Move hot versions not read (or, never read, uploaded) for `older_than_days` to the cold store.
+    Each batch is copied to the cold store first and then flipped in its own transaction; a version
+    deleted in between leaves an orphan object that is removed right away."""
+    V = models.DocumentVersion
+    access_tracker.flush(db)
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    report = {"dry_run": dry_run, "versions_moved": 0, "bytes_moved": 0, "batches": 0}
+    size = func.coalesce(V.file_size, func.length(V.file_data))
+    after_id = 0
+    while True:
+        batch = (
+            db.query(V.version_id, V.document_id, size)
+            .filter(V.version_id > after_id, V.storage_tier == HOT, V.file_data.isnot(None),
+                    func.coalesce(V.last_accessed_at, V.upload_date) < cutoff)
+            .order_by(V.version_id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        after_id = batch[-1][0]
+        report["batches"] += 1
+        if dry_run:
+            db.rollback()
+            report["versions_moved"] += len(batch)
+            report["bytes_moved"] += sum(b[2] or 0 for b in batch)
+            continue
+        store = cold_store()
+        keys = {}
+        # one payload in memory at a time
+        for version_id, document_id, _ in batch:
+            data = db.query(V.file_data).filter(V.version_id == version_id).scalar()
+            if data is None:
+                continue
+            key = f"{document_id}/{version_id}"
+            store.put(key, data)
+            keys[version_id] = key
+        moved, orphans = 0, []
+        for version_id, document_id, n_bytes in batch:
+            if version_id not in keys:
+                continue
+            result = db.execute(
+                update(V).where(V.version_id == version_id, V.storage_tier == HOT)
+                .values(file_data=None, storage_tier=COLD, storage_key=keys[version_id])
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount:
+                moved += 1
+                report["bytes_moved"] += n_bytes or 0
+            else:
+                orphans.append(keys[version_id])
+        db.commit()
+        delete_cold_objects(orphans)
+        report["versions_moved"] += moved
+    return report
+
+
+def tier_stats(db: Session) -> list[dict]:
+    V = models.DocumentVersion
+    # linked versions store nothing themselves
+    size = case((V.storage_tier == LINKED, 0), else_=func.coalesce(V.file_size, func.length(V.file_data)))
+    rows = db.query(V.storage_tier, func.count(), func.coalesce(func.sum(size), 0)).group_by(V.storage_tier).all()
+    return [{"tier": tier, "versions": n, "bytes": int(b)} for tier, n, b in rows]
+
+
+def _run_background(stop: threading.Event) -> None:
+    from backend.app.database import SessionLocal, try_advisory_lock
+
+    since_migration = 0.0
+    interval = min(ACCESS_FLUSH_SECONDS, TIERING_INTERVAL_SECONDS) if TIERING_INTERVAL_SECONDS > 0 else ACCESS_FLUSH_SECONDS
+    while not stop.wait(interval):
+        db = SessionLocal()
+        try:
+            access_tracker.flush(db)
+            since_migration += interval
+            if TIERING_INTERVAL_SECONDS > 0 and since_migration >= TIERING_INTERVAL_SECONDS:
+                since_migration = 0.0
+                with try_advisory_lock(TIERING_LOCK_KEY) as locked:
+                    if locked:
+                        report = migrate_cold(db)
+                        if report["versions_moved"]:
+                            logger.info("moved %d versions (%d bytes) to cold storage",
+                                        report["versions_moved"], report["bytes_moved"])
+        except Exception:
+            logger.exception("storage tiering failed")
+        finally:
+            db.close()
+
+
+def start_tiering() -> threading.Event:
+    """Start the access-flush / cold-migration thread. Set the returned Event to stop it (pending
+    accesses are flushed by stop_tiering)."""
+    stop = threading.Event()
+    threading.Thread(target=_run_background, args=(stop,), name="storage-tiering", daemon=True).start()
+    return stop
+
+
+def stop_tiering(stop: threading.Event) -> None:
+    from backend.app.database import SessionLocal
+
+    stop.set()
+    db = SessionLocal()
+    try:
+        access_tracker.flush(db)
+    finally:
+        db.close()
+
+
+def main(argv: list[str]) -> int:
+    from backend.app.database import SessionLocal, init_db
+
+    p = argparse.ArgumentParser(prog="python -m backend.app.storage", description="Version storage tiers.")
+    p.add_argument("command", choices=["stats", "migrate"])
+    p.add_argument("--older-than-days", type=float, default=COLD_AFTER_DAYS)
+    p.add_argument("--batch-size", type=int, default=TIERING_BATCH_SIZE)
+    p.add_argument("--dry-run", action="store_true")
+    args = p.parse_args(argv)
+    init_db()
+    db = SessionLocal()
+    try:
+        if args.command == "stats":
+            for row in tier_stats(db):
+                print(f"{row['tier']:6} {row['versions']:10d} versions {row['bytes']:15d} bytes")
+            return 0
+        report = migrate_cold(db, args.older_than_days, args.batch_size, args.dry_run)
+        verb = "would move" if args.dry_run else "moved"
+        print(f"{verb} {report['versions_moved']} versions ({report['bytes_moved']} bytes) to {COLD_STORAGE_BACKEND} storage")
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,83 @@
+"""OpenTelemetry tracing.
+
+Code opens spans through the OpenTelemetry API (`tracer.start_as_current_span(...)`), which is a
+no-op until configure_tracing() installs an SDK provider. TRACING_EXPORTER selects the exporter:
+
+    ""        tracing off (default)
+    console   print finished spans to stdout
+    memory    keep finished spans in memory_exporter (tests, local debugging)
+    otlp      OTLP/HTTP, needs opentelemetry-exporter-otlp-proto-http and the usual OTEL_EXPORTER_OTLP_* settings
+
+TracingMiddleware opens the server span of each request, continuing a W3C traceparent if present;
+child spans opened in sync endpoints attach to it because Starlette copies the context into its threadpool.
+"""
+import logging
+import os
+from opentelemetry import trace, propagate
+from backend.app.metrics import route_label
+
+logger = logging.getLogger("backend.app.tracing")
+
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "").strip().lower()
+TRACING_SAMPLE_RATE = float(os.getenv("TRACING_SAMPLE_RATE", 1.0))
+
+tracer = trace.get_tracer("backend.app")
+memory_exporter = None
+
+
+def configure_tracing(exporter: str = TRACING_EXPORTER, sample_rate: float = TRACING_SAMPLE_RATE) -> None:
+    """Install an SDK tracer provider with the requested exporter. Safe to call once at startup."""
+    global memory_exporter
+    if not exporter:
+        return
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", "document-repository")}),
+        sampler=ParentBased(TraceIdRatioBased(sample_rate)),
+    )
+    if exporter == "console":
+        provider.add_span_processor(BatchSpanProcessor(ConsoleSpanExporter()))
+    elif exporter == "memory":
+        from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+        memory_exporter = InMemorySpanExporter()
+        provider.add_span_processor(SimpleSpanProcessor(memory_exporter))
+    elif exporter == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            logger.error("TRACING_EXPORTER=otlp needs opentelemetry-exporter-otlp-proto-http; tracing disabled")
+            return
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    else:
+        logger.error("unknown TRACING_EXPORTER %r; tracing disabled", exporter)
+        return
+    trace.set_tracer_provider(provider)
+
+
+class TracingMiddleware:
+    """Pure ASGI middleware opening one SERVER span per HTTP request, named after the route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        carrier = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        with tracer.start_as_current_span(f"HTTP {scope['method']}", context=propagate.extract(carrier),
+                                          kind=trace.SpanKind.SERVER) as span:
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start" and span.is_recording():
+                    span.set_attribute("http.response.status_code", message["status"])
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+            if span.is_recording():
+                route = route_label(scope)
+                span.update_name(f"{scope['method']} {route}")
+                span.set_attribute("http.request.method", scope["method"])
+                span.set_attribute("http.route", route)
@@ -0,0 +1,235 @@
+"""Trash: documents and versions are soft-deleted first and purged for good later.
+
+DELETE /documents/{id} and DELETE /documents/versions/{id} only set `deleted_at`. A trashed document
+loses its rows in `department_document_access` (backend.app.access), so every access-filtered query
+(listing, search, change feed, events) skips it without a predicate of its own; the per-document
+endpoints treat it as missing. Trashed versions disappear from version lists and downloads. The latest
+version of a document cannot be trashed on its own (trash the document instead), so the document's
+latest-version pointer never changes. Both come back with .../restore until they are purged.
+
+A background thread purges what has been in the trash for TRASH_RETENTION_DAYS, every
+TRASH_PURGE_INTERVAL_SECONDS (one worker at a time), in short transactions of about
+TRASH_PURGE_BATCH_SIZE versions: only trashed rows are touched, so online traffic is never blocked by
+it. A document goes in one transaction with all its versions, so a restore never finds it half
+purged. Cold objects are removed after each commit, and bytes that deduplicated versions link to are
+handed over first (dedup.release_links), as retention does. Both indexes on `deleted_at` are partial
+(trashed rows only). By hand:
+
+    python -m backend.app.trash purge
+    python -m backend.app.trash purge --days 0 --vacuum
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, func, case
+from sqlalchemy.orm import Session
+import backend.app.models as models
+from backend.app.access import sync_document_access
+from backend.app.changelog import record_changes
+from backend.app.payload_cache import payload_cache
+from backend.app.storage import COLD, LINKED, delete_cold_objects
+from backend.app.dedup import release_links
+
+logger = logging.getLogger("backend.app.trash")
+
+TRASH_RETENTION_DAYS = float(os.getenv("TRASH_RETENTION_DAYS", 30))
+TRASH_PURGE_INTERVAL_SECONDS = float(os.getenv("TRASH_PURGE_INTERVAL_SECONDS", 3600))
+TRASH_PURGE_BATCH_SIZE = int(os.getenv("TRASH_PURGE_BATCH_SIZE", 100))
+# Pause between batches so a large purge does not monopolise the database
+TRASH_PURGE_BATCH_PAUSE_SECONDS = float(os.getenv("TRASH_PURGE_BATCH_PAUSE_SECONDS", 0.05))
+# Arbitrary key for the PostgreSQL advisory lock making sure only one worker purges at a time
+PURGE_LOCK_KEY = 7307
+
+
+class TrashError(Exception):
+    """A trash operation that is not allowed; the message is meant for the client."""
+
+
+def trash_document(db: Session, doc: models.Document, user_id: int | None) -> None:
+    """Move a document to the trash and drop its access rows. Does not commit."""
+    doc.deleted_at = datetime.now(timezone.utc)
+    doc.deleted_by = user_id
+    sync_document_access(db, doc)
+
+
+def restore_document(db: Session, doc: models.Document) -> None:
+    """Take a document out of the trash and recompute its access rows. Does not commit."""
+    doc.deleted_at = None
+    doc.deleted_by = None
+    sync_document_access(db, doc)
+
+
+def trash_version(doc: models.Document, version: models.DocumentVersion, user_id: int | None) -> None:
+    """Move a version other than the latest to the trash. Does not commit."""
+    if version.version_number == doc.latest_version_number:
+        raise TrashError("the latest version cannot be deleted; upload a new one first or delete the document")
+    version.deleted_at = datetime.now(timezone.utc)
+    version.deleted_by = user_id
+
+
+def restore_version(version: models.DocumentVersion) -> None:
+    version.deleted_at = None
+    version.deleted_by = None
+
+
+def purge_after(deleted_at: datetime | None) -> datetime | None:
+    """When something trashed at `deleted_at` is due to be purged."""
+    if deleted_at is None:
+        return None
+    if deleted_at.tzinfo is None:
+        # SQLite hands back naive timestamps; they are stored in UTC
+        deleted_at = deleted_at.replace(tzinfo=timezone.utc)
+    return deleted_at + timedelta(days=TRASH_RETENTION_DAYS)
+
+
+def _payload_rows(db: Session, *criteria) -> list[tuple]:
+    """(version_id, bytes freed by deleting it, cold storage key) of the versions matching `criteria`,
+    locked until the caller commits so that no upload links to them meanwhile (dedup.payload_columns)."""
+    V = models.DocumentVersion
+    size = case((V.storage_tier == LINKED, 0), else_=func.coalesce(V.file_size, func.length(V.file_data)))
+    cold_key = case((V.storage_tier == COLD, V.storage_key))
+    return db.query(V.version_id, size, cold_key).filter(*criteria).order_by(V.version_id).with_for_update().all()
+
+
+def _delete_versions(db: Session, rows: list[tuple]) -> tuple[int, list[str]]:
+    """Delete versions (rows from _payload_rows). Does not commit. Returns (bytes freed, cold keys to
+    delete once committed)."""
+    version_ids = [r[0] for r in rows]
+    # versions other versions link to hand their bytes over first
+    handed_over = release_links(db, version_ids)
+    db.execute(delete(models.DocumentVersion).where(models.DocumentVersion.version_id.in_(version_ids)))
+    kept = [r for r in rows if r[0] not in handed_over]
+    return sum(r[1] or 0 for r in kept), [r[2] for r in kept if r[2]]
+
+
+def _finish_batch(db: Session, report: dict, version_ids: list[int], cold_keys: list[str], freed: int) -> None:
+    db.commit()
+    delete_cold_objects(cold_keys)
+    payload_cache.discard(version_ids)
+    report["batches"] += 1
+    report["versions_purged"] += len(version_ids)
+    report["bytes_freed"] += freed
+
+
+def purge(db: Session, older_than: datetime, batch_size: int = TRASH_PURGE_BATCH_SIZE,
+          pause: float = TRASH_PURGE_BATCH_PAUSE_SECONDS, vacuum: bool = False) -> dict:
+    """Delete versions and documents trashed before `older_than`, committing after every batch.
+    Returns a report."""
+    D = models.Document
+    V = models.DocumentVersion
+    report = {"documents_purged": 0, "versions_purged": 0, "bytes_freed": 0, "batches": 0}
+
+    # versions trashed on their own; locked so a concurrent restore waits and then finds them gone
+    while True:
+        ids = [r[0] for r in (db.query(V.version_id).filter(V.deleted_at < older_than)
+                              .order_by(V.version_id).limit(batch_size).with_for_update().all())]
+        if not ids:
+            break
+        rows = _payload_rows(db, V.version_id.in_(ids))
+        # logged so that incremental exports (backend.app.archive) see versions go
+        record_changes(db, [r[0] for r in db.query(V.document_id).filter(V.version_id.in_(ids)).distinct()], "versions")
+        freed, cold_keys = _delete_versions(db, rows)
+        _finish_batch(db, report, ids, cold_keys, freed)
+        if pause and len(ids) == batch_size:
+            time.sleep(pause)
+
+    # documents, each with all its versions in one transaction; a batch holds about batch_size versions
+    after_id = 0
+    while True:
+        candidates = (db.query(D.document_id, func.count(V.version_id))
+                      .outerjoin(V, V.document_id == D.document_id)
+                      .filter(D.deleted_at < older_than, D.document_id > after_id)
+                      .group_by(D.document_id).order_by(D.document_id).limit(batch_size).all())
+        if not candidates:
+            break
+        doc_ids, budget = [], 0
+        for doc_id, versions in candidates:
+            if doc_ids and budget + versions > batch_size:
+                break
+            doc_ids.append(doc_id)
+            budget += versions
+        after_id = doc_ids[-1]
+        # still trashed (not restored meanwhile), and locked until the batch commits
+        doc_ids = [r[0] for r in (db.query(D.document_id).filter(D.document_id.in_(doc_ids), D.deleted_at < older_than)
+                                  .with_for_update().all())]
+        rows = _payload_rows(db, V.document_id.in_(doc_ids)) if doc_ids else []
+        freed, cold_keys = _delete_versions(db, rows) if rows else (0, [])
+        if doc_ids:
+            # dependent rows go by FK cascade; deleted explicitly for databases without it (SQLite)
+            for model in (models.DocumentTag, models.DocumentViewPermission, models.DocumentEditPermission,
+                          models.DepartmentDocumentAccess):
+                db.execute(delete(model).where(model.document_id.in_(doc_ids)))
+            db.execute(delete(D).where(D.document_id.in_(doc_ids)))
+            record_changes(db, doc_ids, "purged")
+        _finish_batch(db, report, [r[0] for r in rows], cold_keys, freed)
+        report["documents_purged"] += len(doc_ids)
+        if pause and len(candidates) == batch_size:
+            time.sleep(pause)
+
+    if vacuum and report["versions_purged"]:
+        from backend.app.retention import vacuum_versions
+
+        vacuum_versions(db.get_bind())
+    return report
+
+
+def _purge_once() -> None:
+    from backend.app.database import SessionLocal, try_advisory_lock
+
+    with try_advisory_lock(PURGE_LOCK_KEY) as locked:
+        if not locked:
+            return
+        db = SessionLocal()
+        try:
+            report = purge(db, datetime.now(timezone.utc) - timedelta(days=TRASH_RETENTION_DAYS))
+        finally:
+            db.close()
+    if report["documents_purged"] or report["versions_purged"]:
+        logger.info("purged %d documents and %d versions from the trash (%d bytes)",
+                    report["documents_purged"], report["versions_purged"], report["bytes_freed"])
+
+
+def start_purger(interval: float = TRASH_PURGE_INTERVAL_SECONDS) -> threading.Event | None:
+    """Run purge() every `interval` seconds on a daemon thread. Returns an Event that stops it."""
+    if interval <= 0:
+        return None
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                _purge_once()
+            except Exception:
+                logger.exception("trash purge failed")
+
+    threading.Thread(target=loop, name="trash-purger", daemon=True).start()
+    return stop
+
+
+def main(argv: list[str]) -> int:
+    from backend.app.database import SessionLocal, init_db
+
+    p = argparse.ArgumentParser(prog="python -m backend.app.trash", description="Purge the trash.")
+    p.add_argument("command", choices=["purge"])
+    p.add_argument("--days", type=float, default=TRASH_RETENTION_DAYS, help="purge what was trashed this long ago")
+    p.add_argument("--batch-size", type=int, default=TRASH_PURGE_BATCH_SIZE)
+    p.add_argument("--vacuum", action="store_true", help="VACUUM afterwards to return the space to the OS")
+    args = p.parse_args(argv)
+    init_db()
+    db = SessionLocal()
+    try:
+        report = purge(db, datetime.now(timezone.utc) - timedelta(days=args.days), batch_size=args.batch_size,
+                       vacuum=args.vacuum)
+    finally:
+        db.close()
+    print(f"purged {report['documents_purged']} documents and {report['versions_purged']} versions, "
+          f"{report['bytes_freed']} bytes ({report['batches']} batches)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,208 @@
+"""Resumable uploads: large files sent in chunks that survive dropped connections.
+
+    POST   /uploads                          {"file_name", "size", "title", "is_public", "document_id", "sha256"}
+                                             -> upload_id, chunk_size
+    PATCH  /uploads/{upload_id}?offset=N     one chunk (application/octet-stream), X-Chunk-SHA256 header
+    GET    /uploads/{upload_id}              received bytes and the offsets still missing (to resume)
+    POST   /uploads/{upload_id}/finalize     -> the document, as /documents/upload returns it
+    DELETE /uploads/{upload_id}              abandon
+
+A session fixes the file size and the chunk size; chunk i covers [i * chunk_size, (i + 1) * chunk_size).
+Each chunk is checked against its SHA-256, written at its offset into a sparse staging file under
+UPLOAD_STAGING_DIR and fsynced before it is recorded in upload_chunks, so a recorded chunk is on disk.
+Chunks are independent: a client can send several at once (up to MAX_CONCURRENT_UPLOAD_CHUNK) and, after
+a failure, resend only the missing ones. Each request holds a worker for one chunk, not the whole file.
+
+Finalize checks that every chunk is there (and the whole-file SHA-256, if the session has one), then
+creates the version the way /documents/upload or /documents/{id}/update would, deleting the session
+in the same transaction: the version exists exactly when the session is gone. Storage takes a version's
+bytes in one piece, so finalize reads the staged file once; UPLOAD_MAX_BYTES bounds it.
+
+The staging directory must be shared by every worker that serves /uploads (one host, or a shared
+volume). Sessions expire UPLOAD_SESSION_TTL_SECONDS after their last chunk; a background thread
+deletes expired sessions and their files every UPLOAD_CLEANUP_INTERVAL_SECONDS, or by hand:
+
+    python -m backend.app.uploads cleanup
+"""
+import hashlib
+import logging
+import os
+import secrets
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+import backend.app.models as models
+from backend.app.database import insert_ignore
+
+logger = logging.getLogger("backend.app.uploads")
+
+UPLOAD_STAGING_DIR = os.getenv("UPLOAD_STAGING_DIR", os.path.normpath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "data", "uploads")))
+# Largest file accepted (PostgreSQL caps a bytea value at 1 GB)
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 1024 ** 3))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", 8 * 1024 ** 2))
+UPLOAD_MIN_CHUNK_BYTES = 256 * 1024
+UPLOAD_MAX_CHUNK_BYTES = int(os.getenv("UPLOAD_MAX_CHUNK_BYTES", 64 * 1024 ** 2))
+UPLOAD_SESSION_TTL_SECONDS = float(os.getenv("UPLOAD_SESSION_TTL_SECONDS", 24 * 3600))
+UPLOAD_CLEANUP_INTERVAL_SECONDS = float(os.getenv("UPLOAD_CLEANUP_INTERVAL_SECONDS", 3600))
+# Arbitrary key for the PostgreSQL advisory lock making sure only one worker cleans up at a time
+CLEANUP_LOCK_KEY = 7305
+
+OPEN = "open"
+FINALIZING = "finalizing"
+
+
+def staging_path(upload_id: str) -> str:
+    return os.path.join(UPLOAD_STAGING_DIR, upload_id + ".part")
+
+
+def _expiry() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS)
+
+
+def create_session(db: Session, user_id: int, size: int, file_name: str | None, title: str | None,
+                   is_public: bool, document_id: int | None, sha256: str | None,
+                   chunk_size: int | None = None) -> models.UploadSession:
+    """Create the staging file (sparse, full size) and the session. Commits."""
+    chunk_size = min(max(chunk_size or UPLOAD_CHUNK_BYTES, UPLOAD_MIN_CHUNK_BYTES), UPLOAD_MAX_CHUNK_BYTES)
+    session = models.UploadSession(
+        upload_id=secrets.token_hex(16), user_id=user_id, document_id=document_id, title=title,
+        file_name=file_name, is_public=is_public, size=size, chunk_size=chunk_size,
+        sha256=sha256.lower() if sha256 else None, status=OPEN, expires_at=_expiry(),
+    )
+    os.makedirs(UPLOAD_STAGING_DIR, exist_ok=True)
+    with open(staging_path(session.upload_id), "wb") as f:
+        f.truncate(size)
+    db.add(session)
+    db.commit()
+    return session
+
+
+def chunk_count(session: models.UploadSession) -> int:
+    return -(-session.size // session.chunk_size)
+
+
+def chunk_length(session: models.UploadSession, index: int) -> int:
+    return min(session.chunk_size, session.size - index * session.chunk_size)
+
+
+def received_chunks(db: Session, upload_id: str) -> dict[int, tuple[int, str]]:
+    """chunk_index -> (size, sha256) of the chunks on disk."""
+    C = models.UploadChunk
+    return {i: (size, digest) for i, size, digest in
+            db.query(C.chunk_index, C.size, C.sha256).filter(C.upload_id == upload_id).all()}
+
+
+def missing_offsets(session: models.UploadSession, received: dict) -> list[int]:
+    return [i * session.chunk_size for i in range(chunk_count(session)) if i not in received]
+
+
+def write_chunk(db: Session, session: models.UploadSession, index: int, data: bytes, digest: str) -> None:
+    """Write a verified chunk at its offset, fsync it, then record it and extend the session. Commits."""
+    with open(staging_path(session.upload_id), "r+b") as f:
+        f.seek(index * session.chunk_size)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    insert_ignore(db, models.UploadChunk, [{"upload_id": session.upload_id, "chunk_index": index,
+                                            "size": len(data), "sha256": digest}])
+    session.expires_at = _expiry()
+    db.commit()
+
+
+def read_staged(session: models.UploadSession) -> bytes:
+    with open(staging_path(session.upload_id), "rb") as f:
+        return f.read(session.size)
+
+
+def sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def discard(db: Session, upload_id: str) -> None:
+    """Delete the session and its chunk records. Does not commit; remove_staging() after the commit."""
+    db.execute(delete(models.UploadChunk).where(models.UploadChunk.upload_id == upload_id))
+    db.execute(delete(models.UploadSession).where(models.UploadSession.upload_id == upload_id))
+
+
+def remove_staging(upload_id: str) -> None:
+    try:
+        os.remove(staging_path(upload_id))
+    except FileNotFoundError:
+        pass
+
+
+def expire_sessions(db: Session, now: datetime | None = None) -> int:
+    """Delete sessions past their expiry and their staging files, and staging files without a session
+    (left by a crash between commit and file removal). Returns the number of sessions deleted."""
+    S = models.UploadSession
+    now = now or datetime.now(timezone.utc)
+    expired = [r[0] for r in db.query(S.upload_id).filter(S.expires_at < now).all()]
+    for upload_id in expired:
+        discard(db, upload_id)
+    db.commit()
+    for upload_id in expired:
+        remove_staging(upload_id)
+    if os.path.isdir(UPLOAD_STAGING_DIR):
+        known = {r[0] for r in db.query(S.upload_id).all()}
+        # a file is created just before its session row commits; leave young ones alone
+        young = now.timestamp() - 3600
+        for name in os.listdir(UPLOAD_STAGING_DIR):
+            path = os.path.join(UPLOAD_STAGING_DIR, name)
+            if (name.endswith(".part") and name[:-5] not in known
+                    and os.path.getmtime(path) < young):
+                remove_staging(name[:-5])
+    return len(expired)
+
+
+def _cleanup_once() -> None:
+    from backend.app.database import SessionLocal, try_advisory_lock
+
+    with try_advisory_lock(CLEANUP_LOCK_KEY) as locked:
+        if not locked:
+            return
+        db = SessionLocal()
+        try:
+            expired = expire_sessions(db)
+        finally:
+            db.close()
+    if expired:
+        logger.info("deleted %d expired upload sessions", expired)
+
+
+def start_cleanup(interval: float = UPLOAD_CLEANUP_INTERVAL_SECONDS) -> threading.Event | None:
+    """Run expire_sessions() every `interval` seconds on a daemon thread. Returns an Event that stops it."""
+    if interval <= 0:
+        return None
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                _cleanup_once()
+            except Exception:
+                logger.exception("upload session cleanup failed")
+
+    threading.Thread(target=loop, name="upload-cleanup", daemon=True).start()
+    return stop
+
+
+def main(argv: list[str]) -> int:
+    from backend.app.database import SessionLocal, init_db
+
+    if argv != ["cleanup"]:
+        print("usage: python -m backend.app.uploads cleanup", file=sys.stderr)
+        return 2
+    init_db()
+    db = SessionLocal()
+    try:
+        print(f"deleted {expire_sessions(db)} expired upload sessions")
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,98 @@
+"""Run the benchmark suite against two git revisions and print the difference.
+
+Each revision is checked out into a temporary git worktree; the benchmark scripts of the current
+checkout are copied over it (so revisions predating the suite can be measured) and the suite runs
+there against its own freshly generated database. HEAD_REV defaults to the working tree, including
+uncommitted changes. Extra arguments are passed through to backend.benchmarks.suite:
+
+    python -m backend.benchmarks.compare main
+    python -m backend.benchmarks.compare v1.0 main -- --scale medium --duration 20 --scenarios dashboard,search
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+METRICS = (("p50_ms", "p50"), ("p95_ms", "p95"), ("p99_ms", "p99"), ("throughput_rps", "req/s"), ("queries_per_request", "queries"))
+
+
+def repo_root() -> str:
+    return subprocess.run(["git", "rev-parse", "--show-toplevel"], capture_output=True, text=True, check=True).stdout.strip()
+
+
+def run_suite(checkout: str, label: str, suite_args: list[str], workdir: str) -> dict:
+    out = os.path.join(workdir, f"{label}.json")
+    db_url = f"sqlite:///{os.path.join(workdir, label + '.sqlite')}"
+    if not any(a == "--database-url" or a.startswith("--database-url=") for a in suite_args):
+        suite_args = ["--database-url", db_url] + suite_args
+    env = dict(os.environ, PYTHONPATH=checkout)
+    print(f"== {label} ({checkout})", flush=True)
+    subprocess.run([sys.executable, "-m", "backend.benchmarks.suite", "--json", out] + suite_args,
+                   cwd=checkout, env=env, check=True)
+    with open(out) as f:
+        return json.load(f)
+
+
+def checkout_revision(root: str, rev: str, workdir: str) -> str:
+    path = os.path.join(workdir, f"rev-{rev.replace('/', '_')}")
+    subprocess.run(["git", "-C", root, "worktree", "add", "--detach", path, rev], check=True, capture_output=True)
+    shutil.copytree(os.path.join(root, "backend", "benchmarks"), os.path.join(path, "backend", "benchmarks"), dirs_exist_ok=True)
+    return path
+
+
+def print_comparison(base_label: str, base: dict, head_label: str, head: dict) -> None:
+    print(f"\n{'scenario':12} {'metric':8} {base_label[:12]:>12} {head_label[:12]:>12} {'change':>9}")
+    for name, b in base["results"].items():
+        h = head["results"].get(name)
+        if h is None:
+            continue
+        for key, label in METRICS:
+            bv, hv = b[key], h[key]
+            change = f"{(hv - bv) / bv * 100:+8.1f}%" if bv else "      n/a"
+            print(f"{name:12} {label:8} {bv:12.2f} {hv:12.2f} {change:>9}")
+        if b["errors"] or h["errors"]:
+            print(f"{name:12} {'errors':8} {b['errors']:12d} {h['errors']:12d}")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    suite_args: list[str] = []
+    if "--" in argv:
+        i = argv.index("--")
+        argv, suite_args = argv[:i], argv[i + 1:]
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("base_rev")
+    p.add_argument("head_rev", nargs="?", help="defaults to the working tree")
+    p.add_argument("--keep", action="store_true", help="keep worktrees and result files")
+    args = p.parse_args(argv)
+
+    root = repo_root()
+    workdir = tempfile.mkdtemp(prefix="docrepo-bench-")
+    worktrees = []
+    try:
+        base_path = checkout_revision(root, args.base_rev, workdir)
+        worktrees.append(base_path)
+        if args.head_rev:
+            head_path = checkout_revision(root, args.head_rev, workdir)
+            worktrees.append(head_path)
+        else:
+            head_path = root
+        head_label = args.head_rev or "working tree"
+        base = run_suite(base_path, args.base_rev, suite_args, workdir)
+        head = run_suite(head_path, args.head_rev or "worktree", suite_args, workdir)
+        print_comparison(args.base_rev, base, head_label, head)
+    finally:
+        if not args.keep:
+            for path in worktrees:
+                subprocess.run(["git", "-C", root, "worktree", "remove", "--force", path], capture_output=True)
+            shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            print(f"results kept in {workdir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
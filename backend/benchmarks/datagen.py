@@ -0,0 +1,228 @@
+"""Synthetic dataset generator shared by the benchmarks.
+
+Fills the database behind backend.app.database.engine with departments, users, documents,
+versions, tags and view/edit permissions at a configurable scale, in bounded memory
+(rows are streamed in chunks). Every generated user has the password BENCH_PASSWORD, and
+usernames are user0000001, user0000002, ...
+
+    python -m backend.benchmarks.datagen --scale small --database-url sqlite:////tmp/bench.sqlite
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+BENCH_PASSWORD = "benchpass"
+FIRST_NAMES = ["Ahmed", "Mona", "Omar", "Sara", "Youssef", "Nour", "Karim", "Laila", "Hassan", "Dina", "John", "Maria"]
+LAST_NAMES = ["Bador", "Hassan", "Farouk", "Salem", "Smith", "Garcia", "Nasser", "Adel", "Kamal", "Fathy"]
+WORDS = ["policy", "report", "budget", "contract", "template", "minutes", "design", "plan", "invoice", "review",
+         "handbook", "roadmap", "audit", "proposal", "summary", "guide"]
+CHUNK = 20_000
+
+# name -> (departments, users, versions, avg versions per document, tags)
+SCALES = {
+    "tiny": (5, 200, 2_000, 4, 20),
+    "small": (10, 2_000, 20_000, 4, 50),
+    "medium": (20, 20_000, 200_000, 5, 200),
+    "large": (50, 100_000, 1_000_000, 5, 1_000),
+}
+
+
+def add_scale_arguments(p: argparse.ArgumentParser) -> None:
+    p.add_argument("--database-url", default="sqlite:////tmp/document_repo_bench.sqlite")
+    p.add_argument("--scale", choices=sorted(SCALES), default="small")
+    p.add_argument("--departments", type=int)
+    p.add_argument("--users", type=int)
+    p.add_argument("--versions", type=int)
+    p.add_argument("--versions-per-document", type=int, help="average")
+    p.add_argument("--tags", type=int)
+    p.add_argument("--tags-per-document", type=int, default=3, help="maximum")
+    p.add_argument("--public-ratio", type=float, default=0.7)
+    p.add_argument("--view-grants-per-document", type=int, default=2, help="maximum, private documents only")
+    p.add_argument("--edit-grants-per-document", type=int, default=1, help="maximum")
+    p.add_argument("--payload-bytes", type=int, default=0, help="file_data size per version (0 stores no blob)")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--reuse", action="store_true", help="skip data generation and reuse the existing database")
+
+
+def resolve_scale(args) -> None:
+    """Fill unset size arguments from the --scale preset."""
+    departments, users, versions, per_doc, tags = SCALES[args.scale]
+    args.departments = args.departments or departments
+    args.users = args.users or users
+    args.versions = args.versions or versions
+    args.versions_per_document = args.versions_per_document or per_doc
+    args.tags = args.tags if args.tags is not None else tags
+
+
+def use_database(url: str):
+    """Point the app at `url`; must run before backend.app.database is first imported."""
+    os.environ["DATABASE_URL"] = url
+    from backend.app.database import engine
+    return engine
+
+
+def _chunks(rows_iter, size=CHUNK):
+    chunk = []
+    for row in rows_iter:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def generate(engine, args) -> dict:
+    """Drop and recreate all tables, then populate them. Returns the generated row counts."""
+    from sqlalchemy import insert, update, Integer
+    import backend.app.models as models
+    from backend.app.database import Base, SessionLocal
+    from backend.app.routers.helpers import bcrypt_context
+
+    resolve_scale(args)
+    rnd = random.Random(args.seed)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    t0 = time.perf_counter()
+    # a factory now; compare.py runs this file against older revisions, where it is the context itself
+    ctx = bcrypt_context() if callable(bcrypt_context) else bcrypt_context
+    password_hash = ctx.hash(BENCH_PASSWORD)
+    payload = os.urandom(args.payload_bytes) if args.payload_bytes else None
+    n_docs = max(1, args.versions // args.versions_per_document)
+    counts = {"departments": args.departments, "users": args.users, "documents": n_docs, "versions": args.versions,
+              "tags": args.tags, "document_tags": 0, "view_permissions": 0, "edit_permissions": 0}
+
+    with engine.begin() as conn:
+        conn.execute(insert(models.Role.__table__), [{"role_id": 0, "name": "admin"}, {"role_id": 1, "name": "user"}])
+        conn.execute(insert(models.Department.__table__),
+                     [{"department_id": d, "name": f"dept{d}"} for d in range(1, args.departments + 1)])
+        users = ({
+            "user_id": u, "username": f"user{u:07d}", "email": f"user{u}@example.com", "password_hash": password_hash,
+            "first_name": rnd.choice(FIRST_NAMES), "last_name": rnd.choice(LAST_NAMES),
+            "department_id": rnd.randint(1, args.departments), "role_id": 0 if u == 1 else 1,
+        } for u in range(1, args.users + 1))
+        for chunk in _chunks(users):
+            conn.execute(insert(models.User.__table__), chunk)
+        if args.tags:
+            conn.execute(insert(models.Tag.__table__),
+                         [{"tag_id": t, "tag_name": f"{WORDS[t % len(WORDS)]}-{t}"} for t in range(1, args.tags + 1)])
+
+        doc_meta: dict[int, tuple[int, bool, int]] = {}
+
+        def documents():
+            for d in range(1, n_docs + 1):
+                dept = rnd.randint(1, args.departments)
+                public = rnd.random() < args.public_ratio
+                owner = rnd.randint(1, args.users)
+                doc_meta[d] = (dept, public, owner)
+                yield {"document_id": d, "department_id": dept, "owner_user_id": owner, "is_public": public,
+                       "latest_version_title": f"{rnd.choice(WORDS)} {rnd.choice(WORDS)} {d}"}
+
+        for chunk in _chunks(documents()):
+            conn.execute(insert(models.Document.__table__), chunk)
+
+        latest: dict[int, int] = {}
+
+        def versions():
+            remaining = args.versions
+            for doc_id in range(1, n_docs + 1):
+                docs_left = n_docs - doc_id
+                k = rnd.randint(1, 2 * args.versions_per_document - 1)
+                k = max(1, min(k, remaining - docs_left)) if docs_left else max(1, remaining)
+                remaining -= k
+                latest[doc_id] = k
+                owner = doc_meta[doc_id][2]
+                for n in range(1, k + 1):
+                    yield {"document_id": doc_id, "version_number": n, "title": f"document {doc_id}",
+                           "file_name": f"doc{doc_id}_v{n}.txt",
+                           "file_size": len(payload) if payload else rnd.randint(1_000, 5_000_000),
+                           "file_data": payload,
+                           "uploader_id": owner if n == 1 else rnd.randint(1, args.users)}
+
+        for chunk in _chunks(versions()):
+            conn.execute(insert(models.DocumentVersion.__table__), chunk)
+        D = models.Document
+        by_count: dict[int, list[int]] = {}
+        for doc_id, k in latest.items():
+            by_count.setdefault(k, []).append(doc_id)
+        for k, doc_ids in by_count.items():
+            for i in range(0, len(doc_ids), CHUNK):
+                conn.execute(update(D.__table__).where(D.document_id.in_(doc_ids[i:i + CHUNK]))
+                             .values(latest_version_number=k))
+
+        def document_tags():
+            for doc_id in range(1, n_docs + 1):
+                if not args.tags:
+                    return
+                for t in rnd.sample(range(1, args.tags + 1), rnd.randint(0, min(args.tags_per_document, args.tags))):
+                    counts["document_tags"] += 1
+                    yield {"document_id": doc_id, "tag_id": t}
+
+        def view_permissions():
+            for doc_id, (dept, public, _) in doc_meta.items():
+                if public or args.departments < 2:
+                    continue
+                others = [d for d in rnd.sample(range(1, args.departments + 1), min(args.departments, args.view_grants_per_document + 1)) if d != dept]
+                for d in others[:rnd.randint(0, args.view_grants_per_document)]:
+                    counts["view_permissions"] += 1
+                    yield {"document_id": doc_id, "department_id": d}
+
+        def edit_permissions():
+            for doc_id, (_, _, owner) in doc_meta.items():
+                users = {rnd.randint(2, max(2, args.users)) for _ in range(rnd.randint(0, args.edit_grants_per_document))}
+                for u in users - {owner}:
+                    counts["edit_permissions"] += 1
+                    yield {"document_id": doc_id, "user_id": u}
+
+        for model, rows in ((models.DocumentTag, document_tags()), (models.DocumentViewPermission, view_permissions()),
+                            (models.DocumentEditPermission, edit_permissions())):
+            for chunk in _chunks(rows):
+                conn.execute(insert(model.__table__), chunk)
+
+    # derived tables of newer schemas; absent when benchmarking an older revision
+    try:
+        from backend.app.access import rebuild_access
+    except ImportError:
+        rebuild_access = None
+    if rebuild_access is not None:
+        db = SessionLocal()
+        try:
+            rebuild_access(db)
+            db.commit()
+        finally:
+            db.close()
+
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            conn.exec_driver_sql("ANALYZE")
+    elif engine.dialect.name == "postgresql":
+        # ids were inserted explicitly; move the serial sequences past them so API inserts don't collide
+        with engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                pk = list(table.primary_key.columns)
+                if len(pk) == 1 and isinstance(pk[0].type, Integer):
+                    col = pk[0]
+                    conn.exec_driver_sql(
+                        f"SELECT setval(pg_get_serial_sequence('{table.name}', '{col.name}'), "
+                        f"COALESCE((SELECT MAX({col.name}) FROM {table.name}), 0) + 1, false)"
+                    )
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("VACUUM ANALYZE")
+    counts["seconds"] = round(time.perf_counter() - t0, 1)
+    return counts
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_scale_arguments(p)
+    args = p.parse_args(sys.argv[1:] if argv is None else argv)
+    engine = use_database(args.database_url)
+    counts = generate(engine, args)
+    print(", ".join(f"{k}={v}" for k, v in counts.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""Measure the per-request overhead of the rate limiter.
+
+Times the in-memory backend directly (hot bucket, many distinct users, concurrency slot acquire/release,
+contended from several threads), the rate_limited wrapper around a bare function, and end to end: the
+same sync ASGI route with and without the decorator, called in-process (no HTTP client, constant user).
+The target is under 50 µs per request, taken as the worst route difference:
+
+    python -m backend.benchmarks.ratelimit
+    python -m backend.benchmarks.ratelimit --iterations 200000 --threads 8
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+
+TARGET_US = 50.0
+
+
+def per_op_us(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    fn(iterations)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def bench_backend(args) -> dict:
+    from backend.app.ratelimit import MemoryBackend
+
+    results = {}
+    b = MemoryBackend()
+    # effectively unlimited budget so every call takes the "allowed" path
+    cap, rate = 1e12, 1e12
+
+    def hot(n):
+        for _ in range(n):
+            b.take("search:user:1", cap, rate)
+    results["take, one hot bucket"] = per_op_us(hot, args.iterations)
+
+    keys = [f"search:user:{i}" for i in range(args.users)]
+
+    def spread(n):
+        for i in range(n):
+            b.take(keys[i % len(keys)], cap, rate)
+    results[f"take, {args.users} users"] = per_op_us(spread, args.iterations)
+
+    def slots(n):
+        for _ in range(n):
+            b.acquire("download:user:1", 4)
+            b.release("download:user:1")
+    results["acquire + release"] = per_op_us(slots, args.iterations)
+
+    per_thread = args.iterations // args.threads
+
+    def contended(_):
+        threads = [threading.Thread(target=spread, args=(per_thread,)) for _ in range(args.threads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    results[f"take, {args.threads} threads"] = per_op_us(contended, per_thread * args.threads)
+    return results
+
+
+def bench_endpoint(args) -> dict:
+    from fastapi import Depends, FastAPI, Request
+    from backend.app import ratelimit
+
+    class BenchUser:
+        user_id = 1
+
+    # stands in for get_current_user, whose DB lookup would add ~1 ms of noise to both routes
+    def bench_user():
+        return BenchUser()
+
+    ratelimit.BUDGETS["search"] = ratelimit.BUDGETS["download"] = ratelimit.BUDGETS["login"] = (1e12, 1e12)
+
+    def endpoint(current_user=None):
+        return None
+
+    results = {}
+    calls = {
+        "plain call": endpoint,
+        "rate limited call": ratelimit.rate_limited("search")(endpoint),
+        "+ concurrency cap call": ratelimit.rate_limited("download", concurrent=True)(endpoint),
+    }
+    user = BenchUser()
+    for name, fn in calls.items():
+        results[name] = per_op_us(lambda n: [fn(current_user=user) for _ in range(n)], args.iterations)
+
+    # identical sync routes (run on the threadpool like the real ones) apart from the limiter
+    app = FastAPI()
+
+    @app.get("/plain")
+    def plain(current_user=Depends(bench_user)):
+        return None
+
+    @app.get("/rate")
+    @ratelimit.rate_limited("search")
+    def rate(current_user=Depends(bench_user)):
+        return None
+
+    @app.get("/rate-concurrent")
+    @ratelimit.rate_limited("download", concurrent=True)
+    def rate_concurrent(current_user=Depends(bench_user)):
+        return None
+
+    @app.get("/rate-ip")
+    @ratelimit.rate_limited("login", per_user=False)
+    def rate_ip(request: Request, current_user=Depends(bench_user)):
+        return None
+
+    async def call(path: str):
+        scope = {"type": "http", "method": "GET", "path": path, "raw_path": path.encode(), "root_path": "",
+                 "query_string": b"", "headers": [], "client": ("127.0.0.1", 1234), "server": ("test", 80),
+                 "scheme": "http", "http_version": "1.1"}
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start" and message["status"] != 200:
+                raise RuntimeError(f"{path} returned {message['status']}")
+        await app(scope, receive, send)
+
+    async def run(path: str, n: int) -> float:
+        start = time.perf_counter()
+        for _ in range(n):
+            await call(path)
+        return (time.perf_counter() - start) / n * 1e6
+
+    paths = ("/plain", "/rate", "/rate-concurrent", "/rate-ip")
+
+    async def main():
+        for path in paths:
+            await run(path, 300)
+        timings = {path: [] for path in paths}
+        # interleave rounds so drift affects all routes alike
+        for _ in range(args.rounds):
+            for path in paths:
+                timings[path].append(await run(path, args.requests))
+        return {path: statistics.median(t) for path, t in timings.items()}
+
+    t = asyncio.run(main())
+    results["route without limiter"] = t["/plain"]
+    for path in paths[1:]:
+        results[f"route {path[1:]}"] = t[path]
+    results["overhead, direct"] = results["+ concurrency cap call"] - results["plain call"]
+    results["overhead, route"] = max(t[path] for path in paths[1:]) - t["/plain"]
+    return results
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--iterations", type=int, default=100000, help="backend calls per measurement")
+    p.add_argument("--users", type=int, default=10000, help="distinct bucket keys")
+    p.add_argument("--threads", type=int, default=4)
+    p.add_argument("--requests", type=int, default=2000, help="requests per round in the endpoint measurement")
+    p.add_argument("--rounds", type=int, default=7)
+    args = p.parse_args(sys.argv[1:] if argv is None else argv)
+    # the app modules need a database URL at import time; nothing is queried
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+    results = bench_backend(args)
+    results.update(bench_endpoint(args))
+    for name, us in results.items():
+        print(f"{name:28} {us:8.2f} µs")
+    overhead = results["overhead, route"]
+    print(f"\noverhead {overhead:.2f} µs per request: {'ok' if overhead < TARGET_US else 'above'} target of {TARGET_US:.0f} µs")
+    return 0 if overhead < TARGET_US else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
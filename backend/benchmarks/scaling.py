@@ -0,0 +1,186 @@
+"""Throughput of the multi-process server from 1 to N workers.
+
+Starts `python -m backend.app.server` once per worker count against a dataset generated by
+backend.benchmarks.datagen, drives it over real HTTP with keep-alive connections from several client
+processes, and reports requests per second, the speedup over one worker and the scaling efficiency.
+Each server is stopped with SIGTERM, which also exercises the graceful drain.
+
+    python -m backend.benchmarks.scaling --scale tiny --workers 1,2,4 --duration 10
+    python -m backend.benchmarks.scaling --reuse --endpoint search --clients 32
+
+The load generator runs on the same machine: keep --clients well above the worker count, and read the
+numbers as relative (the client processes compete with the workers for the same CPUs).
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.parse
+from backend.benchmarks import datagen
+
+ENDPOINTS = {
+    "dashboard": lambda rnd: "/documents/me",
+    "search": lambda rnd: "/documents/search?" + urllib.parse.urlencode({"q": rnd.choice(datagen.WORDS)}),
+    "health": lambda rnd: "/",
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, workers: int, threads: int, database_url: str) -> subprocess.Popen:
+    env = dict(os.environ, DATABASE_URL=database_url, FAST_START="true", RATE_LIMIT_ENABLED="false",
+               RETENTION_SWEEP_INTERVAL_SECONDS="0", TIERING_INTERVAL_SECONDS="0", CHANGE_LOG_COMPACT_INTERVAL_SECONDS="0",
+               UPLOAD_CLEANUP_INTERVAL_SECONDS="0", PREVIEW_INTERVAL_SECONDS="0",
+               TRASH_PURGE_INTERVAL_SECONDS="0")
+    proc = subprocess.Popen([sys.executable, "-m", "backend.app.server", "--port", str(port), "--workers", str(workers),
+                             "--threads", str(threads), "--log-level", "warning"], env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/")
+            if conn.getresponse().status == 200:
+                conn.close()
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("server did not come up")
+
+
+def stop_server(proc: subprocess.Popen) -> float:
+    """SIGTERM and wait; returns the seconds the shutdown took."""
+    start = time.perf_counter()
+    proc.send_signal(signal.SIGTERM)
+    try:
+        proc.wait(timeout=90)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+    return time.perf_counter() - start
+
+
+def login(port: int, username: str) -> str:
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    body = urllib.parse.urlencode({"username": username, "password": datagen.BENCH_PASSWORD})
+    conn.request("POST", "/auth/login", body=body, headers={"Content-Type": "application/x-www-form-urlencoded"})
+    r = conn.getresponse()
+    data = json.loads(r.read())
+    conn.close()
+    if r.status != 200:
+        raise RuntimeError(f"login failed: {r.status} {data}")
+    return data["access_token"]
+
+
+def client(port: int, endpoint: str, tokens: list[str], seed: int, start_at: float, stop_at: float, out) -> None:
+    rnd = random.Random(seed)
+    path_for = ENDPOINTS[endpoint]
+    headers = {"Authorization": f"Bearer {tokens[seed % len(tokens)]}"}
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    ok = errors = 0
+    time.sleep(max(0.0, start_at - time.time()))
+    while time.time() < stop_at:
+        try:
+            conn.request("GET", path_for(rnd), headers=headers)
+            r = conn.getresponse()
+            r.read()
+            if r.status == 200:
+                ok += 1
+            else:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port)
+    conn.close()
+    out.put((ok, errors))
+
+
+def measure(port: int, args, tokens: list[str]) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    out = ctx.Queue()
+    # spawned clients need a moment to start; they all begin at the same wall-clock instant
+    start_at = time.time() + 2.0
+    stop_at = start_at + args.duration
+    procs = [ctx.Process(target=client, args=(port, args.endpoint, tokens, i, start_at, stop_at, out))
+             for i in range(args.clients)]
+    for p in procs:
+        p.start()
+    results = [out.get() for _ in procs]
+    for p in procs:
+        p.join()
+    ok = sum(r[0] for r in results)
+    return {"requests": ok, "errors": sum(r[1] for r in results), "rps": ok / args.duration}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    datagen.add_scale_arguments(p)
+    p.add_argument("--workers", help="comma separated worker counts (default: 1, 2, 4 ... up to the available CPUs)")
+    p.add_argument("--threads", type=int, default=40, help="threadpool size per worker")
+    p.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="dashboard")
+    p.add_argument("--clients", type=int, default=16, help="client processes, one keep-alive connection each")
+    p.add_argument("--logins", type=int, default=20, help="distinct users the clients authenticate as")
+    p.add_argument("--duration", type=float, default=10.0, help="seconds per worker count")
+    p.add_argument("--json", help="also write results to this file")
+    args = p.parse_args(sys.argv[1:] if argv is None else argv)
+    datagen.resolve_scale(args)
+
+    from backend.app.server import available_cpus
+
+    cpus = available_cpus()
+    if args.workers:
+        counts = [int(w) for w in args.workers.split(",")]
+    else:
+        counts = sorted({min(2 ** i, cpus) for i in range(cpus.bit_length() + 1)})
+    if not args.reuse:
+        engine = datagen.use_database(args.database_url)
+        counts_generated = datagen.generate(engine, args)
+        print("dataset: " + ", ".join(f"{k}={v}" for k, v in counts_generated.items()))
+        engine.dispose()
+
+    tokens = None
+    results = {}
+    for workers in counts:
+        port = free_port()
+        proc = start_server(port, workers, args.threads, args.database_url)
+        try:
+            if tokens is None:
+                users = random.Random(args.seed).sample(range(2, args.users + 1), min(args.logins, args.users - 1))
+                tokens = [login(port, f"user{u:07d}") for u in users]
+            r = measure(port, args, tokens)
+        finally:
+            r_shutdown = stop_server(proc)
+        r["shutdown_s"] = round(r_shutdown, 2)
+        results[workers] = r
+        print(f"workers={workers:<3d} {r['rps']:9.1f} req/s  errors={r['errors']}  shutdown={r['shutdown_s']}s", flush=True)
+
+    base = results[counts[0]]["rps"] / counts[0] if results[counts[0]]["rps"] else 0
+    print(f"\n{'workers':>8} {'req/s':>9} {'speedup':>8} {'efficiency':>10}   ({cpus} CPUs available)")
+    for workers, r in results.items():
+        speedup = r["rps"] / (base * counts[0]) if base else 0
+        r["speedup"] = round(speedup, 2)
+        r["efficiency"] = round(speedup * counts[0] / workers, 2)
+        print(f"{workers:8d} {r['rps']:9.1f} {speedup:8.2f} {r['efficiency']:10.0%}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"endpoint": args.endpoint, "clients": args.clients, "threads": args.threads, "cpus": cpus,
+                       "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
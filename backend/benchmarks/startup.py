@@ -0,0 +1,110 @@
+"""Measure application cold start: importing backend.app.main and running its startup hooks.
+
+Each sample is a fresh interpreter, like a new worker or pod. The import of backend.app.main is timed
+against an import-time budget, and modules that must stay deferred until first use (password hashing,
+profile reports, tracing SDK, optional storage and rate-limit backends, diffs, previews and the archive
+tool) must not be loaded by it. The budget is about twice the usual median: samples on a busy machine
+vary by a third, and the deferred list is what catches a heavy import creeping in. The
+lifespan startup is timed with and without FAST_START against a throwaway SQLite database (or
+--database-url). Exits non-zero when the budget is exceeded or a deferred module is imported, so CI
+can run it as a check:
+
+    python -m backend.benchmarks.startup
+    python -m backend.benchmarks.startup --samples 9 --budget-ms 800 --top 15
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", 2500))
+# Loaded on first use only; importing the app must not pull them in
+DEFERRED_MODULES = ("passlib", "pstats", "opentelemetry.sdk", "boto3", "redis", "PIL", "pypdfium2",
+                    "backend.app.diffs", "difflib", "backend.app.previews", "backend.app.archive")
+
+_PROBE = """
+import asyncio, json, sys, time
+t0 = time.perf_counter()
+import backend.app.main as main
+t1 = time.perf_counter()
+loaded = [m for m in {deferred!r} if m in sys.modules]
+
+async def startup():
+    async with main.app.router.lifespan_context(main.app):
+        return time.perf_counter()
+
+t2 = asyncio.run(startup())
+print(json.dumps({{"import_ms": (t1 - t0) * 1000, "startup_ms": (t2 - t1) * 1000, "deferred_loaded": loaded}}))
+"""
+
+
+def probe(database_url: str, fast_start: bool) -> dict:
+    env = dict(os.environ, DATABASE_URL=database_url, FAST_START="true" if fast_start else "false",
+               # keep background jobs out of the measurement
+               RETENTION_SWEEP_INTERVAL_SECONDS="0", TIERING_INTERVAL_SECONDS="0", CHANGE_LOG_COMPACT_INTERVAL_SECONDS="0",
+               UPLOAD_CLEANUP_INTERVAL_SECONDS="0", PREVIEW_INTERVAL_SECONDS="0",
+               TRASH_PURGE_INTERVAL_SECONDS="0")
+    code = _PROBE.format(deferred=DEFERRED_MODULES)
+    out = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def top_imports(database_url: str, n: int) -> list[tuple[str, float]]:
+    """Packages taking the most import time (sum of their modules' own ms) according to python -X importtime."""
+    env = dict(os.environ, DATABASE_URL=database_url)
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import backend.app.main"],
+                         env=env, capture_output=True, text=True, check=True)
+    totals = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, _, name = line[len("import time:"):].split("|")
+        if not own.strip().isdigit():
+            continue
+        name = name.strip()
+        package = ".".join(name.split(".")[:3]) if name.startswith("backend.") else name.split(".")[0]
+        totals[package] = totals.get(package, 0) + int(own) / 1000
+    return sorted(totals.items(), key=lambda kv: kv[1], reverse=True)[:n]
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--samples", type=int, default=5, help="fresh interpreters per measurement")
+    p.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS, help="median import time budget")
+    p.add_argument("--database-url", help="database for the startup hooks (default: a temporary SQLite file)")
+    p.add_argument("--top", type=int, default=10, help="list the N slowest imports (0 to skip)")
+    args = p.parse_args(sys.argv[1:] if argv is None else argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = args.database_url or f"sqlite:///{os.path.join(tmp, 'startup.sqlite')}"
+        # first run writes bytecode caches and creates the schema; not a cold start
+        probe(database_url, fast_start=False)
+        runs = {"full": [], "fast": []}
+        for _ in range(args.samples):
+            runs["full"].append(probe(database_url, fast_start=False))
+            runs["fast"].append(probe(database_url, fast_start=True))
+        top = top_imports(database_url, args.top) if args.top else []
+
+    imports = [r["import_ms"] for rs in runs.values() for r in rs]
+    import_ms = statistics.median(imports)
+    print(f"{'import backend.app.main':32} {import_ms:8.1f} ms  (min {min(imports):.1f}, max {max(imports):.1f})")
+    for mode, rs in runs.items():
+        print(f"{'startup hooks, ' + mode + ' start':32} {statistics.median(r['startup_ms'] for r in rs):8.1f} ms")
+    if top:
+        print("\nslowest imports (own time per package):")
+        for name, ms in top:
+            print(f"  {name:40} {ms:8.1f} ms")
+
+    loaded = sorted({m for rs in runs.values() for r in rs for m in r["deferred_loaded"]})
+    ok = import_ms <= args.budget_ms and not loaded
+    if loaded:
+        print(f"\ndeferred modules imported at startup: {', '.join(loaded)}")
+    print(f"\nimport {import_ms:.1f} ms: {'ok' if import_ms <= args.budget_ms else 'above'} budget of {args.budget_ms:.0f} ms")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
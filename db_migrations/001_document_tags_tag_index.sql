@@ -0,0 +1,3 @@
+-- Reverse-direction index on document_tags used by tag filters and tag facets in search.
+-- (document_id, tag_id) is already covered by the primary key.
+CREATE INDEX IF NOT EXISTS ix_document_tags_tag_document ON document_tags (tag_id, document_id);
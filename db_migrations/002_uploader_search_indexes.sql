@@ -0,0 +1,12 @@
+-- Indexes for the uploader filter of /documents/search.
+-- Any-version uploader match: EXISTS (document_versions WHERE uploader_id IN (...) AND document_id = d.document_id)
+CREATE INDEX IF NOT EXISTS ix_document_versions_uploader_document ON document_versions (uploader_id, document_id);
+
+-- uploader_name with uploader_match=contains: lower(...) LIKE '%x%' served by trigram GIN indexes
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS ix_users_username_trgm ON users USING gin (lower(username) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_users_full_name_trgm ON users USING gin
+    (lower(coalesce(first_name, '') || ' ' || coalesce(last_name, '')) gin_trgm_ops);
+
+-- uploader_name with uploader_match=prefix: lower(username) LIKE 'x%'
+CREATE INDEX IF NOT EXISTS ix_users_username_prefix ON users (lower(username) text_pattern_ops);
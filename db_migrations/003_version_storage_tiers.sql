@@ -0,0 +1,5 @@
+-- Storage tiers for version payloads (backend/app/storage.py).
+-- storage_tier 'cold' means file_data is NULL and the bytes live under storage_key in the cold store.
+ALTER TABLE document_versions ADD COLUMN IF NOT EXISTS storage_tier VARCHAR(8) NOT NULL DEFAULT 'hot';
+ALTER TABLE document_versions ADD COLUMN IF NOT EXISTS storage_key TEXT;
+ALTER TABLE document_versions ADD COLUMN IF NOT EXISTS last_accessed_at TIMESTAMP WITH TIME ZONE;
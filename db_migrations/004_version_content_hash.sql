@@ -0,0 +1,4 @@
+-- Content hashes for upload deduplication (backend/app/dedup.py); storage_tier may now also be 'linked'.
+-- Existing versions are hashed by `python -m backend.app.dedup backfill`.
+ALTER TABLE document_versions ADD COLUMN IF NOT EXISTS content_sha256 VARCHAR(64);
+CREATE INDEX IF NOT EXISTS ix_document_versions_content_sha256 ON document_versions (content_sha256);
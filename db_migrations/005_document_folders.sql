@@ -0,0 +1,4 @@
+-- Folders (backend/app/folders.py). The folders, folder_closure and folder_view_permissions tables are
+-- created by the app (or `python -m backend.app.database init`); run this afterwards on existing databases.
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS folder_id INTEGER REFERENCES folders (folder_id) ON DELETE SET NULL;
+CREATE INDEX IF NOT EXISTS ix_documents_folder_id ON documents (folder_id);
@@ -0,0 +1,8 @@
+-- Trash (backend/app/trash.py): documents and versions are soft-deleted first and purged later.
+-- deleted_at is set while a row is in the trash; only trashed rows are indexed.
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS deleted_by INTEGER REFERENCES users (user_id) ON DELETE SET NULL;
+ALTER TABLE document_versions ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE document_versions ADD COLUMN IF NOT EXISTS deleted_by INTEGER REFERENCES users (user_id) ON DELETE SET NULL;
+CREATE INDEX IF NOT EXISTS ix_documents_trashed ON documents (deleted_at) WHERE deleted_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS ix_document_versions_trashed ON document_versions (deleted_at) WHERE deleted_at IS NOT NULL;
@@ -14,6 +14,11 @@ async function postExpectJson(url){
   if(!res.ok){ const txt = await res.text().catch(()=> ''); throw new Error(txt || `request failed (${res.status})`); }
   try { return await res.json(); } catch { return null; }
 }
+async function postJsonBody(url, body){
+  const res = await apiFetch(url, { method:'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(body) });
+  if(!res.ok){ const txt = await res.text().catch(()=> ''); throw new Error(txt || `request failed (${res.status})`); }
+  return await res.json();
+}
 async function postReturnOk(url){ const res = await apiFetch(url, { method:'POST' }); return res?.ok ?? false; }
 async function delReturnOk(url){ const res = await apiFetch(url, { method:'DELETE' }); if(!res.ok){ const txt = await res.text().catch(()=> ''); throw new Error(txt || `delete failed (${res.status})`); } return true; }
 
@@ -44,12 +49,41 @@ export async function apiJson(url, options = {}, fallback = null) {
   }
 }
 
+// Change feed (Server-Sent Events, see backend/app/events.py). EventSource cannot send headers, and the bearer
+// token must not go in a URL, so the stream is opened with a short-lived ticket (POST /events/ticket). The browser
+// reconnects on its own while the ticket lasts; once a reconnect is refused, a new ticket is fetched.
+// 'ready' fires on every (re)connect.
+const FEED_EVENTS = ['document.created', 'document.updated', 'document.permissions', 'document.removed', 'tag.deleted'];
+export function openChangeFeed(onEvent, { onOpen, onResync, onError } = {}) {
+  if (!getToken() || typeof EventSource === 'undefined') return null;
+  let es = null, closed = false, delay = 1000;
+  const connect = async () => {
+    const ticket = (await apiJson(`${apiBase}/events/ticket`, { method: 'POST' }))?.ticket;
+    if (closed) return;
+    if (!ticket) { onError?.(); delay = Math.min(delay * 2, 60000); setTimeout(connect, delay); return; }
+    es = new EventSource(`${apiBase}/events/stream?ticket=${enc(ticket)}`);
+    FEED_EVENTS.forEach(type => es.addEventListener(type, ev => {
+      try { onEvent(type, JSON.parse(ev.data)); } catch (err) { console.error('change feed event error', err); }
+    }));
+    es.addEventListener('ready', () => { delay = 1000; onOpen?.(); });
+    es.addEventListener('resync', () => onResync?.());
+    es.onerror = () => {
+      onError?.();
+      if (es.readyState === EventSource.CLOSED && !closed) setTimeout(connect, delay);
+    };
+  };
+  connect();
+  return { close() { closed = true; es?.close(); } };
+}
+
 // Tag endpoints
 export async function fetchAllTags() { return await apiJson(`${apiBase}/tags/`, {}, []); }
 export async function fetchDocumentTags(documentId) { return await apiJson(`${apiBase}/tags/document/${encodeURIComponent(documentId)}`, {}, []); }
 export async function createTagOnServer(tagName) { return await postExpectJson(`${apiBase}/tags/?tag_name=${enc(tagName)}`); }
 export async function assignTagToDocument(documentId, tagId) { return await postReturnOk(`${apiBase}/tags/document/${enc(documentId)}/assign/${enc(tagId)}`); }
 export async function removeTagFromDocument(documentId, tagId) { return await postReturnOk(`${apiBase}/tags/document/${enc(documentId)}/remove/${enc(tagId)}`); }
+export async function batchAssignTags(documentIds, tagNames) { return await postJsonBody(`${apiBase}/tags/batch/assign`, { document_ids: documentIds, tag_names: tagNames }); }
+export async function batchRemoveTags(documentIds, tagNames) { return await postJsonBody(`${apiBase}/tags/batch/remove`, { document_ids: documentIds, tag_names: tagNames }); }
 
 // Permissions & departments
 // View (department) permissions endpoints (renamed paths)
@@ -62,6 +96,11 @@ export async function fetchEditPermissions(documentId) { return await apiJson(`$
 export async function grantEditPermission(documentId, { user_id = null } = {}) { if(!user_id) throw new Error('missing user_id'); return await postExpectJson(`${apiBase}/permissions/edit/grant?doc_id=${enc(documentId)}&user_id=${enc(user_id)}`); }
 export async function revokeEditPermission(documentId, { user_id = null } = {}) { if(!user_id) throw new Error('missing user_id'); return await postReturnOk(`${apiBase}/permissions/edit/revoke?doc_id=${enc(documentId)}&user_id=${enc(user_id)}`); }
 export async function fetchEligibleEditUsers(documentId){ return await apiJson(`${apiBase}/permissions/edit/eligible/${encodeURIComponent(documentId)}`, {}, []); }
+// Batch permissions: body { document_ids, department_ids | user_ids }, returns { applied, results[] }
+export async function batchGrantViewPermissions(documentIds, departmentIds) { return await postJsonBody(`${apiBase}/permissions/view/batch/grant`, { document_ids: documentIds, department_ids: departmentIds }); }
+export async function batchRevokeViewPermissions(documentIds, departmentIds) { return await postJsonBody(`${apiBase}/permissions/view/batch/revoke`, { document_ids: documentIds, department_ids: departmentIds }); }
+export async function batchGrantEditPermissions(documentIds, userIds) { return await postJsonBody(`${apiBase}/permissions/edit/batch/grant`, { document_ids: documentIds, user_ids: userIds }); }
+export async function batchRevokeEditPermissions(documentIds, userIds) { return await postJsonBody(`${apiBase}/permissions/edit/batch/revoke`, { document_ids: documentIds, user_ids: userIds }); }
 export async function fetchDepartments() { try { return await apiJson(`${apiBase}/permissions/departments/`, {}, []); } catch (err) { console.error('fetchDepartments error', err); return []; } }
 
 // Documents
@@ -113,12 +152,63 @@ export async function fetchAccessibleDocsRaw() {
   return await apiFetch(`${apiBase}/documents/me`);
 }
 export async function fetchVersions(documentId) { return await apiJson(`${apiBase}/documents/${encodeURIComponent(documentId)}/versions`, {}, []); }
+// Previews (see backend/app/previews.py); the thumbnail comes back as an object URL, or null if there is none
+export async function fetchVersionPreview(versionId) { return await apiJson(`${apiBase}/documents/versions/${enc(versionId)}/preview`, {}, null); }
+export async function fetchVersionThumbnail(versionId) { const res = await apiFetch(`${apiBase}/documents/versions/${enc(versionId)}/thumbnail`); return res?.ok ? URL.createObjectURL(await res.blob()) : null; }
 export async function updateDocumentVersion(documentId, formData) { return await apiFetch(`${apiBase}/documents/${enc(documentId)}/update`, { method: 'POST', body: formData }); }
 export async function uploadDocumentFile(fd) { return await apiFetch(`${apiBase}/documents/upload`, { method: 'POST', body: fd }); }
+
+// Resumable upload (see backend/app/uploads.py) for files above RESUMABLE_UPLOAD_BYTES: chunks go up in parallel with
+// their SHA-256 and failed ones are retried; the session id is kept in localStorage so a reload resumes it.
+// Returns the finalize Response, like uploadDocumentFile.
+export const RESUMABLE_UPLOAD_BYTES = 16 * 1024 * 1024;
+const toHex = (buf) => Array.from(new Uint8Array(buf), b => b.toString(16).padStart(2, '0')).join('');
+export async function uploadDocumentResumable(file, { title, isPublic, parallel = 3, onProgress } = {}) {
+  const key = `upload:${file.name}:${file.size}:${file.lastModified}:${title || ''}`;
+  let session = null;
+  const saved = localStorage.getItem(key);
+  if (saved) {
+    const res = await apiFetch(`${apiBase}/uploads/${enc(saved)}`);
+    if (res.ok) session = await res.json();
+  }
+  if (!session) {
+    session = await postJsonBody(`${apiBase}/uploads/`, { file_name: file.name, size: file.size, title: title || null, is_public: isPublic });
+    localStorage.setItem(key, session.upload_id);
+  }
+  const queue = [...session.missing_offsets];
+  let done = session.received_bytes;
+  onProgress?.(done, file.size);
+  async function sendChunk(offset) {
+    const body = await file.slice(offset, offset + session.chunk_size).arrayBuffer();
+    const digest = toHex(await crypto.subtle.digest('SHA-256', body));
+    for (let attempt = 0; ; attempt++) {
+      try {
+        const res = await apiFetch(`${apiBase}/uploads/${enc(session.upload_id)}?offset=${offset}`, {
+          method: 'PATCH', headers: { 'Content-Type': 'application/octet-stream', 'X-Chunk-SHA256': digest }, body });
+        if (res.ok) break;
+        if (res.status !== 429 && res.status < 500) throw new Error((await res.text().catch(() => '')) || `chunk failed (${res.status})`);
+      } catch (err) {
+        if (attempt >= 4 || !(err instanceof TypeError)) throw err; // TypeError: network error, worth retrying
+      }
+      if (attempt >= 4) throw new Error(`chunk at ${offset} failed`);
+      await new Promise(r => setTimeout(r, 500 * 2 ** attempt));
+    }
+    done += body.byteLength;
+    onProgress?.(done, file.size);
+  }
+  async function worker() { while (queue.length) await sendChunk(queue.shift()); }
+  await Promise.all(Array.from({ length: Math.min(parallel, queue.length) }, worker));
+  const res = await apiFetch(`${apiBase}/uploads/${enc(session.upload_id)}/finalize`, { method: 'POST' });
+  if (res.ok || res.status === 404) localStorage.removeItem(key);
+  return res;
+}
 export async function searchDocuments(params) { return await apiFetch(`${apiBase}/documents/search?${params.toString()}`); }
 
 
 export async function toggleDocumentPublicity(documentId) { return await postExpectJson(`${apiBase}/documents/publicity/${enc(documentId)}/toggle`); }
+export async function trashDocument(documentId) { return await delReturnOk(`${apiBase}/documents/${enc(documentId)}`); }
+export async function restoreDocument(documentId) { return await postExpectJson(`${apiBase}/documents/${enc(documentId)}/restore`); }
+export async function fetchTrash() { return await apiJson(`${apiBase}/documents/trash`, {}, { documents: [], versions: [] }); }
 
 // ---------------- Admin endpoints ----------------
 // Users
@@ -1,9 +1,12 @@
 import { fetchProfile, renderProfile } from './profile.js';
 import { setupDocuments } from './documents.js';
 import { setupDetails } from './details.js';
-import { uploadDocumentFile } from './api.js';
+import { uploadDocumentFile, uploadDocumentResumable, RESUMABLE_UPLOAD_BYTES, openChangeFeed } from './api.js';
 
 let docs; let details; // populated after DOMContentLoaded
+// While the change feed is connected it delivers our own changes too, so lists are not re-fetched after edits
+let feedLive = false;
+const refreshDocuments = async () => { if (!feedLive) await docs.fetchAccessibleDocuments(); };
 
 // Logout binding function
 (() => {
@@ -30,6 +33,14 @@ btnClose?.addEventListener('click', closeUpload);
 btnCancel?.addEventListener('click', closeUpload);
 umEl?.addEventListener('click', e => { if(e.target === umEl) closeUpload(); });
 
+// headers set by backend/app/dedup.py when the uploaded content already exists
+function duplicateNotice(res){
+  const dedup=res.headers.get('X-Upload-Deduplicated'); const dupOf=res.headers.get('X-Duplicate-Of');
+  if(dedup==='skipped') return 'This file is identical to the latest version; no new version was stored.';
+  if(dupOf) return `This file's content already exists (version ${dupOf})${dedup==='linked'?'; it was stored as a link to the existing copy':''}.`;
+  return null;
+}
+
 async function handleUpload(form){
   const fileInput=document.getElementById('uploadFile');
   const titleInput=document.getElementById('uploadTitle');
@@ -39,19 +50,30 @@ async function handleUpload(form){
   const fd=new FormData(); fd.append('file', fileInput.files[0]);
   if(titleInput && titleInput.value) fd.append('title', titleInput.value);
   if(publicInput && publicInput.checked) fd.append('is_public','true');
-  try { const res=await uploadDocumentFile(fd); let txt=''; try{ txt=await res.text(); }catch{} let data=null; try{ data=txt?JSON.parse(txt):null; }catch{} if(!res.ok){ if(statusEl) statusEl.textContent=data?.detail||`Upload failed (${res.status})`; return false; } if(statusEl) statusEl.textContent='Upload succeeded'; form.reset(); return true; } catch(err){ console.error('upload error',err); if(statusEl){ statusEl.style.display=''; statusEl.textContent='Network error during upload'; } return false; }
+  const file=fileInput.files[0];
+  const progress=(sent,total)=>{ if(statusEl){ statusEl.style.display=''; statusEl.textContent=`Uploading… ${Math.floor(sent*100/total)}%`; } };
+  try { const res=file.size>RESUMABLE_UPLOAD_BYTES
+      ? await uploadDocumentResumable(file, { title: titleInput?.value, isPublic: publicInput?.checked ? true : undefined, onProgress: progress })
+      : await uploadDocumentFile(fd); let txt=''; try{ txt=await res.text(); }catch{} let data=null; try{ data=txt?JSON.parse(txt):null; }catch{} if(!res.ok){ if(statusEl) statusEl.textContent=data?.detail||`Upload failed (${res.status})`; return false; } if(statusEl) statusEl.textContent='Upload succeeded'; const dupNote=duplicateNotice(res); if(dupNote) alert(dupNote); form.reset(); return true; } catch(err){ console.error('upload error',err); if(statusEl){ statusEl.style.display=''; statusEl.textContent='Network error during upload'; } return false; }
 }
 
-document.getElementById('uploadForm')?.addEventListener('submit', async ev => { ev.preventDefault(); const ok=await handleUpload(ev.currentTarget); if(ok){ await docs.fetchAccessibleDocuments(); closeUpload(); } });
+document.getElementById('uploadForm')?.addEventListener('submit', async ev => { ev.preventDefault(); const ok=await handleUpload(ev.currentTarget); if(ok){ await refreshDocuments(); closeUpload(); } });
 
 async function init() {
   docs = setupDocuments(() => details.openDetailsModalFor);
-  details = setupDetails(async () => { await docs.fetchAccessibleDocuments(); });
+  details = setupDetails(refreshDocuments);
   const profile = await fetchProfile();
   if (!profile) return; // still allow logout due to early wiring
   const rendered = renderProfile(profile);
   if (!rendered) return; // account pending assignment; logout still works
   await docs.fetchAccessibleDocuments();
+  // no replay on reconnect: changes made while disconnected are picked up by one re-fetch
+  let connectedOnce = false;
+  openChangeFeed((type, data) => docs.applyChange(type, data), {
+    onOpen: async () => { feedLive = true; if (connectedOnce) await docs.fetchAccessibleDocuments(); connectedOnce = true; },
+    onResync: async () => { feedLive = false; await docs.fetchAccessibleDocuments(); },
+    onError: () => { feedLive = false; },
+  });
 }
 
 if (document.readyState === 'loading') {
@@ -1,5 +1,5 @@
 // manages details modal (versions, tags, permissions)
-import { apiBase, fetchAllTags, fetchDocumentTags, fetchViewPermissions, grantViewPermission, revokeViewPermission, fetchDepartments, fetchDocument, fetchVersions, updateDocumentVersion, assignTagToDocument, removeTagFromDocument, createTagOnServer, toggleDocumentPublicity, fetchEditPermissions, grantEditPermission, revokeEditPermission, fetchDocumentCapabilities, fetchEligibleEditUsers } from './api.js';
+import { apiBase, fetchAllTags, fetchDocumentTags, fetchViewPermissions, grantViewPermission, revokeViewPermission, fetchDepartments, fetchDocument, fetchVersions, updateDocumentVersion, assignTagToDocument, removeTagFromDocument, createTagOnServer, toggleDocumentPublicity, trashDocument, fetchEditPermissions, grantEditPermission, revokeEditPermission, fetchDocumentCapabilities, fetchEligibleEditUsers, fetchVersionPreview, fetchVersionThumbnail } from './api.js';
 import { escapeHtml, formatBytes, handleFileRequest, normDeptIdFromDept, normDeptIdFromPerm } from './utils.js';
 
 const detailsModal = document.getElementById('detailsModal');
@@ -31,6 +31,7 @@ function renderVersionEntries(versions, documentId) {
       <div style="font-weight:600">${title} <span style="color:#666;font-weight:400">(#${verNum})</span></div>
       <div style="font-size:0.8rem;color:#555;margin-top:4px">File: ${fname || '—'} • ${size}</div>
       <div style="font-size:0.9rem;color:#666;margin-top:4px">Uploader: ${uploader} • ${uploaded}</div>
+      <div class="version-preview" data-id="${verId}" style="display:flex;gap:10px;align-items:flex-start;margin-top:6px"></div>
       <div style="margin-top:8px">
         <button class="btn" data-action="vview" data-id="${verId}" data-fname="${fname}">View</button>
         <button class="btn secondary" data-action="vdownload" data-id="${verId}" data-fname="${fname}">Download</button>
@@ -39,6 +40,18 @@ function renderVersionEntries(versions, documentId) {
   }, '');
 }
 
+// fills the preview slot of each rendered version once its preview has been generated
+async function loadPreviews(root) {
+  root?.querySelectorAll('.version-preview[data-id]')?.forEach(async el => {
+    const preview = await fetchVersionPreview(el.getAttribute('data-id'));
+    if (!preview || preview.status !== 'ready') return;
+    let html = '';
+    if (preview.has_thumbnail) { const src = await fetchVersionThumbnail(preview.version_id); if (src) html += `<img src="${src}" alt="" style="max-width:96px;max-height:96px;border:1px solid #eee;border-radius:4px">`; }
+    if (preview.snippet) html += `<div style="font-size:0.8rem;color:#777;max-height:4.5em;overflow:hidden">${escapeHtml(preview.snippet)}</div>`;
+    el.innerHTML = html;
+  });
+}
+
 export function setupDetails(refreshDocuments) {
   async function openDetailsModalFor(documentId) {
     if (!versionsListEl) return; versionsListEl.innerHTML = '<div style="padding:12px;color:#666">Loading versions…</div>'; openDetailsModal();
@@ -106,7 +119,7 @@ export function setupDetails(refreshDocuments) {
             <div style="font-weight:600;margin-bottom:6px">Publicity</div>
             <div id="publicityStatus" style="color:#666">${docDetail && docDetail.is_public ? 'Public' : 'Private'}</div>
           </div>
-          ${canEdit ? `<div><button id="btnTogglePublicity" class="btn primary">${docDetail && docDetail.is_public ? 'Make Private' : 'Make Public'}</button></div>`: ''}
+          ${canEdit ? `<div><button id="btnTogglePublicity" class="btn primary">${docDetail && docDetail.is_public ? 'Make Private' : 'Make Public'}</button> <button id="btnTrashDocument" class="btn secondary">Move to trash</button></div>`: ''}
         </div>`;
 
       if (!canEdit) {
@@ -190,11 +203,12 @@ export function setupDetails(refreshDocuments) {
       html += `<div id="versionsInner">${renderVersionEntries(versions, documentId)}</div>`;
 
       versionsListEl.innerHTML = html;
+      loadPreviews(qs('#versionsInner'));
       if (!canEdit) {
         // Defensive: remove any stray edit-only nodes if old HTML cached
         [ '#btnCreateAssignTag', '#vpDeptSelect', '#btnGrantView', '#epUserIdInput', '#btnGrantEdit', '#addVersionForm', '#btnAddVersion' ].forEach(sel => { const el = qs(sel); if (el) el.remove(); });
       }
-      const updateVersionsInner = (updated) => setHTML(qs('#versionsInner'), renderVersionEntries(updated, documentId));
+      const updateVersionsInner = (updated) => { setHTML(qs('#versionsInner'), renderVersionEntries(updated, documentId)); loadPreviews(qs('#versionsInner')); };
 
     const vpSelect = qs('#vpDeptSelect');
     const publicityEl = qs('#publicityStatus');
@@ -236,6 +250,21 @@ export function setupDetails(refreshDocuments) {
           } finally { publicityBtn.disabled = false; }
         });
       }
+      const trashBtn = qs('#btnTrashDocument');
+      if (trashBtn) {
+        trashBtn.addEventListener('click', async () => {
+          if (!confirm('Move this document to the trash? It can be restored until it is purged.')) return;
+          try {
+            trashBtn.disabled = true;
+            await trashDocument(documentId);
+            closeDetailsModal();
+            await refreshDocuments();
+          } catch (e) {
+            alert('Could not delete document: ' + (e.message || 'error'));
+            trashBtn.disabled = false;
+          }
+        });
+      }
       function populateDeptSelect(departmentsList, currentViewPerms, ownerDeptStr) {
         if (!vpSelect) return;
         vpSelect.innerHTML = '<option value="">Select department…</option>';
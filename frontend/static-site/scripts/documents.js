@@ -6,6 +6,9 @@ const resultsEl = document.getElementById('results');
 const btnSearch = document.getElementById('btnSearch');
 
 export function setupDocuments(getOpenDetailsModalFor) {
+  // last full list rendered (change feed deltas are applied to it); null while search results are shown
+  let currentDocs = null;
+
   async function fetchAccessibleDocuments() {
     try {
       const res = await fetchAccessibleDocsRaw();
@@ -20,6 +23,7 @@ export function setupDocuments(getOpenDetailsModalFor) {
   if (Array.isArray(payload)) docs = payload;
   else if (payload && Array.isArray(payload.documents)) docs = payload.documents;
   if (Array.isArray(docs)) docs.sort((a,b)=> (a.document_id||0) - (b.document_id||0));
+  currentDocs = docs;
   await renderDocuments(docs);
     } catch (err) {
       console.error('network error fetching accessible documents', err);
@@ -99,6 +103,7 @@ export function setupDocuments(getOpenDetailsModalFor) {
       }
   let docs = await res.json();
   if (Array.isArray(docs)) docs.sort((a,b)=> (a.document_id||0) - (b.document_id||0));
+  currentDocs = null;
   await renderDocuments(docs);
     } catch (err) {
       console.error('network error during search', err);
@@ -106,6 +111,24 @@ export function setupDocuments(getOpenDetailsModalFor) {
     }
   }
 
+  // Apply one change feed event to the rendered list instead of re-fetching it
+  async function applyChange(type, data) {
+    if (!currentDocs) return; // search results are not kept in sync; the next listing is fresh
+    const id = String(data?.document_id ?? '');
+    if (type === 'tag.deleted') {
+      currentDocs.forEach(d => { if (Array.isArray(d.tags)) d.tags = d.tags.filter(t => String(t.tag_id) !== String(data.tag_id)); });
+    } else if (type === 'document.removed') {
+      currentDocs = currentDocs.filter(d => String(d.document_id) !== id);
+    } else if (data?.document) {
+      const idx = currentDocs.findIndex(d => String(d.document_id) === id);
+      if (idx >= 0) currentDocs[idx] = data.document; else currentDocs.push(data.document);
+      currentDocs.sort((a,b)=> (a.document_id||0) - (b.document_id||0));
+    } else {
+      return;
+    }
+    await renderDocuments(currentDocs);
+  }
+
   // wire search button once here (module scope)
   btnSearch?.addEventListener('click', async () => {
     const q = document.getElementById('q')?.value ?? '';
@@ -115,5 +138,5 @@ export function setupDocuments(getOpenDetailsModalFor) {
     await fetchSearchDocuments({ title: q, tags, uploader });
   });
 
-  return { fetchAccessibleDocuments, fetchSearchDocuments, renderDocuments };
+  return { fetchAccessibleDocuments, fetchSearchDocuments, renderDocuments, applyChange };
 }